@@ -1,19 +1,123 @@
+import html
+import os
+import time
+
 import streamlit as st
 
+from browse_index import data_version, file_digest, open_browse_index, rows_by_source, search, snippet
 from local_loader import list_txt_files
 
+PAGE_SIZE = 10
+MAX_RESULTS = 20
+
 st.title("Explorar archivos de datos")
 
-paths = list(list_txt_files())
 
-file_path = st.selectbox("Selecciona un archivo para visualizar", paths, index=None)
+# --------------------------------------------------------------
+# ÍNDICE Y CACHÉS (por hash de archivo)
+# --------------------------------------------------------------
+
+@st.cache_data(max_entries=512)
+def cached_digest(path, mtime_ns, size):
+    # Solo se vuelve a leer el archivo si cambia su fecha o su tamaño
+    return file_digest(path)
+
+
+def current_digests():
+    digests = {}
+    for path in list_txt_files():
+        stat = os.stat(path)
+        digests[path] = cached_digest(path, stat.st_mtime_ns, stat.st_size)
+    return digests
+
+
+@st.cache_resource(max_entries=2, show_spinner="Indexando archivos…")
+def get_index(version):
+    index = open_browse_index(version=version)
+    return index, rows_by_source(index)
+
+
+@st.cache_data(max_entries=256)
+def render_chunks(version, digest, page, _index, _rows):
+    """
+    Chunks de una página de un archivo ya renderizados. La clave lleva la
+    versión del índice: los metadatos (categoría, duplicados) pueden cambiar
+    por otros archivos aunque este no cambie.
+    """
+    rendered = []
+    for row in _rows:
+        doc = _index.document(row)
+        body = f'<div style="white-space: pre-wrap">{html.escape(doc.page_content)}</div>'
+        rendered.append((doc.metadata, body))
+    return rendered
+
+
+def metadata_line(metadata):
+    line = f"`{metadata.get('chunk_id', '')}` · {metadata.get('category', 'sin categoría')}"
+    if metadata.get("duplicates"):
+        line += f" · sustituye a {metadata['duplicates']} casi duplicado(s)"
+    return line
+
+
+digests = current_digests()
+if not digests:
+    st.info("No hay archivos .txt en data/.")
+    st.stop()
+
+version = data_version(digests)
+index, sources = get_index(version)
+paths = sorted(digests)
+
+
+# --------------------------------------------------------------
+# BÚSQUEDA LÉXICA
+# --------------------------------------------------------------
+
+tab_search, tab_browse = st.tabs(["Buscar", "Chunks por archivo"])
+
+with tab_search:
+    query = st.text_input("Buscar en los chunks indexados", placeholder="p. ej. autoeficacia jóvenes")
+    col1, col2 = st.columns(2)
+    category = col1.selectbox("Categoría", ["Todas"] + index.categories)
+    source = col2.selectbox("Archivo", ["Todos"] + paths, format_func=os.path.basename)
+
+    if query.strip():
+        started = time.perf_counter()
+        results = search(
+            index, query,
+            category=None if category == "Todas" else category,
+            rows=None if source == "Todos" else sources.get(source, []),
+            k=MAX_RESULTS,
+        )
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        st.caption(f"{len(results)} resultados en {elapsed_ms:.1f} ms · "
+                   "misma tokenización que el BM25 del retriever (distingue mayúsculas)")
+
+        for row, score in results:
+            doc = index.document(row)
+            st.markdown(f"**{os.path.basename(str(doc.metadata.get('source', '')))}** · "
+                        f"{metadata_line(doc.metadata)} · BM25 {score:.2f}")
+            st.markdown(snippet(doc.page_content, query), unsafe_allow_html=True)
+
+
+# --------------------------------------------------------------
+# CHUNKS POR ARCHIVO (paginados)
+# --------------------------------------------------------------
+
+with tab_browse:
+    file_path = st.selectbox("Selecciona un archivo", paths, index=None, format_func=os.path.basename)
 
-if file_path:
-    st.subheader(f"Contenido de: {file_path}")
+    if file_path:
+        rows = sources.get(file_path, [])
+        pages = max(1, (len(rows) + PAGE_SIZE - 1) // PAGE_SIZE)
+        page = st.number_input("Página", min_value=1, max_value=pages, value=1) if pages > 1 else 1
+        first = (page - 1) * PAGE_SIZE
+        page_rows = rows[first:first + PAGE_SIZE]
+        st.caption(f"Chunks {first + 1}–{first + len(page_rows)} de {len(rows)}" if rows else
+                   "Este archivo no tiene chunks indexados.")
 
-    try:
-        with open(file_path, "r", encoding="utf-8") as f:
-            content = f.read()
-            st.markdown(content)
-    except Exception as e:
-        st.error(f"No se pudo leer el archivo: {e}")
+        for metadata, body in render_chunks(version, digests[file_path], page, index, page_rows):
+            st.markdown(metadata_line(metadata))
+            st.markdown(body, unsafe_allow_html=True)
+            with st.expander("Metadatos"):
+                st.json(metadata)
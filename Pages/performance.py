@@ -0,0 +1,61 @@
+import streamlit as st
+
+from tracing import TRACER
+
+st.title("Rendimiento por etapa")
+
+# Orden de las etapas dentro de un turno
+STAGE_ORDER = [
+    "load", "split", "dedup", "index", "intent", "memory", "retriever", "cache", "embed_query",
+    "dense", "sparse", "bm25", "rerank", "reorder", "context", "prompt", "llm", "hedge", "record", "total",
+]
+
+
+def stage_rank(stage):
+    # Las etapas desconocidas van justo antes del total
+    return STAGE_ORDER.index(stage) if stage in STAGE_ORDER else len(STAGE_ORDER) - 1.5
+
+
+kind = st.radio("Trazas", ["turn", "index"], horizontal=True,
+                format_func=lambda k: "Turnos" if k == "turn" else "Indexado")
+traces = TRACER.traces(kind)
+
+if not traces:
+    st.info("Todavía no hay trazas. Haz alguna pregunta en el chat y vuelve a esta página.")
+    st.stop()
+
+last = 1
+if len(traces) > 1:
+    last = st.slider("Últimas N trazas", min_value=1, max_value=len(traces), value=min(len(traces), 200))
+stats = TRACER.stage_stats(kind, last=last)
+
+rows = [
+    {"etapa": stage, "n": s["count"], "p50 (ms)": s["p50_ms"], "p95 (ms)": s["p95_ms"], "media (ms)": s["mean_ms"]}
+    for stage, s in sorted(stats.items(), key=lambda kv: stage_rank(kv[0]))
+]
+st.subheader("Latencia p50 / p95")
+st.dataframe(rows, hide_index=True, use_container_width=True)
+
+recent = traces[-last:]
+st.subheader("Tokens y caché")
+col1, col2, col3, col4 = st.columns(4)
+col1.metric("Tokens de entrada", sum(t["prompt_tokens"] for t in recent))
+col2.metric("Tokens de salida", sum(t["completion_tokens"] for t in recent))
+hits = sum(t["cache_hits"] for t in recent)
+lookups = hits + sum(t["cache_misses"] for t in recent)
+col3.metric("Aciertos de caché", f"{hits}/{lookups}")
+col4.metric("Respuestas degradadas", sum(bool(t.get("slo", {}).get("degraded")) for t in recent))
+
+st.subheader("Últimas trazas")
+for t in reversed(recent[-10:]):
+    label = f"{t['name']} · {t['duration_ms']} ms"
+    if t.get("goal"):
+        label += f" · {t['goal']}"
+    with st.expander(label):
+        st.json(t)
+
+col1, col2 = st.columns(2)
+col1.download_button("Descargar JSONL", TRACER.export_jsonl(), file_name="traces.jsonl", mime="application/jsonl")
+if col2.button("Vaciar trazas"):
+    TRACER.clear()
+    st.rerun()
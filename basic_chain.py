@@ -1,10 +1,11 @@
+import hashlib
 import os
+import threading
+
+import httpx
 
 from langchain_core.output_parsers import StrOutputParser
 from langchain_core.prompts import ChatPromptTemplate
-from langchain_openai import ChatOpenAI
-from langchain_community.llms import HuggingFaceHub
-from langchain_community.chat_models.huggingface import ChatHuggingFace
 
 from dotenv import load_dotenv
 
@@ -12,39 +13,132 @@ from dotenv import load_dotenv
 MISTRAL_ID = "mistralai/Mistral-7B-Instruct-v0.1"
 ZEPHYR_ID = "HuggingFaceH4/zephyr-7b-beta"
 
+OPENAI_MODEL = "gpt-4o-mini"
+OPENAI_PARAMS = {"temperature": 0}
+HF_MODEL_KWARGS = {
+    "max_new_tokens": 512,
+    "top_k": 30,
+    "temperature": 0.1,
+    "repetition_penalty": 1.03,
+}
+
+
+# ============================================================
+# POOL DE CLIENTES HTTP Y MODELOS
+# ============================================================
+#
+# Los modelos se cachean por (proveedor, modelo, parámetros, huella de la
+# credencial) y todos los ChatOpenAI comparten un cliente HTTP con
+# conexiones keep-alive, así cada turno reutiliza la conexión TLS.
+
+HTTP_LIMITS = httpx.Limits(max_connections=100, max_keepalive_connections=20, keepalive_expiry=60)
+HTTP_TIMEOUT = httpx.Timeout(60.0, connect=10.0)
+
+_models = {}
+_models_lock = threading.Lock()
+_pool_stats = {"hits": 0, "misses": 0}
+_http_client = None
+
+
+def get_http_client():
+    """Cliente HTTP compartido (síncrono) con pool de conexiones keep-alive."""
+    global _http_client
+    with _models_lock:
+        if _http_client is None:
+            _http_client = httpx.Client(limits=HTTP_LIMITS, timeout=HTTP_TIMEOUT)
+        return _http_client
+
+
+def credential_fingerprint(secret):
+    """Huella de la credencial: distingue claves sin guardarlas en la clave de caché."""
+    if not secret:
+        return None
+    return hashlib.sha256(secret.encode("utf-8")).hexdigest()[:12]
+
+
+def get_model_pool_stats():
+    with _models_lock:
+        stats = dict(_pool_stats, models=len(_models))
+
+    pool = getattr(getattr(_http_client, "_transport", None), "_pool", None)
+    stats["http"] = {
+        "max_connections": HTTP_LIMITS.max_connections,
+        "max_keepalive_connections": HTTP_LIMITS.max_keepalive_connections,
+        "open_connections": len(pool.connections) if pool is not None else 0,
+    }
+    return stats
+
+
+def clear_model_pool():
+    global _http_client
+    with _models_lock:
+        _models.clear()
+        if _http_client is not None:
+            _http_client.close()
+            _http_client = None
+
 
 # ============================================================
 # MODELO BASE
 # ============================================================
 
-def get_model(repo_id="ChatGPT", **kwargs):
+def _build_model(repo_id, openai_api_key=None, huggingfacehub_api_token=None):
+    # Los proveedores se importan aquí: langchain_openai tarda más de un
+    # segundo en cargar y no debe retrasar el primer render de la app
     if repo_id == "ChatGPT":
-        chat_model = ChatOpenAI(
-            temperature=0,
-            model="gpt-4o-mini",
-            openai_api_key=kwargs.get("openai_api_key"),
+        from langchain_openai import ChatOpenAI
+        return ChatOpenAI(
+            model=OPENAI_MODEL,
+            openai_api_key=openai_api_key,
+            http_client=get_http_client(),
+            **OPENAI_PARAMS,
         )
+
+    from langchain_community.llms import HuggingFaceHub
+    from langchain_community.chat_models.huggingface import ChatHuggingFace
+
+    if huggingfacehub_api_token:
+        os.environ["HF_TOKEN"] = huggingfacehub_api_token
+
+    llm = HuggingFaceHub(
+        repo_id=repo_id,
+        task="text-generation",
+        model_kwargs={
+            **HF_MODEL_KWARGS,
+            "huggingfacehub_api_token": huggingfacehub_api_token,
+        }
+    )
+    return ChatHuggingFace(llm=llm)
+
+
+def get_model(repo_id="ChatGPT", **kwargs):
+    """
+    Devuelve un modelo de chat reutilizable: solo se construye la primera vez
+    para cada combinación de proveedor, modelo y credencial.
+    """
+    if repo_id == "ChatGPT":
+        secret = kwargs.get("openai_api_key") or os.environ.get("OPENAI_API_KEY")
+        key = ("openai", OPENAI_MODEL, tuple(sorted(OPENAI_PARAMS.items())), credential_fingerprint(secret))
+        build_kwargs = {"openai_api_key": kwargs.get("openai_api_key")}
     else:
         huggingfacehub_api_token = kwargs.get("HUGGINGFACEHUB_API_TOKEN", None)
         if not huggingfacehub_api_token:
             huggingfacehub_api_token = os.environ.get("HUGGINGFACEHUB_API_TOKEN", None)
+        key = ("huggingface", repo_id, tuple(sorted(HF_MODEL_KWARGS.items())),
+               credential_fingerprint(huggingfacehub_api_token))
+        build_kwargs = {"huggingfacehub_api_token": huggingfacehub_api_token}
 
-        os.environ["HF_TOKEN"] = huggingfacehub_api_token
+    with _models_lock:
+        chat_model = _models.get(key)
+        if chat_model is not None:
+            _pool_stats["hits"] += 1
+            return chat_model
 
-        llm = HuggingFaceHub(
-            repo_id=repo_id,
-            task="text-generation",
-            model_kwargs={
-                "max_new_tokens": 512,
-                "top_k": 30,
-                "temperature": 0.1,
-                "repetition_penalty": 1.03,
-                "huggingfacehub_api_token": huggingfacehub_api_token,
-            }
-        )
-        chat_model = ChatHuggingFace(llm=llm)
+    chat_model = _build_model(repo_id, **build_kwargs)
 
-    return chat_model
+    with _models_lock:
+        _pool_stats["misses"] += 1
+        return _models.setdefault(key, chat_model)
 
 
 # ============================================================
@@ -0,0 +1,260 @@
+import argparse
+import asyncio
+import csv
+import json
+import os
+import re
+import time
+from contextlib import nullcontext
+
+from dotenv import load_dotenv
+
+import basic_chain
+import ensemble
+import filter as hybrid_filter
+from intent import detect_goal
+from local_loader import load_txt_files
+from rag_chain import make_rag_chain
+from retrieval_cache import RetrievalCache, normalize_query
+from splitter import split_documents
+
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_GOAL = "generar_mensaje"
+DEFAULT_QUESTION = "Haz un mensaje personalizado para esta persona, adaptado a su perfil y al objetivo indicado."
+
+
+# ============================================================
+# ENTRADA Y CHECKPOINT
+# ============================================================
+
+def read_rows(path):
+    """
+    Lee el CSV de sujetos. Columnas reconocidas:
+    - subject (obligatoria): descripción de la persona o segmento
+    - id: identificador estable de la fila (por defecto, "row-<n>")
+    - profile / segment: perfil comportamental o segmento conocido
+    - goal: objetivo comunicacional (por defecto, el detectado o "generar_mensaje")
+    - question: petición concreta (por defecto, un mensaje personalizado)
+    """
+    with open(path, "r", encoding="utf-8-sig", newline="") as f:
+        for n, row in enumerate(csv.DictReader(f), start=1):
+            row = {k.strip().lower(): (v or "").strip() for k, v in row.items() if k}
+            if not row.get("subject"):
+                continue
+            row["id"] = row.get("id") or f"row-{n}"
+            yield row
+
+
+def completed_ids(output_path):
+    """Filas ya generadas con éxito en una ejecución anterior (el propio JSONL es el checkpoint)."""
+    done = set()
+    if not os.path.exists(output_path):
+        return done
+
+    with open(output_path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue  # línea truncada por una interrupción
+            if record.get("status") == "ok":
+                done.add(record["id"])
+    return done
+
+
+def ends_with_newline(path):
+    with open(path, "rb") as f:
+        f.seek(-1, os.SEEK_END)
+        return f.read(1) == b"\n"
+
+
+# ============================================================
+# CONTROL DE RITMO Y RECUPERACIÓN POR GRUPO
+# ============================================================
+
+class RateLimiter:
+    """Espacia el arranque de las llamadas al modelo (peticiones por minuto)."""
+
+    def __init__(self, per_minute=0):
+        self.interval = 60.0 / per_minute if per_minute else 0.0
+        self._next = 0.0
+        self._lock = asyncio.Lock()
+
+    async def wait(self):
+        if not self.interval:
+            return
+        async with self._lock:
+            now = asyncio.get_running_loop().time()
+            delay = self._next - now
+            self._next = max(now, self._next) + self.interval
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+class GroupRetriever:
+    """
+    Una sola recuperación por perfil o segmento distinto. Las filas del mismo
+    grupo que llegan a la vez esperan a la misma tarea en curso.
+    """
+
+    def __init__(self, retriever):
+        self.retriever = retriever
+        self._tasks = {}
+        self.calls = 0
+
+    @staticmethod
+    def group_of(row):
+        label = row.get("profile") or row.get("segment") or row["subject"]
+        return normalize_query(label), label
+
+    async def get(self, row):
+        key, label = self.group_of(row)
+        task = self._tasks.get(key)
+        if task is None:
+            self.calls += 1
+            task = asyncio.ensure_future(self.retriever.ainvoke(label))
+            self._tasks[key] = task
+        try:
+            return await asyncio.shield(task)
+        except Exception:
+            # No se memoriza un fallo: la siguiente fila lo reintenta
+            if self._tasks.get(key) is task:
+                del self._tasks[key]
+            raise
+
+
+# ============================================================
+# GENERACIÓN
+# ============================================================
+
+def row_inputs(row, docs):
+    subject = row["subject"]
+    question = row.get("question") or DEFAULT_QUESTION
+    return {
+        "question": question,
+        "chat_history": "",
+        "current_subject": subject,
+        "current_behavioral_profile": row.get("profile", ""),
+        "current_goal": row.get("goal") or detect_goal(f"{question} {subject}") or DEFAULT_GOAL,
+        "documents": docs,
+    }
+
+
+async def generate_row(row, chain, groups, limiter, retries):
+    started = time.perf_counter()
+    last_error = None
+
+    for attempt in range(retries + 1):
+        try:
+            docs = await groups.get(row)
+            inputs = row_inputs(row, docs)
+            await limiter.wait()
+            response = await chain.ainvoke(inputs)
+            profile = re.search(r"PERFIL_ACTUAL:\s*(.*)", response.content)
+            return {
+                "id": row["id"],
+                "status": "ok",
+                "subject": row["subject"],
+                "profile": row.get("profile", ""),
+                "segment": row.get("segment", ""),
+                "goal": inputs["current_goal"],
+                "answer": response.content,
+                "detected_profile": profile.group(1).strip() if profile else "",
+                "attempts": attempt + 1,
+                "latency_ms": round((time.perf_counter() - started) * 1000, 1),
+            }
+        except Exception as e:
+            last_error = e
+            if attempt < retries:
+                await asyncio.sleep(2 ** attempt)
+
+    return {
+        "id": row["id"],
+        "status": "error",
+        "subject": row["subject"],
+        "error": repr(last_error),
+        "attempts": retries + 1,
+    }
+
+
+async def run_batch(rows, chain, retriever, output_path, concurrency=8, rpm=0, retries=2):
+    """
+    Genera las filas con concurrencia acotada y escribe cada resultado en el
+    JSONL en cuanto termina (en orden de finalización, no de entrada).
+    """
+    groups = GroupRetriever(retriever)
+    limiter = RateLimiter(rpm)
+    slots = asyncio.Semaphore(concurrency)
+    counts = {"ok": 0, "error": 0}
+
+    async def worker(row):
+        async with slots:
+            return await generate_row(row, chain, groups, limiter, retries)
+
+    with open(output_path, "a", encoding="utf-8") as out:
+        if out.tell() and not ends_with_newline(output_path):
+            out.write("\n")  # cierra la línea truncada de una ejecución interrumpida
+        for n, future in enumerate(asyncio.as_completed([worker(r) for r in rows]), start=1):
+            record = await future
+            out.write(json.dumps(record, ensure_ascii=False) + "\n")
+            out.flush()
+            counts[record["status"]] += 1
+            if n % 10 == 0 or n == len(rows):
+                print(f"{n}/{len(rows)} filas ({counts['error']} con error)")
+
+    return {**counts, "retrievals": groups.calls}
+
+
+def build_retriever(kind):
+    docs = load_txt_files(os.path.join(BASE_DIR, "data"))
+    if kind == "ensemble":
+        return ensemble.ensemble_retriever_from_docs(docs, cache=RetrievalCache())
+    return hybrid_filter.create_retriever(split_documents(docs), cache=RetrievalCache())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generación masiva de mensajes a partir de un CSV de sujetos.")
+    parser.add_argument("input", help="CSV con columnas subject[, id, profile, segment, goal, question]")
+    parser.add_argument("--output", help="JSONL de resultados (por defecto, junto al CSV)")
+    parser.add_argument("--concurrency", type=int, default=8, help="Generaciones simultáneas")
+    parser.add_argument("--rpm", type=int, default=0, help="Máximo de llamadas al modelo por minuto (0 = sin límite)")
+    parser.add_argument("--retries", type=int, default=2, help="Reintentos por fila")
+    parser.add_argument("--restart", action="store_true", help="Ignorar el checkpoint y empezar de cero")
+    parser.add_argument("--retriever", choices=["filter", "ensemble"], default="filter")
+    parser.add_argument("--offline", action="store_true", help="LLM y embeddings locales simulados")
+    parser.add_argument("--llm-latency", type=float, default=0.0, help="Latencia simulada del LLM con --offline (s)")
+    args = parser.parse_args()
+
+    load_dotenv()
+    os.environ["TOKENIZERS_PARALLELISM"] = "false"
+    output_path = args.output or os.path.splitext(args.input)[0] + "_mensajes.jsonl"
+
+    if args.restart and os.path.exists(output_path):
+        os.remove(output_path)
+    done = completed_ids(output_path)
+    rows = [r for r in read_rows(args.input) if r["id"] not in done]
+    print(f"{len(rows)} filas pendientes ({len(done)} ya generadas)")
+    if not rows:
+        return
+
+    if args.offline:
+        from benchmark import offline_backends
+        backends = offline_backends(llm_latency=args.llm_latency)
+    else:
+        backends = nullcontext()
+
+    with backends:
+        retriever = build_retriever(args.retriever)
+        chain = make_rag_chain(basic_chain.get_model("ChatGPT"), retriever)
+        started = time.perf_counter()
+        summary = asyncio.run(run_batch(
+            rows, chain, retriever, output_path,
+            concurrency=args.concurrency, rpm=args.rpm, retries=args.retries,
+        ))
+
+    print(f"Hecho en {time.perf_counter() - started:.1f}s: {summary} -> {output_path}")
+
+
+if __name__ == "__main__":
+    main()
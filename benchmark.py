@@ -0,0 +1,439 @@
+import argparse
+import asyncio
+import hashlib
+import json
+import math
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from contextlib import contextmanager
+from pathlib import Path
+from typing import List
+
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+import basic_chain
+import ensemble
+import filter as hybrid_filter
+import full_chain
+import memory
+import rag_chain
+import reranker
+import vector_store
+from local_loader import load_txt_files, load_csv_files, get_document_text
+from retrieval_cache import RetrievalCache
+from splitter import split_documents
+
+
+# ============================================================
+# BACKENDS LOCALES DETERMINISTAS
+# ============================================================
+
+FAKE_PROFILES = [
+    "Perfil A – Activista Estratégica",
+    "Perfil B – Práctico Eco-consumidor",
+    "Perfil C – Aliado Institucional",
+    "Perfil D – Simpatizante Distante",
+]
+
+
+class FakeChatModel(BaseChatModel):
+    """
+    Modelo de chat offline: respuesta determinista derivada del prompt y
+    latencia simulada configurable. Soporta invoke/ainvoke/stream/astream.
+    """
+
+    latency: float = 0.0
+    """Segundos hasta el primer token."""
+    token_delay: float = 0.0
+    """Segundos entre tokens al hacer streaming."""
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-offline"
+
+    def _answer(self, messages):
+        prompt = "\n".join(str(m.content) for m in messages)
+        digest = hashlib.sha1(prompt.encode("utf-8")).hexdigest()
+        profile = FAKE_PROFILES[int(digest, 16) % len(FAKE_PROFILES)]
+        text = (
+            f"Respuesta simulada {digest[:8]} a partir de un prompt de {len(prompt)} caracteres.\n"
+            f"PERFIL_ACTUAL: {profile}"
+        )
+        usage = {
+            "input_tokens": len(prompt) // 4 + 1,
+            "output_tokens": len(text) // 4 + 1,
+        }
+        usage["total_tokens"] = usage["input_tokens"] + usage["output_tokens"]
+        return text, usage
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        time.sleep(self.latency)
+        text, usage = self._answer(messages)
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=text, usage_metadata=usage))])
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        await asyncio.sleep(self.latency)
+        text, usage = self._answer(messages)
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=text, usage_metadata=usage))])
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        time.sleep(self.latency)
+        text, _ = self._answer(messages)
+        for token in re.split(r"(?<=\s)", text):
+            time.sleep(self.token_delay)
+            yield ChatGenerationChunk(message=AIMessageChunk(content=token))
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        await asyncio.sleep(self.latency)
+        text, _ = self._answer(messages)
+        for token in re.split(r"(?<=\s)", text):
+            await asyncio.sleep(self.token_delay)
+            yield ChatGenerationChunk(message=AIMessageChunk(content=token))
+
+
+class FakeEmbeddings(Embeddings):
+    """
+    Embeddings offline: bolsa de palabras con hashing, normalizada. Es
+    determinista y conserva algo de similitud léxica, así la recuperación
+    sigue teniendo sentido en los benchmarks.
+    """
+
+    def __init__(self, size=384, latency=0.0):
+        self.size = size
+        self.latency = latency
+
+    def _vector(self, text):
+        vector = [0.0] * self.size
+        for token in re.findall(r"\w+", text.lower()):
+            h = int.from_bytes(hashlib.md5(token.encode("utf-8")).digest()[:8], "little")
+            vector[h % self.size] += 1.0 if (h >> 63) else -1.0
+        norm = math.sqrt(sum(v * v for v in vector)) or 1.0
+        return [v / norm for v in vector]
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        time.sleep(self.latency)
+        return [self._vector(t) for t in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        time.sleep(self.latency)
+        return self._vector(text)
+
+
+class FakeCrossEncoder:
+    """Cross-encoder offline: fracción de términos de la pregunta presentes en el chunk."""
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+
+    def predict(self, pairs, batch_size=16, show_progress_bar=False):
+        scores = []
+        for start in range(0, len(pairs), batch_size):
+            time.sleep(self.latency)
+            for query, text in pairs[start:start + batch_size]:
+                terms = set(re.findall(r"\w+", query.lower()))
+                found = set(re.findall(r"\w+", text.lower()))
+                scores.append(len(terms & found) / (len(terms) or 1))
+        return scores
+
+
+@contextmanager
+def offline_backends(llm_latency=0.0, embed_latency=0.0, token_delay=0.0, store_dir=None):
+    """
+    Sustituye `get_model` y las clases de embeddings por los backends locales
+    y aísla las colecciones en `store_dir` (temporal por defecto).
+    """
+    def fake_get_model(*args, **kwargs):
+        return FakeChatModel(latency=llm_latency, token_delay=token_delay)
+
+    patches = [
+        (basic_chain, "get_model", fake_get_model),
+        (full_chain, "get_model", fake_get_model),
+        (memory, "get_model", fake_get_model),
+        (rag_chain, "get_model", fake_get_model),
+        (hybrid_filter, "torch_embeddings",
+         lambda: (FakeEmbeddings(384, embed_latency), FakeEmbeddings(1024, embed_latency))),
+        (vector_store, "load_openai_embeddings", lambda **kw: FakeEmbeddings(1536, embed_latency)),
+        (reranker, "load_cross_encoder", lambda model_name: FakeCrossEncoder(embed_latency)),
+    ]
+    originals = [(module, name, getattr(module, name)) for module, name, _ in patches]
+    previous_store = os.environ.get("RAG_STORE_DIR")
+    tmp = tempfile.TemporaryDirectory() if store_dir is None else None
+
+    try:
+        for module, name, value in patches:
+            setattr(module, name, value)
+        os.environ["RAG_STORE_DIR"] = store_dir or tmp.name
+        os.environ.setdefault("OPENAI_API_KEY", "sk-offline")
+        os.environ.setdefault("ANONYMIZED_TELEMETRY", "False")
+        yield
+    finally:
+        for module, name, value in originals:
+            setattr(module, name, value)
+        if previous_store is None:
+            os.environ.pop("RAG_STORE_DIR", None)
+        else:
+            os.environ["RAG_STORE_DIR"] = previous_store
+        if tmp is not None:
+            tmp.cleanup()
+
+
+# ============================================================
+# MEDICIÓN POR ETAPAS
+# ============================================================
+
+def percentile(values, p):
+    """Percentil por rango más cercano."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(1, math.ceil(p / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+def summarize(samples, peak_bytes=0):
+    total = sum(samples)
+    return {
+        "count": len(samples),
+        "p50_ms": round(percentile(samples, 50) * 1000, 3),
+        "p95_ms": round(percentile(samples, 95) * 1000, 3),
+        "mean_ms": round(total / len(samples) * 1000, 3) if samples else 0.0,
+        "total_s": round(total, 4),
+        "throughput_per_s": round(len(samples) / total, 2) if total else None,
+        "peak_alloc_mb": round(peak_bytes / 2 ** 20, 2),
+    }
+
+
+class StageRecorder:
+    """Acumula duraciones y pico de memoria (tracemalloc) por etapa."""
+
+    def __init__(self):
+        self.samples = {}
+        self.peaks = {}
+
+    @contextmanager
+    def stage(self, name):
+        tracing = tracemalloc.is_tracing()
+        baseline = 0
+        if tracing:
+            tracemalloc.reset_peak()
+            baseline = tracemalloc.get_traced_memory()[0]
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.samples.setdefault(name, []).append(time.perf_counter() - start)
+            if tracing:
+                # Pico de memoria asignada durante la etapa, sobre lo ya ocupado
+                peak = tracemalloc.get_traced_memory()[1] - baseline
+                self.peaks[name] = max(self.peaks.get(name, 0), peak)
+
+    def report(self):
+        return {name: summarize(s, self.peaks.get(name, 0)) for name, s in self.samples.items()}
+
+
+# ============================================================
+# CORPUS Y CONSULTAS
+# ============================================================
+
+BENCH_QUERIES = [
+    "¿Qué perfil comportamental encaja con una activista joven con ecoansiedad?",
+    "Barreras y palancas del eco-consumidor pragmático",
+    "Normas de comunicación sobre el tono y el catastrofismo",
+    "¿Cómo comunicar con personas de la adultez madura?",
+    "Insights sobre autoeficacia y normas sociales",
+    "Mensaje para un aliado institucional que busca métricas",
+    "Problemas cognitivos y polarización en la audiencia",
+    "Segmentación por edades para una campaña de socios",
+]
+
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def load_corpus(data_dir=None, examples_dir=None, include_examples=True):
+    data_dir = data_dir or os.path.join(BASE_DIR, "data")
+    examples_dir = examples_dir or os.path.join(BASE_DIR, "examples")
+
+    docs = load_txt_files(data_dir)
+    if include_examples:
+        docs += load_txt_files(examples_dir)
+        docs += load_csv_files(examples_dir)
+        for path in sorted(Path(examples_dir).glob("*.pdf")):
+            with open(path, "rb") as f:
+                docs += get_document_text(f, title=path.name)
+    return docs
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=BASE_DIR, capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except Exception:
+        return None
+
+
+# ============================================================
+# BENCHMARK
+# ============================================================
+
+def run_benchmark(llm_latency=0.0, embed_latency=0.0, repeat=3, include_examples=True):
+    """Ejecuta el pipeline real con backends offline y devuelve el informe."""
+    recorder = StageRecorder()
+    tracemalloc.start()
+    started = time.perf_counter()
+
+    with offline_backends(llm_latency=llm_latency, embed_latency=embed_latency):
+        with recorder.stage("load"):
+            docs = load_corpus(include_examples=include_examples)
+        with recorder.stage("split"):
+            texts = split_documents(docs)
+
+        # Cachés de tamaño 0: se mide la recuperación real, no la caché
+        with recorder.stage("index_filter"):
+            filter_retriever = hybrid_filter.create_retriever(texts, cache=RetrievalCache(max_entries=0))
+        with recorder.stage("index_ensemble"):
+            ensemble_retriever = ensemble.ensemble_retriever_from_docs(docs, cache=RetrievalCache(max_entries=0))
+
+        for _ in range(repeat):
+            for q in BENCH_QUERIES:
+                with recorder.stage("retrieve_filter"):
+                    filter_retriever.invoke(q)
+                with recorder.stage("retrieve_ensemble"):
+                    ensemble_retriever.invoke(q)
+
+        model = full_chain.get_model()
+        chain = rag_chain.make_rag_chain(model, ensemble_retriever)
+        for _ in range(repeat):
+            for q in BENCH_QUERIES:
+                with recorder.stage("rag_chain"):
+                    chain.invoke({"question": q, "current_goal": "generar_mensaje"})
+
+        for _ in range(repeat):
+            session = full_chain.create_full_chain(filter_retriever)
+            for q in full_chain.DEMO_CONVERSATION:
+                with recorder.stage("full_chain_turn"):
+                    session.invoke(q)
+
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        "commit": git_commit(),
+        "config": {
+            "llm_latency_s": llm_latency,
+            "embed_latency_s": embed_latency,
+            "repeat": repeat,
+            "include_examples": include_examples,
+            "documents": len(docs),
+            "chunks": len(texts),
+        },
+        "wall_time_s": round(time.perf_counter() - started, 3),
+        "peak_memory_mb": round(peak / 2 ** 20, 2),
+        "stages": recorder.report(),
+    }
+
+
+# ============================================================
+# PRESUPUESTO DE IMPORTACIÓN
+# ============================================================
+#
+# Módulos que la app importa antes de tener el índice listo. Cada uno se
+# importa en un intérprete nuevo: debe cargar dentro de su presupuesto y
+# sin arrastrar dependencias pesadas, que van dentro de las funciones.
+
+IMPORT_BUDGETS_MS = {
+    "tracing": 500,
+    "local_loader": 500,
+    "retrieval_cache": 500,
+    "basic_chain": 1500,
+    "filter": 2000,
+    "full_chain": 2000,
+}
+HEAVY_IMPORTS = [
+    "langchain_openai", "openai", "chromadb", "pypdf", "sentence_transformers", "torch",
+    "onnxruntime", "wikipedia", "langchain_community.embeddings", "langchain_community.vectorstores",
+    "langchain_community.document_loaders", "langchain_community.llms", "langchain_community.retrievers",
+]
+
+IMPORT_PROBE = """
+import json, sys, time
+sys.path.insert(0, {base!r})
+started = time.perf_counter()
+import {module}
+print(json.dumps({{"ms": (time.perf_counter() - started) * 1000, "modules": list(sys.modules)}}))
+"""
+
+
+def measure_import(module, repeat=3):
+    """Mediana del tiempo de importación en frío y dependencias pesadas cargadas."""
+    times, loaded = [], set()
+    for _ in range(repeat):
+        result = subprocess.run(
+            [sys.executable, "-c", IMPORT_PROBE.format(base=BASE_DIR, module=module)],
+            capture_output=True, text=True, check=True,
+        )
+        data = json.loads(result.stdout.strip().splitlines()[-1])
+        times.append(data["ms"])
+        loaded.update(data["modules"])
+    return sorted(times)[len(times) // 2], [name for name in HEAVY_IMPORTS if name in loaded]
+
+
+def check_import_budget(budgets=IMPORT_BUDGETS_MS, repeat=3):
+    report = {}
+    for module, budget in budgets.items():
+        ms, heavy = measure_import(module, repeat)
+        report[module] = {
+            "ms": round(ms, 1),
+            "budget_ms": budget,
+            "heavy": heavy,
+            "ok": ms <= budget and not heavy,
+        }
+    return {"commit": git_commit(), "ok": all(r["ok"] for r in report.values()), "modules": report}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark offline del pipeline RAG.")
+    parser.add_argument("--llm-latency", type=float, default=0.0, help="Latencia simulada del LLM (s)")
+    parser.add_argument("--embed-latency", type=float, default=0.0, help="Latencia simulada por llamada de embeddings (s)")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--no-examples", action="store_true", help="Solo data/, sin examples/")
+    parser.add_argument("--output", help="Ruta del informe JSON (por defecto, stdout)")
+    parser.add_argument("--imports", action="store_true",
+                        help="Solo comprobar el presupuesto de importación (sale con 1 si se supera)")
+    args = parser.parse_args()
+
+    if args.imports:
+        report = check_import_budget(repeat=args.repeat)
+    else:
+        report = run_benchmark(
+            llm_latency=args.llm_latency,
+            embed_latency=args.embed_latency,
+            repeat=args.repeat,
+            include_examples=not args.no_examples,
+        )
+
+    output = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output)
+        print(f"Informe guardado en {args.output}")
+    else:
+        print(output)
+
+    if args.imports and not report["ok"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    os.environ["TOKENIZERS_PARALLELISM"] = "false"
+    main()
@@ -0,0 +1,111 @@
+import hashlib
+import html
+import os
+import re
+
+import numpy as np
+
+from local_loader import list_txt_files, load_txt_files
+from mmap_index import index_path, load_index, tokenize
+from splitter import split_documents
+
+
+# ============================================================
+# ÍNDICE LÉXICO DE LOS ARCHIVOS DE DATOS
+# ============================================================
+#
+# Para la página de exploración: los mismos chunks que indexa el retriever
+# (troceado y deduplicación de `split_documents`) en un índice mmap sin
+# embeddings, solo con textos, metadatos y postings BM25. Se reconstruye
+# cuando cambia el contenido de algún archivo de data/.
+
+BROWSE_INDEX = "browse"
+SNIPPET_CHARS = 240
+
+
+def file_digest(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()[:16]
+
+
+def data_version(digests):
+    """Versión del índice a partir de {archivo: hash} de los archivos de datos."""
+    h = hashlib.sha256(b"browse-v1")
+    for path in sorted(digests):
+        h.update(os.path.basename(path).encode("utf-8"))
+        h.update(digests[path].encode("utf-8"))
+    return h.hexdigest()[:16]
+
+
+def open_browse_index(data_dir="./data", version=None):
+    """Índice léxico de `data_dir`; solo se trocea de nuevo si cambió algún archivo."""
+    if version is None:
+        version = data_version({p: file_digest(p) for p in list_txt_files(data_dir)})
+    return load_index(
+        index_path(BROWSE_INDEX),
+        lambda: split_documents(load_txt_files(data_dir)),
+        {},
+        version,
+    )
+
+
+def rows_by_source(index):
+    """{ruta de origen: [filas]} en el orden del troceado."""
+    sources = {}
+    for row in range(len(index)):
+        source = str(index.document(row).metadata.get("source") or "")
+        sources.setdefault(source, []).append(row)
+    return sources
+
+
+# ============================================================
+# BÚSQUEDA Y FRAGMENTOS RESALTADOS
+# ============================================================
+
+def search(index, query, category=None, rows=None, k=20):
+    """
+    [(fila, puntuación)] de los chunks con puntuación BM25 positiva, como
+    los vería el BM25 del retriever (misma tokenización: por espacios).
+    `rows` limita la búsqueda a un subconjunto, p. ej. un archivo.
+    """
+    candidates, scores = index.bm25_scores(query, category)
+    if rows is not None:
+        inside = np.isin(candidates, rows)
+        candidates, scores = candidates[inside], scores[inside]
+    order = np.argsort(scores, kind="stable")[::-1][:k]
+    return [(int(candidates[i]), float(scores[i])) for i in order if scores[i] > 0]
+
+
+def term_pattern(query):
+    """Tokens de la consulta como palabras completas (separadas por espacios, como BM25)."""
+    tokens = sorted(set(tokenize(query)), key=len, reverse=True)
+    if not tokens:
+        return None
+    return re.compile(r"(?<!\S)(" + "|".join(re.escape(t) for t in tokens) + r")(?!\S)")
+
+
+def highlight(text, pattern):
+    """HTML escapado con los términos de la consulta en <mark>."""
+    if pattern is None:
+        return html.escape(text)
+    parts, last = [], 0
+    for m in pattern.finditer(text):
+        parts.append(html.escape(text[last:m.start()]))
+        parts.append(f"<mark>{html.escape(m.group(0))}</mark>")
+        last = m.end()
+    parts.append(html.escape(text[last:]))
+    return "".join(parts)
+
+
+def snippet(text, query, width=SNIPPET_CHARS):
+    """Fragmento de `width` caracteres alrededor de la primera coincidencia, resaltado."""
+    text = " ".join(text.split())
+    pattern = term_pattern(query)
+    match = pattern.search(text) if pattern is not None else None
+    start = max(0, (match.start() if match else 0) - width // 3)
+    end = min(len(text), start + width)
+    fragment = highlight(text[start:end], pattern)
+    return ("…" if start > 0 else "") + fragment + ("…" if end < len(text) else "")
@@ -0,0 +1,89 @@
+import os
+
+
+# ============================================================
+# CATEGORÍAS DEL CORPUS
+# ============================================================
+#
+# Se asignan al indexar (metadata["category"]) y las usan tanto la
+# búsqueda por particiones como `structure_context` al montar el prompt.
+
+CATEGORIES = [
+    "PERFILES_COMPORTAMENTALES",
+    "NORMAS_COMUNICACION",
+    "PROBLEMAS_AUDIENCIA",
+    "SEGMENTACION_EDADES",
+    "INSIGHTS_PSICOLOGICOS",
+    "OTROS",
+]
+
+# Los documentos de data/ tienen una categoría clara por archivo
+SOURCE_CATEGORIES = {
+    "perfiles_comportamentales": "PERFILES_COMPORTAMENTALES",
+    "normasdecomunicacion": "NORMAS_COMUNICACION",
+    "problemas_audiencia": "PROBLEMAS_AUDIENCIA",
+    "segmentacion_edades": "SEGMENTACION_EDADES",
+    "insights_psicologicos": "INSIGHTS_PSICOLOGICOS",
+}
+
+# Resto de documentos: por palabras clave del contenido, en este orden
+TEXT_RULES = [
+    ("PERFILES_COMPORTAMENTALES", ["perfil a", "perfil b", "perfil c"]),
+    ("NORMAS_COMUNICACION", ["principios rectores", "tono y estilo"]),
+    ("PROBLEMAS_AUDIENCIA", ["problemas cognitivos", "problemas emocionales"]),
+    ("SEGMENTACION_EDADES", ["adolescencia", "juventud adulta", "adultez"]),
+    ("INSIGHTS_PSICOLOGICOS", ["autoeficacia", "dragones de la inactividad"]),
+]
+
+
+def categorize(doc):
+    """Categoría de un chunk: la de sus metadatos, la de su archivo o la de su contenido."""
+    metadata = getattr(doc, "metadata", None) or {}
+    if metadata.get("category") in CATEGORIES:
+        return metadata["category"]
+
+    source = os.path.basename(str(metadata.get("source") or metadata.get("title") or "")).lower()
+    for prefix, category in SOURCE_CATEGORIES.items():
+        if source.startswith(prefix):
+            return category
+
+    text = doc.page_content.lower()
+    for category, keywords in TEXT_RULES:
+        if any(k in text for k in keywords):
+            return category
+    return "OTROS"
+
+
+# ============================================================
+# ENRUTADO POR OBJETIVO
+# ============================================================
+
+# Particiones y k por partición para cada objetivo de `intent.GOAL_KEYWORDS`.
+# Sin objetivo (o con uno no listado) se busca en todo el corpus.
+GOAL_ROUTES = {
+    "identificar_perfil": {
+        "PERFILES_COMPORTAMENTALES": 3,
+        "INSIGHTS_PSICOLOGICOS": 2,
+        "SEGMENTACION_EDADES": 1,
+    },
+    "generar_mensaje": {
+        "NORMAS_COMUNICACION": 2,
+        "PERFILES_COMPORTAMENTALES": 2,
+        "INSIGHTS_PSICOLOGICOS": 1,
+    },
+    "asesoramiento_campaña": {
+        "SEGMENTACION_EDADES": 2,
+        "PROBLEMAS_AUDIENCIA": 2,
+        "NORMAS_COMUNICACION": 1,
+        "PERFILES_COMPORTAMENTALES": 1,
+    },
+    "comparar_perfiles": {
+        "PERFILES_COMPORTAMENTALES": 4,
+        "SEGMENTACION_EDADES": 1,
+    },
+}
+
+
+def route_for_goal(goal):
+    """{categoría: k} para el objetivo, o None si se busca en todo el corpus."""
+    return GOAL_ROUTES.get(goal or "")
@@ -0,0 +1,107 @@
+import re
+
+import mmh3
+import numpy as np
+
+from intent import normalize_text
+
+
+# ============================================================
+# DEDUPLICACIÓN APROXIMADA AL INDEXAR (MinHash + LSH)
+# ============================================================
+#
+# Chunks casi idénticos (texto repetido entre archivos de data/, PDFs
+# subidos dos veces...) se agrupan y solo se indexa uno por grupo. En cada
+# representante quedan anotados los chunks que sustituye.
+
+NUM_PERM = 128
+BANDS = 16                # 16 bandas de 8 filas: candidatos a partir de ~0.7
+SHINGLE_WORDS = 5
+THRESHOLD = 0.8           # Jaccard mínimo (sobre los shingles) para agrupar
+
+_MERSENNE = np.uint64((1 << 61) - 1)
+_MAX_HASH = np.uint64((1 << 32) - 1)
+_WORD_RE = re.compile(r"\w+")
+
+_rng = np.random.RandomState(1)
+_A = _rng.randint(1, 1 << 32, size=NUM_PERM, dtype=np.uint64)
+_B = _rng.randint(0, 1 << 32, size=NUM_PERM, dtype=np.uint64)
+
+
+def shingles(text, size=SHINGLE_WORDS):
+    """Hashes de los n-gramas de palabras del texto normalizado."""
+    words = _WORD_RE.findall(normalize_text(text))
+    if not words:
+        return set()
+    grams = [" ".join(words[i:i + size]) for i in range(max(1, len(words) - size + 1))]
+    return {mmh3.hash(g, signed=False) for g in grams}
+
+
+def minhash(hashes):
+    """Firma MinHash: mínimo de cada permutación (a·h + b mod p) sobre los shingles."""
+    values = np.fromiter(hashes, dtype=np.uint64, count=len(hashes))
+    permuted = (np.outer(values, _A) + _B) % _MERSENNE & _MAX_HASH
+    return permuted.min(axis=0)
+
+
+def near_duplicate_clusters(texts, threshold=THRESHOLD, bands=BANDS):
+    """
+    Grupos de índices de `texts` con similitud de Jaccard >= `threshold`.
+    Solo se comparan los pares que coinciden en alguna banda LSH, así el
+    coste es casi lineal en el número de chunks.
+    """
+    sets = [shingles(t) for t in texts]
+    rows = NUM_PERM // bands
+    buckets = {}
+    for i, s in enumerate(sets):
+        if not s:
+            continue
+        signature = minhash(s)
+        for band in range(bands):
+            key = (band, signature[band * rows:(band + 1) * rows].tobytes())
+            buckets.setdefault(key, []).append(i)
+
+    parent = list(range(len(texts)))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    checked = set()
+    for members in buckets.values():
+        for n, j in enumerate(members):
+            for i in members[:n]:
+                if (i, j) in checked or find(i) == find(j):
+                    continue
+                checked.add((i, j))
+                if len(sets[i] & sets[j]) / len(sets[i] | sets[j]) >= threshold:
+                    # El representante es siempre el primero en orden de indexado
+                    a, b = sorted((find(i), find(j)))
+                    parent[b] = a
+
+    clusters = {}
+    for i in range(len(texts)):
+        clusters.setdefault(find(i), []).append(i)
+    return [members for members in clusters.values() if len(members) > 1]
+
+
+def deduplicate_chunks(docs, threshold=THRESHOLD):
+    """
+    Conserva un chunk por grupo de casi duplicados (los de `split_documents`,
+    que ya llevan chunk_id) y anota en sus metadatos cuántos sustituye
+    (`duplicates`) y cuáles (`duplicate_ids`, `duplicate_sources`, separados
+    por comas para que Chroma los acepte).
+    """
+    clusters = near_duplicate_clusters([d.page_content for d in docs], threshold)
+    removed = set()
+    for members in clusters:
+        representative, others = docs[members[0]], [docs[i] for i in members[1:]]
+        sources = {str(d.metadata.get("source") or "") for d in others}
+        representative.metadata["duplicates"] = len(others)
+        representative.metadata["duplicate_ids"] = ",".join(str(d.metadata.get("chunk_id", "")) for d in others)
+        representative.metadata["duplicate_sources"] = ",".join(sorted(s for s in sources if s))
+        removed.update(members[1:])
+
+    return [d for i, d in enumerate(docs) if i not in removed]
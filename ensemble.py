@@ -1,9 +1,12 @@
-from langchain_community.retrievers import BM25Retriever
+import asyncio
+
 from langchain_core.retrievers import BaseRetriever
 from langchain_core.documents import Document
 
 from splitter import split_documents
-from vector_store import create_vector_db
+from vector_store import create_vector_db, asearch_by_vector, embedding_context
+from retrieval_cache import RetrievalCache, compute_index_version
+from tracing import span, timed
 
 
 def safe_content(d):
@@ -17,39 +20,76 @@ def safe_content(d):
         return str(d)
 
 
-def ensemble_retriever_from_docs(docs, embeddings=None):
+def ensemble_retriever_from_docs(docs, embeddings=None, cache=None):
 
     # 1. Split de documentos
     texts = split_documents(docs)
 
+    # Caché de resultados, invalidada si cambia el índice
+    if cache is None:
+        cache = RetrievalCache()
+    cache.bind(compute_index_version(texts, "ensemble"))
+
     # 2. Crea vector store retriever moderno
     vector_store = create_vector_db(texts, embeddings)
     semantic_retriever = vector_store.as_retriever(search_kwargs={"k": 4})
 
     # 3. BM25 moderno (usa invoke, no get_relevant_documents)
-    bm25_retriever = BM25Retriever.from_texts(
-        [t.page_content for t in texts]
-    )
+    from langchain_community.retrievers import BM25Retriever
+    bm25_retriever = BM25Retriever.from_documents(texts)
+
+    def merge(query, docs_sem, docs_bm25):
+        # Fusionar eliminando duplicados
+        seen = set()
+        merged = []
+
+        for d in docs_sem + docs_bm25:
+            content = safe_content(d)
+            if content not in seen:
+                seen.add(content)
+                # Convertir a Document siempre, conservando metadatos (chunk_id)
+                metadata = dict(getattr(d, "metadata", None) or {})
+                merged.append(Document(page_content=content, metadata=metadata))
+
+        cache.put(query, merged)
+        return merged
 
     class HybridRetriever(BaseRetriever):
 
         def _get_relevant_documents(self, query, *, run_manager=None):
 
+            with span("cache") as s:
+                cached = cache.get(query)
+                s["hit"] = cached is not None
+            if cached is not None:
+                return cached
+
             # LA API CORRECTA EN LANGCHAIN 0.2+
-            docs_sem = semantic_retriever.invoke(query)
-            docs_bm25 = bm25_retriever.invoke(query)
+            with embedding_context():
+                with span("dense"):
+                    docs_sem = semantic_retriever.invoke(query)
+                with span("bm25"):
+                    docs_bm25 = bm25_retriever.invoke(query)
+
+            with span("merge"):
+                return merge(query, docs_sem, docs_bm25)
+
+        async def _aget_relevant_documents(self, query, *, run_manager=None):
 
-            # Fusionar eliminando duplicados
-            seen = set()
-            merged = []
+            with span("cache") as s:
+                cached = cache.get(query)
+                s["hit"] = cached is not None
+            if cached is not None:
+                return cached
 
-            for d in docs_sem + docs_bm25:
-                content = safe_content(d)
-                if content not in seen:
-                    seen.add(content)
-                    # Convertir a Document siempre
-                    merged.append(Document(page_content=content))
+            # Búsqueda semántica y BM25 en paralelo
+            with embedding_context():
+                docs_sem, docs_bm25 = await asyncio.gather(
+                    timed("dense", asearch_by_vector(vector_store, query, k=4)),
+                    timed("bm25", bm25_retriever.ainvoke(query)),
+                )
 
-            return merged
+            with span("merge"):
+                return merge(query, docs_sem, docs_bm25)
 
     return HybridRetriever()
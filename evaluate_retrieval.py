@@ -0,0 +1,240 @@
+import argparse
+import json
+import os
+import re
+import time
+from contextlib import nullcontext
+
+import ensemble
+import filter as hybrid_filter
+from benchmark import BASE_DIR, git_commit, offline_backends, percentile
+from local_loader import load_txt_files
+from memory import estimate_tokens
+from rag_chain import format_docs
+from reranker import CrossEncoderReranker
+from retrieval_cache import RetrievalCache
+from splitter import split_documents
+
+
+GOLDEN_SET = os.path.join(BASE_DIR, "golden", "retrieval_es.json")
+K_VALUES = (1, 3, 5, 10)
+
+# Filter se puntúa sobre sus candidatos: los documentos core (siempre delante)
+# y el LongContextReorder medirían el montaje del prompt, no la búsqueda. Los
+# tokens de contexto sí se miden sobre la salida normal, la que ve el modelo.
+CANDIDATES_CONFIG = {"metadata": {"candidates_only": True}}
+
+# Cabeceras de sección de data/*.txt: "1. PERFIL A – ..." (no "2.1. ...")
+_SECTION_RE = re.compile(r"^(\d+)\.\s", re.MULTILINE)
+
+
+# ============================================================
+# SECCIONES DEL CORPUS
+# ============================================================
+
+class SectionIndex:
+    """
+    Localiza cada chunk dentro de su archivo de origen y devuelve las
+    secciones que cubre, como "perfiles_comportamentales.txt#2".
+    El texto anterior a la primera cabecera cuenta como sección 0.
+    """
+
+    def __init__(self):
+        self._files = {}
+
+    def _sections(self, source):
+        if source not in self._files:
+            try:
+                with open(source, "r", encoding="utf-8") as f:
+                    text = f.read()
+            except Exception:
+                text = ""
+            starts = [(m.start(), m.group(1)) for m in _SECTION_RE.finditer(text)]
+            self._files[source] = (text, starts)
+        return self._files[source]
+
+    def sections_of(self, doc):
+        source = doc.metadata.get("source")
+        if not source:
+            return set()
+
+        text, starts = self._sections(source)
+        pos = text.find(doc.page_content)
+        if pos < 0:
+            return set()
+        end = pos + len(doc.page_content)
+
+        name = os.path.basename(source)
+        found = {"0"} if not starts or pos < starts[0][0] else set()
+        for i, (start, number) in enumerate(starts):
+            next_start = starts[i + 1][0] if i + 1 < len(starts) else len(text)
+            if start < end and next_start > pos:
+                found.add(number)
+        return {f"{name}#{number}" for number in found}
+
+
+# ============================================================
+# MÉTRICAS
+# ============================================================
+
+def score_query(ranked_sections, expected, k_values=K_VALUES):
+    """recall@k (fracción de secciones esperadas recuperadas) y rango recíproco."""
+    expected = set(expected)
+    recall = {}
+    for k in k_values:
+        hit = set().union(*ranked_sections[:k]) if ranked_sections[:k] else set()
+        recall[k] = len(hit & expected) / len(expected)
+
+    reciprocal_rank = 0.0
+    for rank, sections in enumerate(ranked_sections, start=1):
+        if sections & expected:
+            reciprocal_rank = 1.0 / rank
+            break
+    return recall, reciprocal_rank
+
+
+def evaluate(retriever, golden, sections, k_values=K_VALUES):
+    """Ejecuta el conjunto dorado sobre un retriever y agrega las métricas de ranking."""
+    latencies, candidate_tokens, reciprocal_ranks = [], [], []
+    recalls = {k: [] for k in k_values}
+    per_query = []
+
+    for item in golden:
+        start = time.perf_counter()
+        docs = retriever.invoke(item["question"], CANDIDATES_CONFIG)
+        latencies.append(time.perf_counter() - start)
+
+        ranked = [sections.sections_of(d) for d in docs]
+        recall, rr = score_query(ranked, item["expected"], k_values)
+        tokens = estimate_tokens(format_docs(docs))
+
+        for k in k_values:
+            recalls[k].append(recall[k])
+        reciprocal_ranks.append(rr)
+        candidate_tokens.append(tokens)
+        per_query.append({
+            "question": item["question"],
+            "reciprocal_rank": round(rr, 3),
+            "documents": len(docs),
+            "candidate_tokens": tokens,
+            "latency_ms": round(latencies[-1] * 1000, 3),
+        })
+
+    n = len(golden)
+    return {
+        "queries": n,
+        **{f"recall@{k}": round(sum(v) / n, 3) for k, v in recalls.items()},
+        "mrr": round(sum(reciprocal_ranks) / n, 3),
+        "candidate_tokens_mean": round(sum(candidate_tokens) / n, 1),
+        "latency_p50_ms": round(percentile(latencies, 50) * 1000, 3),
+        "latency_p95_ms": round(percentile(latencies, 95) * 1000, 3),
+        "per_query": per_query,
+    }
+
+
+def measure_context(retriever, golden, metrics):
+    """Tokens del contexto que recibe el modelo (salida normal, con core y fichas)."""
+    tokens = []
+    for item, query in zip(golden, metrics["per_query"]):
+        docs = retriever.invoke(item["question"])
+        query["context_documents"] = len(docs)
+        query["context_tokens"] = estimate_tokens(format_docs(docs))
+        tokens.append(query["context_tokens"])
+    metrics["context_tokens_mean"] = round(sum(tokens) / len(tokens), 1) if tokens else 0.0
+    return metrics
+
+
+# ============================================================
+# CONFIGURACIONES DE RETRIEVER
+# ============================================================
+
+def filter_with_reranker(docs, texts, top_n=6):
+    """Filter con reranking; el reranker viaja en `metadata` para informar de su latencia."""
+    rerank = CrossEncoderReranker(top_n=top_n)
+    retriever = hybrid_filter.create_retriever(
+        texts, cache=RetrievalCache(max_entries=0), embedding_backend="torch", reranker=rerank)
+    retriever.metadata = {"reranker": rerank}
+    return retriever
+
+
+# Cachés de tamaño 0: se mide la recuperación real, no la caché
+RETRIEVER_CONFIGS = {
+    "ensemble": lambda docs, texts: ensemble.ensemble_retriever_from_docs(
+        docs, cache=RetrievalCache(max_entries=0)),
+    "filter": lambda docs, texts: hybrid_filter.create_retriever(
+        texts, cache=RetrievalCache(max_entries=0), embedding_backend="torch"),
+    "filter-onnx": lambda docs, texts: hybrid_filter.create_retriever(
+        texts, cache=RetrievalCache(max_entries=0), embedding_backend="onnx"),
+    "filter-onnx-int8": lambda docs, texts: hybrid_filter.create_retriever(
+        texts, cache=RetrievalCache(max_entries=0), embedding_backend="onnx-int8"),
+    "filter-rerank": filter_with_reranker,
+}
+DEFAULT_CONFIGS = ["ensemble", "filter"]
+
+
+def load_golden(path=GOLDEN_SET):
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def run_evaluation(configs=None, golden_path=GOLDEN_SET, data_dir=None, offline=False):
+    """Evalúa cada configuración sobre el mismo corpus y conjunto dorado."""
+    configs = configs or DEFAULT_CONFIGS
+    golden = load_golden(golden_path)
+    sections = SectionIndex()
+
+    backends = offline_backends() if offline else nullcontext()
+    with backends:
+        docs = load_txt_files(data_dir or os.path.join(BASE_DIR, "data"))
+        texts = split_documents(docs)
+
+        results = {}
+        for name in configs:
+            start = time.perf_counter()
+            retriever = RETRIEVER_CONFIGS[name](docs, texts)
+            build_s = time.perf_counter() - start
+            results[name] = {"build_s": round(build_s, 3), **evaluate(retriever, golden, sections)}
+            rerank = (retriever.metadata or {}).get("reranker")
+            if rerank is not None:
+                results[name]["rerank"] = rerank.stats()
+            # Después de leer las estadísticas del reranker: esta pasada no cuenta
+            measure_context(retriever, golden, results[name])
+
+    return {
+        "commit": git_commit(),
+        "offline": offline,
+        "golden_set": os.path.relpath(golden_path, BASE_DIR),
+        "chunks": len(texts),
+        "retrievers": results,
+    }
+
+
+def print_table(report):
+    columns = [f"recall@{k}" for k in K_VALUES] + ["mrr", "context_tokens_mean", "candidate_tokens_mean",
+                                                   "latency_p50_ms", "latency_p95_ms"]
+    print("retriever".ljust(12) + "".join(c.rjust(23) for c in columns))
+    for name, metrics in report["retrievers"].items():
+        print(name.ljust(12) + "".join(str(metrics[c]).rjust(23) for c in columns))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Evaluación de calidad y latencia de los retrievers.")
+    parser.add_argument("--configs", nargs="+", choices=list(RETRIEVER_CONFIGS),
+                        help="Retrievers a evaluar (por defecto, ensemble y filter)")
+    parser.add_argument("--golden", default=GOLDEN_SET, help="Conjunto dorado (JSON)")
+    parser.add_argument("--offline", action="store_true",
+                        help="Embeddings deterministas locales (solo BM25 es significativo)")
+    parser.add_argument("--output", help="Ruta del informe JSON completo")
+    args = parser.parse_args()
+
+    report = run_evaluation(configs=args.configs, golden_path=args.golden, offline=args.offline)
+    print_table(report)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"Informe guardado en {args.output}")
+
+
+if __name__ == "__main__":
+    main()
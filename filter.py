@@ -1,14 +1,19 @@
-from langchain_community.document_transformers import (
-    EmbeddingsRedundantFilter,
-    LongContextReorder
-)
-from langchain_community.embeddings import HuggingFaceBgeEmbeddings, HuggingFaceEmbeddings
-from langchain_community.retrievers import BM25Retriever
+import asyncio
+import os
+from typing import ClassVar
+
 from langchain_core.documents import Document
 from langchain_core.retrievers import BaseRetriever
+from langchain_core.runnables.config import run_in_executor
 
-from vector_store import create_vector_db
+from vector_store import EmbeddingProxy, create_vector_db, asearch_by_vector, embedding_context
 from splitter import split_documents
+from retrieval_cache import RetrievalCache, compute_index_version
+from categories import GOAL_ROUTES, categorize, route_for_goal
+from dedup import deduplicate_chunks
+from tracing import span, timed
+from profile_cards import card_documents, card_source_paths, load_cards, summarized_chunks
+from mmap_index import INDEX_FORMAT, MmapBM25Retriever, MmapVectorStore, index_path, load_index
 
 
 # ============================================================
@@ -30,72 +35,352 @@ def is_core_doc(doc: Document):
     return any(keyword in text for keywords in CORE_KEYWORDS.values() for keyword in keywords)
 
 
+# Fichas que se añaden cuando la pregunta no tiene objetivo (sin ruta)
+UNROUTED_CARD_CATEGORIES = {"PERFILES_COMPORTAMENTALES", "NORMAS_COMUNICACION"}
+
+
+def select_core_docs(texts, cards, limit=8):
+    """
+    Documentos core: las fichas compactas de perfiles, segmentos y normas
+    y, para las categorías sin ficha, los chunks con palabras clave core.
+    """
+    carded = {c.metadata["category"] for c in cards}
+    chunks = [d for d in texts if is_core_doc(d) and d.metadata["category"] not in carded]
+    return cards + chunks[:max(0, limit - len(cards))]
+
+
+# ============================================================
+# EMBEDDINGS LOCALES
+# ============================================================
+
+EMBEDDING_BACKENDS = ("torch", "onnx", "onnx-int8")
+
+
+def torch_embeddings():
+    """Modelos sentence-transformers (punto único para poder sustituirlos en benchmarks)."""
+    from langchain_community.embeddings import HuggingFaceBgeEmbeddings, HuggingFaceEmbeddings
+
+    dense_embeddings = HuggingFaceEmbeddings(model_name="all-MiniLM-L6-v2")
+    sparse_embeddings = HuggingFaceBgeEmbeddings(
+        model_name="BAAI/bge-large-en",
+        encode_kwargs={'normalize_embeddings': False}
+    )
+    return dense_embeddings, sparse_embeddings
+
+
+def local_embeddings(backend="torch"):
+    """
+    Modelos denso (all-MiniLM-L6-v2) y "esparso" (bge-large-en):
+    - "torch": sentence-transformers en PyTorch (por defecto)
+    - "onnx" / "onnx-int8": onnxruntime en CPU, opcionalmente cuantizado a int8
+    """
+    if backend not in EMBEDDING_BACKENDS:
+        raise ValueError(f"Backend de embeddings desconocido: {backend}")
+
+    if backend == "torch":
+        return torch_embeddings()
+
+    # La misma instrucción de consulta que HuggingFaceBgeEmbeddings (backend "torch")
+    from langchain_community.embeddings.huggingface import DEFAULT_QUERY_BGE_INSTRUCTION_EN
+    from onnx_embeddings import OnnxEmbeddings
+    quantize = backend == "onnx-int8"
+    dense_embeddings = OnnxEmbeddings(
+        "sentence-transformers/all-MiniLM-L6-v2", pooling="mean", normalize=True,
+        quantize=quantize, max_length=256,
+    )
+    sparse_embeddings = OnnxEmbeddings(
+        "BAAI/bge-large-en", pooling="cls", normalize=False, quantize=quantize,
+        query_instruction=DEFAULT_QUERY_BGE_INSTRUCTION_EN,
+    )
+    return dense_embeddings, sparse_embeddings
+
+
 # ============================================================
 # RETRIEVER MEJORADO
 # ============================================================
 
-def create_retriever(texts):
+def create_retriever(texts, cache=None, embedding_backend=None, reranker=None, mmap_index=None):
     """
     Retriever híbrido mejorado:
     - Recupera documentos por similitud híbrida
-    - Añade SIEMPRE documentos core
-    - Filtra redundancia
+    - Añade SIEMPRE documentos core (fichas compactas de `profile_cards`)
+    - Indexa un solo chunk por grupo de casi duplicados (MinHash, al crearlo)
     - Reordena para coherencia contextual
+    - Cachea resultados por pregunta normalizada y versión del índice
+
+    `embedding_backend` ("torch", "onnx", "onnx-int8") se toma por defecto
+    de la variable de entorno `RAG_EMBEDDINGS_BACKEND`.
+
+    Con `reranker` (p. ej. `CrossEncoderReranker`) los candidatos se puntúan
+    frente a la pregunta y solo pasan los `top_n` mejores, core incluidos.
+    Si no se indica, `RAG_RERANK_TOP_N` activa el reranker por defecto.
+
+    Con `mmap_index` (o `RAG_MMAP_INDEX=1`) los vectores, el BM25 y los
+    textos de los chunks se leen de un índice en store/ abierto con mmap,
+    compartido entre workers, en lugar de Chroma y BM25 en memoria.
+
+    `metadata["retrieval_mode"]` ("bm25" o "core") pide un escalón
+    degradado, sin embeddings ni reranking (lo usa el ejecutor de `slo`).
+
+    Con `metadata["candidates_only"]` devuelve solo los candidatos de la
+    búsqueda, en su orden (y reranqueados si hay reranker): sin documentos
+    core, sin reordenar y sin caché. Es lo que puntúa `evaluate_retrieval.py`.
     """
+    embedding_backend = embedding_backend or os.environ.get("RAG_EMBEDDINGS_BACKEND", "torch")
+    if mmap_index is None:
+        mmap_index = os.environ.get("RAG_MMAP_INDEX") == "1"
+    if reranker is None and os.environ.get("RAG_RERANK_TOP_N"):
+        from reranker import CrossEncoderReranker
+        reranker = CrossEncoderReranker(top_n=int(os.environ["RAG_RERANK_TOP_N"]))
+
+    # === Casi duplicados: ya no hace falta filtrar redundancias en cada pregunta ===
+    # Los chunks de `split_documents` (con chunk_id) ya vienen deduplicados
+    if not all(d.metadata.get("chunk_id") for d in texts):
+        texts = deduplicate_chunks(texts)
+
+    # === Categoría de cada chunk (partición de búsqueda) ===
+    for d in texts:
+        d.metadata.setdefault("category", categorize(d))
+
+    # === Caché de resultados (se invalida si cambia el índice o el reranker) ===
+    if cache is None:
+        cache = RetrievalCache()
+    rerank_config = (reranker.model_name, reranker.top_n) if reranker is not None else None
+    cards, cards_version = load_cards(card_source_paths(texts))
+    cache.bind(compute_index_version(texts, "filter", embedding_backend, rerank_config, cards_version))
 
     # === Embeddings densos y esparsos ===
-    dense_embeddings = HuggingFaceEmbeddings(model_name="all-MiniLM-L6-v2")
-    sparse_embeddings = HuggingFaceBgeEmbeddings(
-        model_name="BAAI/bge-large-en",
-        encode_kwargs={'normalize_embeddings': False}
-    )
+    dense_embeddings, sparse_embeddings = local_embeddings(embedding_backend)
+
+    # Cada backend tiene sus propias colecciones: los vectores no son intercambiables
+    suffix = "" if embedding_backend == "torch" else "_" + embedding_backend.replace("-", "_")
+
+    # Particiones: BM25 propio por categoría; en Chroma se filtra por metadatos
+    partitions = {}
+    for d in texts:
+        partitions.setdefault(d.metadata["category"], []).append(d)
+    route_k = {}
+    for route in GOAL_ROUTES.values():
+        for category, k in route.items():
+            route_k[category] = max(route_k.get(category, 0), k)
+
+    if mmap_index:
+        index = load_index(
+            index_path("filter" + suffix), texts,
+            {"dense": dense_embeddings, "sparse": sparse_embeddings},
+            version=compute_index_version(texts, "mmap", INDEX_FORMAT, embedding_backend),
+        )
+        dense_vs = MmapVectorStore(index, "dense", EmbeddingProxy(dense_embeddings))
+        sparse_vs = MmapVectorStore(index, "sparse", EmbeddingProxy(sparse_embeddings))
+        bm25_retriever = MmapBM25Retriever(index=index)
+        bm25_partitions = {
+            category: MmapBM25Retriever(index=index, k=route_k[category], category=category)
+            for category in partitions if category in route_k
+        }
+    else:
+        from langchain_community.retrievers import BM25Retriever
 
-    dense_vs = create_vector_db(texts, collection_name="dense", embeddings=dense_embeddings)
-    sparse_vs = create_vector_db(texts, collection_name="sparse", embeddings=sparse_embeddings)
+        dense_vs = create_vector_db(texts, collection_name="dense" + suffix, embeddings=dense_embeddings)
+        sparse_vs = create_vector_db(texts, collection_name="sparse" + suffix, embeddings=sparse_embeddings)
+        bm25_retriever = BM25Retriever.from_documents(texts)
+        bm25_partitions = {
+            category: BM25Retriever.from_documents(docs, k=route_k[category])
+            for category, docs in partitions.items() if category in route_k
+        }
 
     dense_retriever = dense_vs.as_retriever(search_kwargs={"k": 3})
     sparse_retriever = sparse_vs.as_retriever(search_kwargs={"k": 3})
-    bm25_retriever = BM25Retriever.from_texts([t.page_content for t in texts])
 
-    redundant_filter = EmbeddingsRedundantFilter(embeddings=sparse_embeddings)
+    from langchain_community.document_transformers import LongContextReorder
     reordering = LongContextReorder()
 
-    # === SELECCIÓN PREVIA: documentos core ===
-    core_docs = [d for d in texts if is_core_doc(d)]
-    core_docs = core_docs[:8]  # evita meter demasiado contexto
+    # === SELECCIÓN PREVIA: documentos core (fichas compactas si las hay) ===
+    core_docs = select_core_docs(texts, card_documents(cards))
+    summarized = summarized_chunks(texts, cards)
 
     # ============================================================
     # Modern Retriever con priorización
     # ============================================================
 
+    def route_of(run_manager):
+        """Particiones a consultar según el `current_goal` de la ejecución (None = todo)."""
+        metadata = getattr(run_manager, "metadata", None) or {}
+        route = route_for_goal(metadata.get("current_goal"))
+        if route is None:
+            return None, None
+        route = {c: k for c, k in route.items() if c in partitions}
+        return route or None, metadata.get("current_goal")
+
+    def mode_of(run_manager):
+        """Escalón de recuperación pedido por el ejecutor con plazos (`slo`)."""
+        metadata = getattr(run_manager, "metadata", None) or {}
+        return metadata.get("retrieval_mode") or "full"
+
+    def candidates_of(run_manager):
+        """¿Solo los candidatos de la búsqueda (evaluación), sin montar el contexto?"""
+        metadata = getattr(run_manager, "metadata", None) or {}
+        return bool(metadata.get("candidates_only"))
+
+    def cache_key(query, goal):
+        return f"{goal}::{query}" if goal else query
+
+    def routed_search(query, route):
+        docs = []
+        for category, k in route.items():
+            where = {"category": category}
+            with span("dense", category=category):
+                docs += dense_vs.similarity_search(query, k=k, filter=where)
+            with span("sparse", category=category):
+                docs += sparse_vs.similarity_search(query, k=k, filter=where)
+            with span("bm25", category=category):
+                docs += bm25_partitions[category].invoke(query)[:k]
+        return docs
+
+    async def arouted_search(query, route):
+        searches = []
+        for category, k in route.items():
+            where = {"category": category}
+            searches += [
+                timed("dense", asearch_by_vector(dense_vs, query, k=k, filter=where), category=category),
+                timed("sparse", asearch_by_vector(sparse_vs, query, k=k, filter=where), category=category),
+                timed("bm25", bm25_partitions[category].ainvoke(query), category=category),
+            ]
+        results = await asyncio.gather(*searches)
+        ks = [k for k in route.values() for _ in range(3)]
+        return [d for k, result in zip(ks, results) for d in result[:k]]
+
+    def bm25_search(query, route):
+        """Escalón "bm25": solo búsqueda léxica, sin embeddings de la pregunta."""
+        docs = []
+        for category, k in (route or {}).items():
+            with span("bm25", category=category):
+                docs += bm25_partitions[category].invoke(query)[:k]
+        if docs:
+            return docs, route
+        with span("bm25"):
+            return bm25_retriever.invoke(query), None
+
+    def prioritize(query, docs, route=None, key=None, degraded=False, candidates_only=False):
+        # 2 — Añadir documentos core SIEMPRE (solo los de las particiones consultadas)
+        if candidates_only:
+            core = []
+        elif route is None:
+            core = [d for d in core_docs if "card" not in d.metadata or d.metadata["category"] in UNROUTED_CARD_CATEGORIES]
+        else:
+            core = [d for d in core_docs if d.metadata["category"] in route]
+
+        # Las fichas sustituyen a los chunks crudos de las secciones que resumen
+        carded = {d.metadata["category"] for d in core if "card" in d.metadata}
+        docs = core + [
+            d for d in docs
+            if d.metadata.get("category") not in carded or d.metadata.get("chunk_id") not in summarized
+        ]
+
+        # 3 — Eliminar duplicados preservando orden
+        seen = set()
+        unique_docs = []
+        for d in docs:
+            if d.page_content not in seen:
+                unique_docs.append(d)
+                seen.add(d.page_content)
+
+        # 4 — Reranking opcional: menos chunks y más relevantes en el prompt
+        if reranker is not None and not degraded:
+            with span("rerank", candidates=len(unique_docs)):
+                unique_docs = reranker.rerank(query, unique_docs)
+
+        if candidates_only:
+            return unique_docs
+
+        # 5 — Reorganizar para coherencia
+        with span("reorder"):
+            unique_docs = reordering.transform_documents(unique_docs)
+
+        # Los resultados degradados no se cachean: la próxima vez, búsqueda completa
+        if not degraded:
+            cache.put(key or query, unique_docs)
+        return unique_docs
+
+    def degraded_search(query, route, mode, key):
+        """Escalones "bm25" y "core" (el "full" es la búsqueda híbrida normal)."""
+        if mode == "core":
+            return prioritize(query, [], route, key, degraded=True)
+        docs, route = bm25_search(query, route)
+        return prioritize(query, docs, route, key, degraded=True)
+
     class ModernHybridRetriever(BaseRetriever):
+        # Escalones que acepta en metadata["retrieval_mode"], de mejor a peor
+        modes: ClassVar[tuple] = ("full", "bm25", "core")
+
         def _get_relevant_documents(self, query, *, run_manager=None):
 
-            # 1 — Recuperación híbrida clásica
-            docs = (
-                dense_retriever.invoke(query)
-                + sparse_retriever.invoke(query)
-                + bm25_retriever.invoke(query)
-            )
+            # 0 — Preguntas repetidas o regeneradas: resultado cacheado
+            route, goal = route_of(run_manager)
+            key = cache_key(query, goal)
+            candidates = candidates_of(run_manager)
+            if not candidates:
+                with span("cache") as s:
+                    cached = cache.get(key)
+                    s["hit"] = cached is not None
+                if cached is not None:
+                    return cached
 
+            # Escalones degradados: sin embeddings ni reranking
+            mode = mode_of(run_manager)
+            if mode != "full":
+                return degraded_search(query, route, mode, key)
 
-            # 2 — Añadir documentos core SIEMPRE
-            docs = core_docs + docs
+            # Un único embedding de la pregunta por modelo en toda la petición
+            with embedding_context():
 
-            # 3 — Eliminar duplicados preservando orden
-            seen = set()
-            unique_docs = []
-            for d in docs:
-                if d.page_content not in seen:
-                    unique_docs.append(d)
-                    seen.add(d.page_content)
+                # 1 — Con objetivo: solo las particiones relevantes
+                docs = routed_search(query, route) if route else []
 
-            # 4 — Filtrar redundancias
-            unique_docs = redundant_filter.transform_documents(unique_docs)
+                # 1b — Recuperación híbrida clásica sobre todo el corpus
+                if not docs:
+                    route = None
+                    with span("dense"):
+                        docs = dense_retriever.invoke(query)
+                    with span("sparse"):
+                        docs += sparse_retriever.invoke(query)
+                    with span("bm25"):
+                        docs += bm25_retriever.invoke(query)
 
-            # 5 — Reorganizar para coherencia
-            unique_docs = reordering.transform_documents(unique_docs)
+                return prioritize(query, docs, route, key, candidates_only=candidates)
 
-            return unique_docs
+        async def _aget_relevant_documents(self, query, *, run_manager=None):
+
+            route, goal = route_of(run_manager)
+            key = cache_key(query, goal)
+            candidates = candidates_of(run_manager)
+            if not candidates:
+                with span("cache") as s:
+                    cached = cache.get(key)
+                    s["hit"] = cached is not None
+                if cached is not None:
+                    return cached
+
+            mode = mode_of(run_manager)
+            if mode != "full":
+                return degraded_search(query, route, mode, key)
+
+            with embedding_context():
+
+                # 1 — Las búsquedas son independientes: se lanzan en paralelo
+                docs = await arouted_search(query, route) if route else []
+
+                if not docs:
+                    route = None
+                    results = await asyncio.gather(
+                        timed("dense", asearch_by_vector(dense_vs, query, k=3)),
+                        timed("sparse", asearch_by_vector(sparse_vs, query, k=3)),
+                        timed("bm25", bm25_retriever.ainvoke(query)),
+                    )
+                    docs = [d for result in results for d in result]
+
+                # El reranking ejecuta el modelo: fuera del event loop
+                if reranker is not None:
+                    return await run_in_executor(None, prioritize, query, docs, route, key, False, candidates)
+                return prioritize(query, docs, route, key, candidates_only=candidates)
 
     return ModernHybridRetriever()
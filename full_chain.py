@@ -1,159 +1,331 @@
+import logging
 import os
 import re
 from dotenv import load_dotenv
 from langchain_community.chat_message_histories import ChatMessageHistory
+from langchain_core.messages import AIMessage
 
-from basic_chain import get_model
-from rag_chain import make_rag_chain
+from basic_chain import basic_chain, get_model
+from intent import classify_intent, content_terms
+from memory import SummaryBufferMemory
+from sessions import SessionManager
+from rag_chain import make_rag_chain, make_light_chain
 from local_loader import load_txt_files
+from splitter import chunk_id
+from tracing import span, trace_request, tracing_config
+from slo import DeadlineExecutor, degradation, enabled as slo_enabled, fallback_input, is_degraded
 
 
-# --------------------------------------------------------
-# DETECTORES DE INTENCIÓN Y EXTRACTORES DE SUJETO / PERFIL
-# --------------------------------------------------------
-
-def extract_subject_description(text):
-    """
-    Detecta si el usuario describe a una persona real para análisis.
-    Ejemplos:
-    - "soy un hombre de 29 años..."
-    - "una mujer de 40 años colaboradora..."
-    """
-
-    patterns = [
-        r"soy\s+[^\n]+",
-        r"persona\s+[^\n]+",
-        r"(hombre|mujer)[^\n]+años",
-        r"\b\d{2}\s*años\b",
-        r"socio",
-        r"colaborador",
-        r"voluntari[oa]",
-    ]
+# Reutilización de contexto entre turnos
+RRF_K = 60                 # constante de Reciprocal Rank Fusion para puntuar chunks
+FOLLOWUP_EXTRA_DOCS = 4    # chunks nuevos que puede añadir una búsqueda de seguimiento
+MAX_REUSED_DOCS = 12       # tope de chunks tras fusionar varios seguimientos
 
-    for p in patterns:
-        match = re.search(p, text.lower())
-        if match:
-            return text  # almacenamos toda la descripción
-    return None
-
-
-def user_is_asking_for_profile(text):
-    """
-    Detecta si el usuario quiere identificar un perfil.
-    """
-    keywords = [
-        "qué perfil", "que perfil", "que comportamiento", "qué comportamiento",
-        "a qué perfil corresponde", "que sería", "qué sería"
-    ]
-    return any(k in text.lower() for k in keywords)
 
+# --------------------------------------------------------
+# CONTENEDOR DE ESTADO (una instancia por sesión)
+# --------------------------------------------------------
 
-def user_is_asking_for_message(text):
-    """
-    Detecta si el usuario quiere generar un mensaje.
-    """
-    keywords = [
-        "haz un mensaje", "genera un mensaje", "mensaje para", "email",
-        "correo", "escribe un mensaje", "invitar", "convocar", "campaña"
-    ]
-    return any(k in text.lower() for k in keywords)
+class MemoryWrappedChain:
+    def __init__(self, rag_chain, chat_memory, light_chain=None, retriever=None,
+                 executor=None, fallback_chain=None):
+        self.rag_chain = rag_chain
+        self.light_chain = light_chain or rag_chain
+        self.chat_memory = chat_memory
+        self.retriever = retriever
+
+        # Plazos por etapa (slo.DeadlineExecutor); sin él, cada etapa espera lo que tarde
+        self.executor = executor
+        self.fallback_chain = fallback_chain
+        self.last_degraded = False         # ¿la última respuesta salió degradada?
+
+        # Contexto recuperado en el turno anterior: [(chunk_id, score, doc)].
+        # No se persiste: una sesión rehidratada vuelve a buscar.
+        self.last_retrieval = []
+
+        self.current_subject = ""          # Descripción textual del sujeto
+        self.current_behavioral_profile = ""  # Perfil comportamental asignado
+        self.current_goal = ""             # Objetivo comunicacional actual (mensaje/campaña/etc.)
+
+    def get_state(self):
+        """Estado serializable de la sesión (para el gestor de sesiones)."""
+        return {
+            "current_subject": self.current_subject,
+            "current_behavioral_profile": self.current_behavioral_profile,
+            "current_goal": self.current_goal,
+            "memory": self.chat_memory.get_state(),
+        }
+
+    def set_state(self, state):
+        self.current_subject = state.get("current_subject", "")
+        self.current_behavioral_profile = state.get("current_behavioral_profile", "")
+        self.current_goal = state.get("current_goal", "")
+        self.chat_memory.set_state(state.get("memory", {}))
+
+    def update_state_from_query(self, query):
+
+        intent = classify_intent(query, self.current_behavioral_profile)
+
+        # A) Detectamos si describe un sujeto nuevo
+        if intent.subject:
+            self.current_subject = intent.subject
+            self.current_behavioral_profile = ""  # obligamos recalcular si lo piden
+
+        # B) Tipo de consulta (los turnos triviales no cambian el objetivo)
+        if intent.goal:
+            self.current_goal = intent.goal
+
+        return intent
+
+    def chain_for(self, intent):
+        if intent.route == "ligero":
+            return self.light_chain
+        return self.rag_chain
+
+    def answer_from_state(self, intent):
+        """Respuestas que no necesitan modelo: salen del estado de la sesión."""
+        if intent.route == "estado" and intent.kind == "perfil_actual":
+            return AIMessage(
+                content=f"Está pensado para el perfil identificado: **{self.current_behavioral_profile}**.\n\n"
+                        f"PERFIL_ACTUAL: {self.current_behavioral_profile}"
+            )
+        return None
+
+    # ---- RECUPERACIÓN CON REUTILIZACIÓN ENTRE TURNOS ----
+
+    def retrieval_query(self, user_query, intent):
+        """
+        Consulta a lanzar para este turno, o None si es un seguimiento sin
+        contenido nuevo ("¿para qué perfil es ese mensaje?") y basta con el
+        contexto del turno anterior. Los seguimientos con contenido se
+        siembran con el sujeto activo.
+        """
+        if not (intent.followup and self.last_retrieval):
+            return user_query
+        if not content_terms(user_query):
+            return None
+        return f"{self.current_subject} {user_query}".strip()
+
+    def remember_retrieval(self, docs, merge=False):
+        """Guarda los chunks con su puntuación RRF; en seguimientos se fusionan con los previos."""
+        entries = list(self.last_retrieval) if merge else []
+        positions = {cid: i for i, (cid, _, _) in enumerate(entries)}
+        added = 0
+
+        for rank, doc in enumerate(docs):
+            cid = chunk_id(doc)
+            score = 1.0 / (RRF_K + rank + 1)
+            if cid in positions:
+                i = positions[cid]
+                entries[i] = (cid, entries[i][1] + score, entries[i][2])
+            elif not merge or added < FOLLOWUP_EXTRA_DOCS:
+                positions[cid] = len(entries)
+                entries.append((cid, score, doc))
+                added += 1
+
+        if merge and len(entries) > MAX_REUSED_DOCS:
+            # Se descartan los de menor puntuación sin alterar el orden
+            keep = set(sorted(range(len(entries)), key=lambda i: -entries[i][1])[:MAX_REUSED_DOCS])
+            entries = [e for i, e in enumerate(entries) if i in keep]
+
+        self.last_retrieval = entries
+        return [doc for _, _, doc in entries]
+
+    def retrieval_config(self):
+        """El objetivo actual decide en qué particiones del corpus se busca."""
+        return {"metadata": {"current_goal": self.current_goal}} if self.current_goal else None
+
+    def remember_or_drop(self, docs, mode, merge):
+        # El contexto degradado no se reutiliza: el siguiente turno vuelve a buscar
+        if mode != "full":
+            self.last_retrieval = []
+            return docs, mode
+        return self.remember_retrieval(docs, merge=merge), mode
+
+    def retrieve(self, user_query, intent):
+        """(documentos, escalón de recuperación: "full", "bm25", "core" o "none")."""
+        merge = intent.followup and bool(self.last_retrieval)
+        query = self.retrieval_query(user_query, intent)
+        if query is None:
+            return [doc for _, _, doc in self.last_retrieval], "full"
+        config = tracing_config(self.retrieval_config())
+        if self.executor is None:
+            return self.remember_retrieval(self.retriever.invoke(query, config), merge=merge), "full"
+        docs, mode = self.executor.retrieve(self.retriever, query, config)
+        return self.remember_or_drop(docs, mode, merge)
+
+    async def aretrieve(self, user_query, intent):
+        merge = intent.followup and bool(self.last_retrieval)
+        query = self.retrieval_query(user_query, intent)
+        if query is None:
+            return [doc for _, _, doc in self.last_retrieval], "full"
+        config = tracing_config(self.retrieval_config())
+        if self.executor is None:
+            return self.remember_retrieval(await self.retriever.ainvoke(query, config), merge=merge), "full"
+        docs, mode = await self.executor.aretrieve(self.retriever, query, config)
+        return self.remember_or_drop(docs, mode, merge)
+
+    def respond(self, chain, inputs, mode="full"):
+        if self.executor is None:
+            return chain.invoke(inputs, tracing_config())
+        return self.executor.respond(chain, self.fallback_chain, inputs, mode, tracing_config())
+
+    async def arespond(self, chain, inputs, mode="full"):
+        if self.executor is None:
+            return await chain.ainvoke(inputs, tracing_config())
+        return await self.executor.arespond(chain, self.fallback_chain, inputs, mode, tracing_config())
+
+    def prepare_inputs(self, user_query):
+
+        # 2. Guardar mensaje usuario
+        self.chat_memory.add_user_message(user_query)
+
+        # 3. Historial compacto (resumen + ventana reciente, cacheado)
+        history_text = self.chat_memory.format_history()
+
+        # 4. Entrada del RAG con estado completo del usuario
+        return {
+            "question": user_query,
+            "chat_history": history_text,
+            "current_subject": self.current_subject,
+            "current_behavioral_profile": self.current_behavioral_profile,
+            "current_goal": self.current_goal,
+        }
+
+    def record_response(self, content):
+
+        # 5. Actualizar perfil comportamental si el asistente lo identifica
+        if "PERFIL_ACTUAL:" in content:
+            extracted = re.search(r"PERFIL_ACTUAL:\s*(.*)", content)
+            if extracted:
+                self.current_behavioral_profile = extracted.group(1).strip()
+
+        # 6. Guardar respuesta (notifica el cambio de estado de la sesión)
+        self.chat_memory.add_ai_message(content)
+
+    def start_turn(self, user_query, trace):
+        """Intención, estado y entradas del turno (cronometrados en la traza)."""
+        with span("intent"):
+            intent = self.update_state_from_query(user_query)
+        with span("memory"):
+            inputs = self.prepare_inputs(user_query)
+        trace.set(route=intent.route, goal=self.current_goal)
+        return intent, inputs
+
+    def finish_turn(self, content):
+        with span("record"):
+            self.record_response(content)
+
+    def invoke(self, user_query):
+        with trace_request("turn") as trace:
+
+            # 1. Actualizar estado semántico y decidir la ruta
+            intent, inputs = self.start_turn(user_query, trace)
+
+            response = self.answer_from_state(intent)
+            if response is None:
+                mode = "full"
+                if intent.route == "rag" and self.retriever is not None:
+                    inputs["documents"], mode = self.retrieve(user_query, intent)
+                response = self.respond(self.chain_for(intent), inputs, mode)
+
+            self.last_degraded = is_degraded(response)
+            self.finish_turn(response.content)
+            return response
 
+    async def ainvoke(self, user_query):
+        with trace_request("turn") as trace:
+            intent, inputs = self.start_turn(user_query, trace)
 
-def user_is_comparing_profiles(text):
-    """
-    Detecta comparaciones.
-    """
-    keywords = ["compara", "diferencia", "qué diferencia", "cuál es mejor"]
-    return any(k in text.lower() for k in keywords)
+            response = self.answer_from_state(intent)
+            if response is None:
+                mode = "full"
+                if intent.route == "rag" and self.retriever is not None:
+                    inputs["documents"], mode = await self.aretrieve(user_query, intent)
+                response = await self.arespond(self.chain_for(intent), inputs, mode)
 
+            self.last_degraded = is_degraded(response)
+            self.finish_turn(response.content)
+            return response
 
-def user_is_preparing_campaign(text):
-    """
-    Detecta consultas de campaña.
-    """
-    keywords = ["campaña", "segmentación", "target", "público objetivo"]
-    return any(k in text.lower() for k in keywords)
+    async def astream(self, user_query):
+        """Emite los chunks del modelo y guarda la respuesta completa al terminar."""
+        with trace_request("turn", stream=True) as trace:
+            intent, inputs = self.start_turn(user_query, trace)
+
+            response = self.answer_from_state(intent)
+            if response is not None:
+                self.last_degraded = False
+                yield response
+                self.finish_turn(response.content)
+                return
+
+            mode = "full"
+            if intent.route == "rag" and self.retriever is not None:
+                inputs["documents"], mode = await self.aretrieve(user_query, intent)
+
+            # En streaming no hay petición duplicada: si el modelo falla antes
+            # del primer token (o no hubo recuperación) responde el fallback_prompt
+            chain, chain_inputs = self.chain_for(intent), inputs
+            fallback = self.executor is not None and mode == "none"
+            if fallback:
+                chain, chain_inputs = self.fallback_chain, fallback_input(inputs)
+
+            parts = []
+            try:
+                async for chunk in chain.astream(chain_inputs, tracing_config()):
+                    parts.append(chunk.content)
+                    yield chunk
+            except Exception:
+                if parts or fallback or self.executor is None:
+                    raise
+                logging.exception("Fallo del modelo antes del primer token: se usa el prompt de respaldo")
+                fallback = True
+                async for chunk in self.fallback_chain.astream(fallback_input(inputs), tracing_config()):
+                    parts.append(chunk.content)
+                    yield chunk
+
+            if self.executor is not None:
+                self.last_degraded = degradation(retrieval=mode, fallback=fallback)["degraded"]
+            self.finish_turn("".join(parts))
 
 
 # --------------------------------------------------------
 # CADENA PRINCIPAL
 # --------------------------------------------------------
 
-def create_full_chain(retriever, openai_api_key=None, chat_memory=None):
-
+def make_session_factory(retriever, openai_api_key=None, executor=None):
+    """
+    Devuelve una función que crea sesiones nuevas (MemoryWrappedChain)
+    compartiendo modelo, retriever, cadenas y ejecutor con plazos entre
+    todas ellas. Sin `executor`, se crea uno salvo con `RAG_SLO=0`.
+    """
     model = get_model("ChatGPT", openai_api_key=openai_api_key)
 
-    if chat_memory is None:
-        chat_memory = ChatMessageHistory()
-
     rag_chain = make_rag_chain(model, retriever)
+    light_chain = make_light_chain(model)
+    fallback_chain = basic_chain(model)
+    if executor is None and slo_enabled():
+        executor = DeadlineExecutor()
 
-    # ---- CONTENEDOR DE ESTADO ----
-    class MemoryWrappedChain:
-        def __init__(self, rag_chain, chat_memory):
-            self.rag_chain = rag_chain
-            self.chat_memory = chat_memory
-
-            self.current_subject = ""          # Descripción textual del sujeto
-            self.current_behavioral_profile = ""  # Perfil comportamental asignado
-            self.current_goal = ""             # Objetivo comunicacional actual (mensaje/campaña/etc.)
-
-        def update_state_from_query(self, query):
-
-            # A) Detectamos si describe un sujeto nuevo
-            subject = extract_subject_description(query)
-            if subject:
-                self.current_subject = subject
-                self.current_behavioral_profile = ""  # obligamos recalcular si lo piden
-
-            # B) Identificamos tipo de consulta
-            if user_is_asking_for_profile(query):
-                self.current_goal = "identificar_perfil"
-
-            elif user_is_asking_for_message(query):
-                self.current_goal = "generar_mensaje"
-
-            elif user_is_preparing_campaign(query):
-                self.current_goal = "asesoramiento_campaña"
-
-            elif user_is_comparing_profiles(query):
-                self.current_goal = "comparar_perfiles"
+    def new_session(chat_memory=None):
+        if chat_memory is None:
+            chat_memory = ChatMessageHistory()
 
-        def invoke(self, user_query):
+        # Ventana acotada + resumen incremental de los turnos antiguos
+        memory = SummaryBufferMemory(chat_memory=chat_memory, llm=model)
+        return MemoryWrappedChain(rag_chain, memory, light_chain, retriever, executor, fallback_chain)
 
-            # 1. Actualizar estado semántico
-            self.update_state_from_query(user_query)
+    return new_session
 
-            # 2. Guardar mensaje usuario
-            self.chat_memory.add_user_message(user_query)
 
-            # 3. Historial compacto
-            history_text = "\n".join(
-                f"{m.type.upper()}: {m.content}"
-                for m in self.chat_memory.messages[-6:]
-            )
-
-            # 4. Ejecutar RAG con estado completo del usuario
-            response = self.rag_chain.invoke({
-                "question": user_query,
-                "chat_history": history_text,
-                "current_subject": self.current_subject,
-                "current_behavioral_profile": self.current_behavioral_profile,
-                "current_goal": self.current_goal,
-            })
-
-            # 5. Guardar respuesta
-            self.chat_memory.add_ai_message(response.content)
+def create_session_manager(retriever, openai_api_key=None, **kwargs):
+    """Gestor de sesiones concurrentes (LRU en memoria + SQLite)."""
+    return SessionManager(make_session_factory(retriever, openai_api_key), **kwargs)
 
-            # 6. Actualizar perfil comportamental si el asistente lo identifica
-            if "PERFIL_ACTUAL:" in response.content:
-                extracted = re.search(r"PERFIL_ACTUAL:\s*(.*)", response.content)
-                if extracted:
-                    self.current_behavioral_profile = extracted.group(1).strip()
 
-            return response
-
-    return MemoryWrappedChain(rag_chain, chat_memory)
+def create_full_chain(retriever, openai_api_key=None, chat_memory=None):
+    return make_session_factory(retriever, openai_api_key)(chat_memory)
 
 
 # -----------------
@@ -164,10 +336,25 @@ def ask_question(chain, query):
     return chain.invoke(query)
 
 
+async def aask_question(chain, query):
+    return await chain.ainvoke(query)
+
+
 # -----------------
 # LOCAL TEST
 # -----------------
 
+# Conversación de ejemplo (también la usan benchmark.py y las pruebas de carga)
+DEMO_CONVERSATION = [
+    "Soy un hombre de 29 años socio, padre, vivo en Madrid y colaboro cada año.",
+    "¿Qué perfil sería yo?",
+    "Haz un mensaje para él invitándole a un evento de recaudación",
+    "¿Para qué perfil es ese mensaje?",
+    "Compárame este perfil con un adulto mayor activo",
+    "Quiero una campaña para este perfil",
+]
+
+
 def main():
     load_dotenv()
 
@@ -181,16 +368,7 @@ def main():
 
     chain = create_full_chain(retriever)
 
-    queries = [
-        "Soy un hombre de 29 años socio, padre, vivo en Madrid y colaboro cada año.",
-        "¿Qué perfil sería yo?",
-        "Haz un mensaje para él invitándole a un evento de recaudación",
-        "¿Para qué perfil es ese mensaje?",
-        "Compárame este perfil con un adulto mayor activo",
-        "Quiero una campaña para este perfil",
-    ]
-
-    for q in queries:
+    for q in DEMO_CONVERSATION:
         response = ask_question(chain, q)
         console.print(Markdown(response.content))
 
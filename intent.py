@@ -0,0 +1,164 @@
+import re
+import unicodedata
+from collections import namedtuple
+
+
+# --------------------------------------------------------
+# CLASIFICADOR DE INTENCIÓN (precompilado)
+# --------------------------------------------------------
+#
+# Todas las reglas se compilan una sola vez al importar el módulo y se
+# evalúan sobre el texto normalizado (minúsculas, sin tildes).
+#
+# Rutas posibles:
+# - "rag":    recuperación híbrida + prompt completo.
+# - "ligero": saludos, agradecimientos... prompt corto sin recuperación.
+# - "estado": se responde directamente con el estado de la sesión.
+
+Intent = namedtuple("Intent", ["route", "goal", "kind", "subject", "followup"])
+
+
+def normalize_text(text):
+    """Minúsculas y sin tildes, para que las reglas no dependan de la ortografía."""
+    text = unicodedata.normalize("NFD", (text or "").lower())
+    return "".join(c for c in text if unicodedata.category(c) != "Mn").strip()
+
+
+def _alternation(keywords):
+    return "|".join(re.escape(k) for k in keywords)
+
+
+# Objetivos comunicacionales, en orden de prioridad
+GOAL_KEYWORDS = [
+    ("identificar_perfil", [
+        "que perfil", "que comportamiento", "a que perfil corresponde", "que seria",
+    ]),
+    ("generar_mensaje", [
+        "haz un mensaje", "genera un mensaje", "mensaje para", "email",
+        "correo", "escribe un mensaje", "invitar", "convocar", "campana",
+    ]),
+    ("asesoramiento_campaña", ["campana", "segmentacion", "target", "publico objetivo"]),
+    ("comparar_perfiles", ["compara", "diferencia", "cual es mejor"]),
+]
+
+_GOAL_RE = re.compile(
+    "|".join(f"(?P<g{i}>{_alternation(keywords)})" for i, (_, keywords) in enumerate(GOAL_KEYWORDS))
+)
+
+_SUBJECT_RE = re.compile(
+    r"soy\s+[^\n]+"
+    r"|persona\s+[^\n]+"
+    r"|(hombre|mujer)[^\n]+anos"
+    r"|\b\d{2}\s*anos\b"
+    r"|socio"
+    r"|colaborador"
+    r"|voluntari[oa]"
+)
+
+# Turnos triviales: el mensaje completo es un saludo, agradecimiento o despedida
+_TRIVIAL_RE = {
+    "saludo": re.compile(
+        r"^(hola|buenas|buenos dias|buenas tardes|buenas noches|hey|que tal|hola,? que tal)[\s!¡.,?¿]*$"
+    ),
+    "agradecimiento": re.compile(
+        r"^(muchas |mil )?(gracias|perfecto|genial|vale|ok|de acuerdo|estupendo|entendido)"
+        r"( gracias| muchas gracias)?[\s!¡.,]*$"
+    ),
+    "despedida": re.compile(r"^(adios|hasta luego|hasta pronto|nos vemos|chao)[\s!¡.,]*$"),
+}
+
+# Seguimientos que se responden con el estado de la sesión
+_PROFILE_FOLLOWUP_RE = re.compile(
+    r"(para|a) (que|cual) perfil (es|era|va|iba)"
+    r"|que perfil (le |me )?(has|habias|hemos) (asignado|identificado|dicho)"
+    r"|cual (es|era) (el|su|mi) perfil"
+)
+
+
+# Referencias anafóricas a turnos anteriores ("él", "ese perfil", "lo anterior"...)
+_ANAPHORA_RE = re.compile(
+    r"\b(él|ella|ellos|ellas|ese|esa|eso|esos|esas|este|esta|esto|estos|estas"
+    r"|aquel|aquella|dicho|dicha|lo anterior|lo mismo|el anterior|la anterior)\b"
+)
+
+# Pronombres enclíticos de 3.ª persona ("resumirlo", "hazlo", "adáptalo"), sobre
+# texto normalizado. Infinitivos y gerundios con cualquier verbo; imperativos
+# solo de verbos habituales al retocar una respuesta ("modelo", "escuela" y
+# demás sustantivos en -elo/-ela no cuentan).
+_CLITIC = r"(?:me|te|se|nos)?(?:lo|la|los|las|le|les)\b"
+_CLITIC_RE = re.compile(
+    r"\b\w{2,}(?:ar|er|ir|ando|iendo)" + _CLITIC +
+    r"|\b(?:haz|di|pon|da|dame|adapta|resume|cambia|mejora|reescribe|escribe|redacta|reformula"
+    r"|acorta|alarga|amplia|simplifica|traduce|explica|detalla|desarrolla|ajusta|modifica|corrige"
+    r"|revisa|repite|personaliza|convierte|aplica|enfoca|dirige|orienta|manda|envia|compara)" + _CLITIC
+)
+
+# Palabras sin contenido para la búsqueda (ya normalizadas, sin tildes)
+_STOPWORDS = frozenset("""
+    el la los las un una unos unas lo le les de del al a en con por para sin sobre entre
+    y o u ni que como cual cuales quien donde cuando porque pero mas muy ya se su sus mi mis
+    tu tus me te nos es son era ser sera seria esta estan hay yo el ella ellos ellas ese esa
+    eso esos esas este esta esto estos estas aquel aquella dicho dicha anterior mismo misma
+    quiero queria puedes podrias haz hazme dame dime genera escribe prepara mensaje mensajes
+    perfil perfiles campana ahora tambien otro otra
+""".split())
+
+
+def content_terms(text):
+    """Términos con contenido para la búsqueda (sin stopwords ni anáforas)."""
+    return [t for t in re.findall(r"\w+", normalize_text(text)) if len(t) > 2 and t not in _STOPWORDS]
+
+
+def is_followup(text):
+    """Detecta si la consulta se apoya en turnos anteriores."""
+    return bool(_ANAPHORA_RE.search((text or "").lower()) or _CLITIC_RE.search(normalize_text(text)))
+
+
+assert is_followup("¿Puedes resumirlo?")
+assert is_followup("Hazlo más corto")
+assert is_followup("Adáptalo a jóvenes")
+assert is_followup("Explícaselo con un ejemplo")
+assert not is_followup("Dame un modelo de mensaje para una escuela")
+assert not is_followup("Mensajes para personas mayores de 55 años")
+
+
+def extract_subject_description(text):
+    """
+    Detecta si el usuario describe a una persona real para análisis.
+    Ejemplos:
+    - "soy un hombre de 29 años..."
+    - "una mujer de 40 años colaboradora..."
+    """
+    if _SUBJECT_RE.search(normalize_text(text)):
+        return text  # almacenamos toda la descripción
+    return None
+
+
+def detect_goal(text):
+    """Devuelve el objetivo comunicacional de mayor prioridad presente en el texto."""
+    normalized = normalize_text(text)
+    found = {int(m.lastgroup[1:]) for m in _GOAL_RE.finditer(normalized)}
+    if not found:
+        return None
+    return GOAL_KEYWORDS[min(found)][0]
+
+
+def classify_intent(text, current_behavioral_profile=""):
+    """
+    Clasifica la consulta en una sola pasada:
+    objetivo comunicacional, sujeto descrito y ruta de ejecución.
+    """
+    normalized = normalize_text(text)
+
+    for kind, pattern in _TRIVIAL_RE.items():
+        if pattern.match(normalized):
+            return Intent(route="ligero", goal=None, kind=kind, subject=None, followup=False)
+
+    subject = extract_subject_description(text)
+
+    if current_behavioral_profile and not subject and _PROFILE_FOLLOWUP_RE.search(normalized):
+        return Intent(route="estado", goal="identificar_perfil", kind="perfil_actual", subject=None,
+                      followup=True)
+
+    return Intent(route="rag", goal=detect_goal(text), kind="consulta", subject=subject,
+                  followup=not subject and is_followup(text))
@@ -0,0 +1,237 @@
+import argparse
+import asyncio
+import json
+import os
+import time
+import tracemalloc
+
+import ensemble
+import filter as hybrid_filter
+from benchmark import BASE_DIR, git_commit, offline_backends, percentile
+from full_chain import DEMO_CONVERSATION, create_session_manager
+from local_loader import load_txt_files
+from retrieval_cache import RetrievalCache
+from splitter import split_documents
+
+
+# ============================================================
+# SESIONES SIMULADAS
+# ============================================================
+
+class TurnRecorder:
+    """Tiempos por turno: espera en cola, servicio, latencia total y primer token."""
+
+    def __init__(self):
+        self.queue = []
+        self.service = []
+        self.latency = []
+        self.first_token = []
+        self.errors = 0
+        self.first_error = None
+
+    def summary(self, values):
+        return {
+            "p50_ms": round(percentile(values, 50) * 1000, 3),
+            "p95_ms": round(percentile(values, 95) * 1000, 3),
+            "p99_ms": round(percentile(values, 99) * 1000, 3),
+            "max_ms": round(max(values, default=0.0) * 1000, 3),
+        }
+
+    def report(self):
+        report = {
+            "turns": len(self.latency),
+            "errors": self.errors,
+            "first_error": self.first_error,
+            "latency": self.summary(self.latency),
+            "queueing_delay": self.summary(self.queue),
+            "service_time": self.summary(self.service),
+        }
+        if self.first_token:
+            report["time_to_first_token"] = self.summary(self.first_token)
+        return report
+
+
+async def run_turn(session, query, stream):
+    """Ejecuta un turno y devuelve el instante del primer token (o None)."""
+    if not stream:
+        await session.ainvoke(query)
+        return None
+
+    first = None
+    async for _ in session.astream(query):
+        if first is None:
+            first = time.perf_counter()
+    return first
+
+
+async def run_session(session_id, manager, conversation, workers, recorder,
+                      replays=1, think_time=0.0, start_delay=0.0, stream=False):
+    """
+    Reproduce la conversación `replays` veces. La espera en cola es el tiempo
+    hasta obtener un hueco del pool de workers del proceso.
+    """
+    await asyncio.sleep(start_delay)
+
+    for _ in range(replays):
+        for query in conversation:
+            enqueued = time.perf_counter()
+            async with workers:
+                started = time.perf_counter()
+                try:
+                    session = manager.get(session_id)
+                    first = await run_turn(session, query, stream)
+                except Exception as e:
+                    recorder.errors += 1
+                    recorder.first_error = recorder.first_error or repr(e)
+                    continue
+                finished = time.perf_counter()
+
+            recorder.queue.append(started - enqueued)
+            recorder.service.append(finished - started)
+            recorder.latency.append(finished - enqueued)
+            if first is not None:
+                recorder.first_token.append(first - enqueued)
+
+            if think_time:
+                await asyncio.sleep(think_time)
+
+
+class Unbounded:
+    """Sustituto del semáforo cuando no se limita la concurrencia."""
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+
+# ============================================================
+# PRUEBA DE CARGA
+# ============================================================
+
+def build_retriever(kind, cache_entries):
+    docs = load_txt_files(os.path.join(BASE_DIR, "data"))
+    cache = RetrievalCache(max_entries=cache_entries)
+    if kind == "ensemble":
+        return ensemble.ensemble_retriever_from_docs(docs, cache=cache), cache
+    return hybrid_filter.create_retriever(split_documents(docs), cache=cache), cache
+
+
+async def run_load(manager, sessions, workers, replays, think_time, ramp, stream, conversation):
+    recorder = TurnRecorder()
+    limit = asyncio.Semaphore(workers) if workers else Unbounded()
+
+    started = time.perf_counter()
+    await asyncio.gather(*(
+        run_session(
+            f"load-{i}", manager, conversation, limit, recorder,
+            replays=replays, think_time=think_time,
+            start_delay=ramp * i / max(sessions, 1), stream=stream,
+        )
+        for i in range(sessions)
+    ))
+    return recorder, time.perf_counter() - started
+
+
+def run_loadtest(sessions=20, workers=0, replays=1, think_time=0.0, ramp=0.0,
+                 llm_latency=0.5, token_delay=0.0, embed_latency=0.0,
+                 retriever_kind="filter", cache_entries=256, max_sessions=256,
+                 persist=False, stream=False, conversation=None):
+    """Lanza `sessions` sesiones concurrentes contra el pipeline completo con un LLM simulado."""
+    conversation = conversation or DEMO_CONVERSATION
+
+    with offline_backends(llm_latency=llm_latency, embed_latency=embed_latency, token_delay=token_delay):
+        retriever, cache = build_retriever(retriever_kind, cache_entries)
+        db_path = os.path.join(os.environ["RAG_STORE_DIR"], "sessions.sqlite3") if persist else None
+        manager = create_session_manager(retriever, db_path=db_path, max_sessions=max_sessions)
+
+        tracemalloc.start()
+        baseline = tracemalloc.get_traced_memory()[0]
+        try:
+            recorder, wall = asyncio.run(run_load(
+                manager, sessions, workers, replays, think_time, ramp, stream, conversation,
+            ))
+            current, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+            manager.close()
+
+    growth = current - baseline
+    turns = len(recorder.latency)
+    return {
+        "commit": git_commit(),
+        "config": {
+            "sessions": sessions,
+            "workers": workers or None,
+            "replays": replays,
+            "turns_per_session": len(conversation) * replays,
+            "think_time_s": think_time,
+            "ramp_s": ramp,
+            "llm_latency_s": llm_latency,
+            "token_delay_s": token_delay,
+            "embed_latency_s": embed_latency,
+            "retriever": retriever_kind,
+            "cache_entries": cache_entries,
+            "max_sessions": max_sessions,
+            "persist": persist,
+            "stream": stream,
+        },
+        "wall_time_s": round(wall, 3),
+        "throughput_turns_per_s": round(turns / wall, 2) if wall else None,
+        **recorder.report(),
+        "memory": {
+            "growth_mb": round(growth / 2 ** 20, 2),
+            "growth_per_session_kb": round(growth / max(sessions, 1) / 1024, 1),
+            "peak_mb": round((peak - baseline) / 2 ** 20, 2),
+        },
+        "sessions": manager.stats(),
+        "retrieval_cache": cache.stats(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Prueba de carga con sesiones concurrentes y LLM simulado.")
+    parser.add_argument("--sessions", type=int, default=20, help="Sesiones concurrentes")
+    parser.add_argument("--workers", type=int, default=0, help="Turnos en paralelo del proceso (0 = sin límite)")
+    parser.add_argument("--replays", type=int, default=1, help="Veces que cada sesión repite la conversación")
+    parser.add_argument("--think-time", type=float, default=0.0, help="Pausa entre turnos de una sesión (s)")
+    parser.add_argument("--ramp", type=float, default=0.0, help="Tiempo de arranque escalonado de las sesiones (s)")
+    parser.add_argument("--llm-latency", type=float, default=0.5, help="Latencia simulada del LLM (s)")
+    parser.add_argument("--token-delay", type=float, default=0.0, help="Pausa entre tokens en streaming (s)")
+    parser.add_argument("--embed-latency", type=float, default=0.0, help="Latencia simulada de embeddings (s)")
+    parser.add_argument("--retriever", choices=["filter", "ensemble"], default="filter")
+    parser.add_argument("--cache-entries", type=int, default=256, help="Tamaño de la caché de recuperación (0 = sin caché)")
+    parser.add_argument("--max-sessions", type=int, default=256, help="Sesiones activas en memoria (LRU)")
+    parser.add_argument("--persist", action="store_true", help="Persistir sesiones en SQLite (directorio temporal)")
+    parser.add_argument("--stream", action="store_true", help="Usar astream y medir el primer token")
+    parser.add_argument("--output", help="Ruta del informe JSON (por defecto, stdout)")
+    args = parser.parse_args()
+
+    report = run_loadtest(
+        sessions=args.sessions,
+        workers=args.workers,
+        replays=args.replays,
+        think_time=args.think_time,
+        ramp=args.ramp,
+        llm_latency=args.llm_latency,
+        token_delay=args.token_delay,
+        embed_latency=args.embed_latency,
+        retriever_kind=args.retriever,
+        cache_entries=args.cache_entries,
+        max_sessions=args.max_sessions,
+        persist=args.persist,
+        stream=args.stream,
+    )
+
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text)
+        print(f"Informe guardado en {args.output}")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,9 @@
 import os
 from pathlib import Path
 
-from pypdf import PdfReader
 from langchain_core.documents import Document
-from langchain_community.document_loaders.csv_loader import CSVLoader
+
+from tracing import span
 
 
 # ==========================================================
@@ -52,15 +52,16 @@ def load_txt_files(data_dir="./data"):
     docs = []
     paths = list_txt_files(data_dir)
 
-    for path in paths:
-        print(f"Cargando archivo: {path}")
+    with span("load"):
+        for path in paths:
+            print(f"Cargando archivo: {path}")
 
-        try:
-            docs.extend(safe_load_text(path))
-        except Exception as e:
-            print(f"⚠️  ERROR cargando {path}: {e}")
-            print("❌ Archivo omitido.\n")
-            continue
+            try:
+                docs.extend(safe_load_text(path))
+            except Exception as e:
+                print(f"⚠️  ERROR cargando {path}: {e}")
+                print("❌ Archivo omitido.\n")
+                continue
 
     return docs
 
@@ -70,6 +71,8 @@ def load_txt_files(data_dir="./data"):
 # ==========================================================
 
 def load_csv_files(data_dir="./data"):
+    from langchain_community.document_loaders.csv_loader import CSVLoader
+
     docs = []
     paths = Path(data_dir).glob("**/*.csv")
     for path in paths:
@@ -94,6 +97,7 @@ def get_document_text(uploaded_file, title=None):
 
     # PDF
     if fname.lower().endswith(".pdf"):
+        from pypdf import PdfReader
         pdf_reader = PdfReader(uploaded_file)
 
         for num, page in enumerate(pdf_reader.pages):
@@ -1,21 +1,63 @@
+import hashlib
 import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from typing import List, Iterable, Any
 
 from dotenv import load_dotenv
 from langchain_community.chat_message_histories import ChatMessageHistory
-from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.callbacks import (
+    AsyncCallbackManagerForRetrieverRun,
+    CallbackManagerForRetrieverRun,
+)
 from langchain_core.chat_history import BaseChatMessageHistory
 from langchain_core.documents import Document
+from langchain_core.messages import SystemMessage, messages_from_dict, messages_to_dict
 from langchain_core.output_parsers import StrOutputParser
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
 from langchain_core.retrievers import BaseRetriever
+from langchain_core.runnables import RunnableLambda
 from langchain_core.runnables.history import RunnableWithMessageHistory
 
 from basic_chain import get_model
+from intent import is_followup
 from rag_chain import make_rag_chain
+from sessions import SessionManager
 
 
-def create_memory_chain(llm, base_chain, chat_memory):
+REWRITE_CACHE_SIZE = 512
+
+
+def first_line(text, final=False):
+    """
+    Primera línea no vacía de la reformulación. Mientras llega el stream solo
+    se devuelve cuando está completa (terminada en salto de línea).
+    """
+    text = text.lstrip()
+    if "\n" in text:
+        return text.split("\n", 1)[0].strip()
+    return text.strip() if final else ""
+
+
+def create_memory_chain(llm, base_chain, chat_memory=None, *, session_manager=None):
+    """
+    Cadena con historial por `session_id`. Sin `session_manager` se usa uno
+    en memoria (sin persistencia) con una SummaryBufferMemory por sesión.
+    Con `chat_memory` (firma original) ese historial sirve a todas las sesiones.
+
+    La reformulación de la pregunta (una llamada extra al LLM) solo se hace
+    si hay historial y la pregunta depende de él; las reformulaciones se
+    cachean por (historial, pregunta).
+    """
+    if chat_memory is not None:
+        def get_session_history(session_id: str) -> BaseChatMessageHistory:
+            return chat_memory
+    else:
+        if session_manager is None:
+            session_manager = SessionManager(lambda: SummaryBufferMemory(llm=llm), db_path=None)
+        get_session_history = session_manager.get_history
+
     contextualize_q_system_prompt = """
 Dado el historial de la conversación y la última pregunta del usuario,
 reformula la pregunta para que pueda entenderse de manera independiente,
@@ -33,10 +75,64 @@ Si no es necesario reformular, deja la pregunta tal como está.
         ]
     )
 
-    runnable = contextualize_q_prompt | llm | base_chain
+    rewrite_chain = contextualize_q_prompt | llm | StrOutputParser()
+    rewrite_cache = OrderedDict()
+    cache_lock = threading.Lock()
+
+    def cache_key(x):
+        history = "\n".join(f"{m.type}:{m.content}" for m in x.get("chat_history", []))
+        return hashlib.sha1(history.encode("utf-8")).hexdigest(), x["question"]
+
+    def needs_rewrite(x):
+        # Sin historial o sin referencias al contexto, la pregunta ya es autónoma
+        return bool(x.get("chat_history")) and is_followup(x["question"])
+
+    def remember(key, question):
+        with cache_lock:
+            rewrite_cache[key] = question
+            while len(rewrite_cache) > REWRITE_CACHE_SIZE:
+                rewrite_cache.popitem(last=False)
+        return question
+
+    def lookup(key):
+        with cache_lock:
+            if key in rewrite_cache:
+                rewrite_cache.move_to_end(key)
+            return rewrite_cache.get(key)
+
+    def contextualize(x):
+        if not needs_rewrite(x):
+            return x["question"]
+        key = cache_key(x)
+        cached = lookup(key)
+        if cached is not None:
+            return cached
+
+        # Se consume en streaming y se corta en la primera línea completa:
+        # la reformulación es una sola pregunta y el resto solo añade latencia.
+        parts = []
+        for chunk in rewrite_chain.stream(x):
+            parts.append(chunk)
+            if first_line("".join(parts)):
+                break
+        return remember(key, first_line("".join(parts), final=True) or x["question"])
+
+    async def acontextualize(x):
+        if not needs_rewrite(x):
+            return x["question"]
+        key = cache_key(x)
+        cached = lookup(key)
+        if cached is not None:
+            return cached
+
+        parts = []
+        async for chunk in rewrite_chain.astream(x):
+            parts.append(chunk)
+            if first_line("".join(parts)):
+                break
+        return remember(key, first_line("".join(parts), final=True) or x["question"])
 
-    def get_session_history(session_id: str) -> BaseChatMessageHistory:
-        return chat_memory
+    runnable = RunnableLambda(contextualize, afunc=acontextualize) | base_chain
 
     return RunnableWithMessageHistory(
         runnable,
@@ -46,6 +142,180 @@ Si no es necesario reformular, deja la pregunta tal como está.
     )
 
 
+# ============================================================
+# MEMORIA ACOTADA CON RESUMEN INCREMENTAL
+# ============================================================
+
+summary_template_es = """
+Actualiza el resumen de una conversación entre una persona que diseña campañas
+y el asistente de la ONG *Cambia el Clima*.
+
+Conserva solo lo útil para continuar: sujeto o segmento descrito, perfil comportamental
+identificado, objetivos, mensajes o campañas acordadas y decisiones tomadas.
+Máximo 120 palabras, en español.
+
+RESUMEN ACTUAL:
+{summary}
+
+MENSAJES NUEVOS:
+{new_lines}
+
+RESUMEN ACTUALIZADO:
+"""
+
+summary_prompt_es = ChatPromptTemplate.from_template(summary_template_es)
+
+# Los resúmenes se generan fuera del camino de la petición
+_summary_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="memory-summary")
+
+
+def estimate_tokens(text):
+    """Estimación barata (~4 caracteres por token), suficiente para el presupuesto."""
+    return len(text) // 4 + 1
+
+
+def format_messages(messages):
+    return "\n".join(f"{m.type.upper()}: {m.content}" for m in messages)
+
+
+class SummaryBufferMemory(BaseChatMessageHistory):
+    """
+    Memoria conversacional acotada.
+
+    Mantiene una ventana de mensajes recientes dentro de un presupuesto de
+    tokens; los mensajes que salen de la ventana se integran en un resumen
+    que se actualiza en segundo plano. El historial formateado se cachea
+    hasta el siguiente cambio.
+
+    `on_change` (opcional) se llama tras cada modificación, p. ej. para que
+    el gestor de sesiones programe la escritura a disco.
+    """
+
+    def __init__(self, chat_memory=None, llm=None, max_tokens=1500, max_messages=6,
+                 summary_max_chars=1200):
+        self.chat_memory = chat_memory if chat_memory is not None else ChatMessageHistory()
+        self.llm = llm
+        self.max_tokens = max_tokens
+        self.max_messages = max_messages
+        self.summary_max_chars = summary_max_chars
+
+        self.summary = ""
+        self._evicted = []
+        self._lock = threading.Lock()
+        self._fold_lock = threading.Lock()
+        self._formatted = None
+        self.on_change = None
+
+    @property
+    def messages(self):
+        # El resumen de lo expulsado va delante de la ventana: sin él, el
+        # modelo nunca lo vería (RunnableWithMessageHistory solo lee `messages`)
+        with self._lock:
+            summary = self.summary
+            messages = list(self.chat_memory.messages)
+        if summary:
+            return [SystemMessage(content=f"RESUMEN DE LA CONVERSACIÓN ANTERIOR: {summary}")] + messages
+        return messages
+
+    def add_messages(self, messages):
+        self.chat_memory.add_messages(messages)
+        self._trim()
+        self._notify()
+
+    def clear(self):
+        with self._lock:
+            self.chat_memory.clear()
+            self.summary = ""
+            self._evicted = []
+            self._formatted = None
+        self._notify()
+
+    def get_state(self):
+        with self._lock:
+            return {
+                "summary": self.summary,
+                "messages": messages_to_dict(self.chat_memory.messages),
+            }
+
+    def set_state(self, state):
+        with self._lock:
+            self.chat_memory.clear()
+            self.chat_memory.add_messages(messages_from_dict(state.get("messages", [])))
+            self.summary = state.get("summary", "")
+            self._formatted = None
+
+    def _notify(self):
+        if self.on_change is not None:
+            self.on_change()
+
+    def format_history(self):
+        """Resumen previo + ventana reciente, cacheado entre cambios."""
+        with self._lock:
+            if self._formatted is None:
+                parts = []
+                if self.summary:
+                    parts.append(f"RESUMEN DE LA CONVERSACIÓN ANTERIOR: {self.summary}")
+                parts.append(format_messages(self.chat_memory.messages))
+                self._formatted = "\n".join(p for p in parts if p)
+            return self._formatted
+
+    # --------------------------------------------------------
+    # VENTANA Y RESUMEN
+    # --------------------------------------------------------
+
+    def _trim(self):
+        with self._lock:
+            self._formatted = None
+            messages = list(self.chat_memory.messages)
+
+            evicted = []
+            total = sum(estimate_tokens(m.content) for m in messages)
+            while len(messages) > 1 and (
+                len(messages) > self.max_messages or total > self.max_tokens
+            ):
+                m = messages.pop(0)
+                total -= estimate_tokens(m.content)
+                evicted.append(m)
+
+            if not evicted:
+                return
+
+            self.chat_memory.clear()
+            self.chat_memory.add_messages(messages)
+            self._evicted.extend(evicted)
+
+        _summary_executor.submit(self._fold_evicted)
+
+    def _fold_evicted(self):
+        # Un solo resumen a la vez por sesión, respetando el orden de llegada
+        with self._fold_lock:
+            with self._lock:
+                evicted, self._evicted = self._evicted, []
+                summary = self.summary
+            if not evicted:
+                return
+
+            new_lines = format_messages(evicted)
+            try:
+                if self.llm is None:
+                    raise ValueError("Sin modelo para resumir")
+                chain = summary_prompt_es | self.llm | StrOutputParser()
+                summary = chain.invoke({"summary": summary or "(vacío)", "new_lines": new_lines})
+            except Exception:
+                # Resumen extractivo: conserva lo más reciente dentro del límite
+                summary = f"{summary}\n{new_lines}".strip()
+
+            summary = summary.strip()
+            if len(summary) > self.summary_max_chars:
+                # Recorta por el principio sin dejar líneas a medias
+                summary = summary[-self.summary_max_chars:].split("\n", 1)[-1]
+
+            with self._lock:
+                self.summary = summary
+                self._formatted = None
+            self._notify()
+
+
 class SimpleTextRetriever(BaseRetriever):
     docs: List[Document]
     """Documentos base."""
@@ -60,11 +330,15 @@ class SimpleTextRetriever(BaseRetriever):
     ) -> List[Document]:
         return self.docs
 
+    async def _aget_relevant_documents(
+        self, query: str, *, run_manager: AsyncCallbackManagerForRetrieverRun = None
+    ) -> List[Document]:
+        return self.docs
+
 
 def main():
     load_dotenv()
     model = get_model("ChatGPT")
-    chat_memory = ChatMessageHistory()
 
     system_prompt = """
 Eres un asistente diseñado para generar información y mensajes basados en el contexto proporcionado.
@@ -83,7 +357,7 @@ Eres un asistente diseñado para generar información y mensajes basados en el c
     retriever = SimpleTextRetriever.from_texts([text])
     rag_chain = make_rag_chain(model, retriever, rag_prompt=None)
 
-    chain = create_memory_chain(model, rag_chain, chat_memory) | StrOutputParser()
+    chain = create_memory_chain(model, rag_chain) | StrOutputParser()
 
     queries = [
         "¿Qué información contiene este texto?",
@@ -0,0 +1,389 @@
+import argparse
+import json
+import logging
+import mmap
+import os
+import struct
+import time
+from collections import Counter
+from typing import Any, Optional
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+from langchain_core.vectorstores import VectorStore
+from rank_bm25 import BM25Okapi
+
+from vector_store import get_store_dir
+
+
+# ============================================================
+# FORMATO DEL ÍNDICE
+# ============================================================
+#
+# Un único archivo, de solo lectura una vez construido:
+#
+#   MAGIC | longitud de la cabecera | cabecera JSON | arrays alineados a 64 bytes
+#
+# Los arrays (matrices de embeddings, postings BM25, textos y metadatos de
+# los chunks) se leen con np.frombuffer sobre un mmap: no se copian a la
+# memoria del proceso y la caché de páginas del sistema guarda una sola
+# copia aunque haya varios workers.
+
+INDEX_FORMAT = 1
+MAGIC = b"RAGMMAP1"
+ALIGN = 64
+
+# Mismos parámetros que BM25Retriever (rank_bm25.BM25Okapi por defecto)
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+
+def tokenize(text):
+    """Tokenización de BM25Retriever por defecto: separar por espacios."""
+    return text.split()
+
+
+def _padded(size):
+    return (size + ALIGN - 1) // ALIGN * ALIGN
+
+
+def _blob(values):
+    """Concatena cadenas en un array de bytes más sus offsets (n + 1)."""
+    encoded = [v.encode("utf-8") for v in values]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(e) for e in encoded])
+    return np.frombuffer(b"".join(encoded), dtype=np.uint8), offsets
+
+
+def index_path(name="filter"):
+    return os.path.join(get_store_dir(), f"{name}.ragidx")
+
+
+# ============================================================
+# CONSTRUCCIÓN
+# ============================================================
+
+def build_index(texts, embeddings, path, version=""):
+    """
+    Escribe el índice de `texts` en `path` de forma atómica.
+
+    `embeddings` es {nombre: modelo}, p. ej. {"dense": ..., "sparse": ...}:
+    cada modelo embebe los chunks una sola vez aquí y los workers solo
+    leen los vectores. Las estadísticas BM25 (idf y longitud media) se
+    guardan para todo el corpus y para cada categoría, igual que los
+    BM25Retriever por partición de `filter.create_retriever`.
+    """
+    docs = [t if isinstance(t, Document) else Document(page_content=t) for t in texts]
+    contents = [d.page_content for d in docs]
+    arrays = {}
+
+    for name, model in embeddings.items():
+        matrix = np.asarray(model.embed_documents(contents), dtype=np.float32).reshape(len(docs), -1)
+        arrays[name] = matrix
+        arrays[name + "_norms"] = np.einsum("ij,ij->i", matrix, matrix)
+
+    arrays["text_blob"], arrays["text_offsets"] = _blob(contents)
+    arrays["meta_blob"], arrays["meta_offsets"] = _blob(
+        json.dumps(d.metadata, ensure_ascii=False, default=str) for d in docs
+    )
+
+    categories = sorted({str(d.metadata.get("category", "")) for d in docs})
+    category_ids = {c: i for i, c in enumerate(categories)}
+    arrays["categories"] = np.array([category_ids[str(d.metadata.get("category", ""))] for d in docs], dtype=np.int32)
+
+    # === Postings BM25: por término (en orden de bytes), documentos y frecuencias ===
+    tokens = [tokenize(c) for c in contents]
+    vocab = sorted({t for doc_tokens in tokens for t in doc_tokens}, key=lambda t: t.encode("utf-8"))
+    term_ids = {t: i for i, t in enumerate(vocab)}
+    postings = [[] for _ in vocab]
+    for row, doc_tokens in enumerate(tokens):
+        for term, tf in Counter(doc_tokens).items():
+            postings[term_ids[term]].append((row, tf))
+
+    arrays["vocab_blob"], arrays["vocab_offsets"] = _blob(vocab)
+    arrays["term_offsets"] = np.zeros(len(vocab) + 1, dtype=np.int64)
+    arrays["term_offsets"][1:] = np.cumsum([len(p) for p in postings])
+    arrays["post_docs"] = np.array([row for p in postings for row, _ in p], dtype=np.int32)
+    arrays["post_tf"] = np.array([tf for p in postings for _, tf in p], dtype=np.int32)
+    arrays["doc_len"] = np.array([len(t) for t in tokens], dtype=np.int32)
+
+    # Fila 0: todo el corpus; fila i + 1: categoría i
+    arrays["idf"] = np.zeros((len(categories) + 1, len(vocab)), dtype=np.float64)
+    avgdl = []
+    for c in range(len(categories) + 1):
+        rows = range(len(docs)) if c == 0 else np.flatnonzero(arrays["categories"] == c - 1)
+        bm25 = BM25Okapi([tokens[r] for r in rows], k1=BM25_K1, b=BM25_B)
+        avgdl.append(bm25.avgdl)
+        for term, value in bm25.idf.items():
+            arrays["idf"][c, term_ids[term]] = value
+
+    header = {
+        "format": INDEX_FORMAT,
+        "version": version,
+        "count": len(docs),
+        "categories": categories,
+        "avgdl": avgdl,
+        "created": time.time(),
+    }
+    _write(path, header, arrays)
+    return path
+
+
+def _write(path, header, arrays):
+    layout, offset = {}, 0
+    for name, array in arrays.items():
+        array = np.ascontiguousarray(array)
+        arrays[name] = array
+        layout[name] = {"offset": offset, "dtype": array.dtype.str, "shape": list(array.shape)}
+        offset += _padded(array.nbytes)
+
+    raw = json.dumps({**header, "arrays": layout}).encode("utf-8")
+    start = _padded(len(MAGIC) + 8 + len(raw))
+
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(MAGIC + struct.pack("<Q", len(raw)) + raw)
+        f.write(b"\0" * (start - f.tell()))
+        for name, array in arrays.items():
+            data = array.tobytes()
+            f.write(data + b"\0" * (_padded(len(data)) - len(data)))
+    # Varios workers pueden construirlo a la vez: gana el último, todos válidos
+    os.replace(tmp_path, path)
+
+
+# ============================================================
+# LECTURA (mmap, solo lectura)
+# ============================================================
+
+class MmapIndex:
+    """Índice abierto con mmap: búsquedas vectoriales exactas y BM25 sobre los postings."""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if self._mmap[:len(MAGIC)] != MAGIC:
+            self._mmap.close()
+            raise ValueError(f"{path} no es un índice mmap válido")
+        (header_len,) = struct.unpack_from("<Q", self._mmap, len(MAGIC))
+        self.header = json.loads(self._mmap[len(MAGIC) + 8:len(MAGIC) + 8 + header_len])
+        if self.header.get("format") != INDEX_FORMAT:
+            self._mmap.close()
+            raise ValueError(f"Formato de índice no soportado en {path}")
+
+        start = _padded(len(MAGIC) + 8 + header_len)
+        self.arrays = {}
+        for name, spec in self.header["arrays"].items():
+            shape = tuple(spec["shape"])
+            self.arrays[name] = np.frombuffer(
+                self._mmap, dtype=np.dtype(spec["dtype"]),
+                count=int(np.prod(shape)), offset=start + spec["offset"],
+            ).reshape(shape)
+
+        self.categories = self.header["categories"]
+
+    @property
+    def version(self):
+        return self.header.get("version")
+
+    def __len__(self):
+        return self.header["count"]
+
+    def close(self):
+        self.arrays = {}
+        self._mmap.close()
+
+    # ---- chunks ----
+
+    def _string(self, blob, offsets, i):
+        return self.arrays[blob][offsets[i]:offsets[i + 1]].tobytes().decode("utf-8")
+
+    def document(self, row):
+        """Document del chunk `row` (objeto nuevo en cada llamada)."""
+        return Document(
+            page_content=self._string("text_blob", self.arrays["text_offsets"], row),
+            metadata=json.loads(self._string("meta_blob", self.arrays["meta_offsets"], row)),
+        )
+
+    def documents(self, rows=None):
+        return [self.document(int(r)) for r in (range(len(self)) if rows is None else rows)]
+
+    def rows(self, category=None):
+        if category is None:
+            return np.arange(len(self))
+        if category not in self.categories:
+            return np.arange(0)
+        return np.flatnonzero(self.arrays["categories"] == self.categories.index(category))
+
+    # ---- búsqueda vectorial exacta (distancia L2 al cuadrado, como Chroma) ----
+
+    def vector_search(self, name, vector, k=4, category=None):
+        query = np.asarray(vector, dtype=np.float32)
+        matrix, norms = self.arrays[name], self.arrays[name + "_norms"]
+        if category is not None:
+            rows = self.rows(category)
+            matrix, norms = matrix[rows], norms[rows]
+        else:
+            rows = None
+
+        distances = norms - 2 * (matrix @ query) + query @ query
+        order = np.argsort(distances, kind="stable")[:k]
+        return order if rows is None else rows[order]
+
+    # ---- BM25 ----
+
+    def term_id(self, term):
+        """Búsqueda binaria del término en el vocabulario (ordenado por bytes)."""
+        key = term.encode("utf-8")
+        blob, offsets = self.arrays["vocab_blob"], self.arrays["vocab_offsets"]
+        lo, hi = 0, len(offsets) - 1
+        while lo < hi:
+            mid = (lo + hi) // 2
+            value = blob[offsets[mid]:offsets[mid + 1]].tobytes()
+            if value < key:
+                lo = mid + 1
+            elif value > key:
+                hi = mid
+            else:
+                return mid
+        return None
+
+    def bm25_scores(self, query, category=None):
+        """(filas, puntuaciones BM25) de todos los chunks de `category` (o del corpus)."""
+        rows = self.rows(category)
+        if not len(rows):
+            return rows, np.zeros(0)
+        corpus = 0 if category is None else self.categories.index(category) + 1
+        avgdl = self.header["avgdl"][corpus]
+
+        position = np.full(len(self), -1, dtype=np.int64)
+        position[rows] = np.arange(len(rows))
+        scores = np.zeros(len(rows))
+        offsets = self.arrays["term_offsets"]
+
+        for token in tokenize(query):
+            term = self.term_id(token)
+            if term is None:
+                continue
+            docs = self.arrays["post_docs"][offsets[term]:offsets[term + 1]]
+            tf = self.arrays["post_tf"][offsets[term]:offsets[term + 1]].astype(np.float64)
+            inside = position[docs] >= 0
+            docs, tf = docs[inside], tf[inside]
+            doc_len = self.arrays["doc_len"][docs]
+            scores[position[docs]] += self.arrays["idf"][corpus, term] * (
+                tf * (BM25_K1 + 1) / (tf + BM25_K1 * (1 - BM25_B + BM25_B * doc_len / avgdl))
+            )
+        return rows, scores
+
+    def bm25_search(self, query, k=4, category=None):
+        """Top-k BM25 con las mismas puntuaciones y orden que BM25Retriever."""
+        rows, scores = self.bm25_scores(query, category)
+        return rows[np.argsort(scores)[::-1][:k]]
+
+
+def load_index(path, texts, embeddings, version):
+    """
+    Abre el índice de `path`; si falta o su versión no coincide con la de
+    los chunks actuales, lo construye primero (una sola vez: los siguientes
+    workers ya lo encuentran hecho). `texts` puede ser una función que
+    devuelve los chunks: solo se llama si hay que construir.
+    """
+    if os.path.exists(path):
+        try:
+            index = MmapIndex(path)
+            if index.version == version:
+                return index
+            index.close()
+        except (ValueError, OSError) as e:
+            logging.warning(f"No se pudo abrir el índice {path}: {e}")
+
+    logging.info(f"Construyendo el índice mmap {path}")
+    build_index(texts() if callable(texts) else texts, embeddings, path, version)
+    return MmapIndex(path)
+
+
+# ============================================================
+# ADAPTADORES LANGCHAIN
+# ============================================================
+
+def _category_of(filter):
+    if not filter:
+        return None
+    if set(filter) != {"category"}:
+        raise ValueError(f"El índice mmap solo filtra por categoría: {filter}")
+    return filter["category"]
+
+
+class MmapVectorStore(VectorStore):
+    """Vista de solo lectura de una matriz del índice con la interfaz de Chroma que usa `filter`."""
+
+    def __init__(self, index, name, embedding):
+        self.index = index
+        self.name = name
+        self._embedding = embedding
+
+    @property
+    def embeddings(self):
+        return self._embedding
+
+    def add_texts(self, texts, metadatas=None, **kwargs):
+        raise NotImplementedError("El índice mmap es de solo lectura: se reconstruye con build_index")
+
+    @classmethod
+    def from_texts(cls, texts, embedding, metadatas=None, **kwargs):
+        raise NotImplementedError("Usa build_index / load_index")
+
+    def similarity_search_by_vector(self, embedding, k=4, filter=None, **kwargs):
+        rows = self.index.vector_search(self.name, embedding, k, _category_of(filter))
+        return self.index.documents(rows)
+
+    def similarity_search(self, query, k=4, filter=None, **kwargs):
+        return self.similarity_search_by_vector(self._embedding.embed_query(query), k, filter)
+
+
+class MmapBM25Retriever(BaseRetriever):
+    """Equivalente a BM25Retriever (o a uno por categoría) sobre los postings del índice."""
+
+    index: Any
+    k: int = 4
+    category: Optional[str] = None
+
+    def _get_relevant_documents(self, query, *, run_manager=None):
+        return self.index.documents(self.index.bm25_search(query, self.k, self.category))
+
+
+# ============================================================
+# CLI: construir el índice antes de arrancar los workers
+# ============================================================
+
+def main():
+    parser = argparse.ArgumentParser(description="Construye el índice mmap del retriever híbrido.")
+    parser.add_argument("--backend", default=None, help="Backend de embeddings (torch, onnx, onnx-int8)")
+    parser.add_argument("--offline", action="store_true", help="Embeddings deterministas locales (pruebas)")
+    args = parser.parse_args()
+
+    from contextlib import nullcontext
+
+    import filter as hybrid_filter
+    from local_loader import load_txt_files
+    from splitter import split_documents
+
+    base_dir = os.path.dirname(os.path.abspath(__file__))
+    if args.offline:
+        from benchmark import offline_backends
+        backends = offline_backends(store_dir=get_store_dir())
+    else:
+        backends = nullcontext()
+
+    with backends:
+        started = time.perf_counter()
+        texts = split_documents(load_txt_files(os.path.join(base_dir, "data")))
+        hybrid_filter.create_retriever(texts, embedding_backend=args.backend, mmap_index=True)
+        print(f"Índice listo en {get_store_dir()} ({time.perf_counter() - started:.1f}s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,190 @@
+import logging
+import os
+import threading
+from typing import List
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from vector_store import get_store_dir
+
+
+# ============================================================
+# EXPORTACIÓN Y CUANTIZACIÓN (solo la primera vez)
+# ============================================================
+
+def onnx_dir(model_name):
+    """Directorio con el modelo ONNX y el tokenizer; admite una ruta local ya exportada."""
+    if os.path.isdir(model_name):
+        return model_name
+    return os.path.join(get_store_dir(), "onnx", model_name.replace("/", "__"))
+
+
+def export_onnx(model_name, out_dir, opset=17):
+    """
+    Exporta el encoder de Hugging Face a ONNX con ejes dinámicos (batch y
+    secuencia) y guarda `tokenizer.json`. Requiere torch y transformers,
+    pero solo aquí: la inferencia usa únicamente onnxruntime y tokenizers.
+    """
+    import torch
+    from transformers import AutoModel, AutoTokenizer
+
+    os.makedirs(out_dir, exist_ok=True)
+    tokenizer = AutoTokenizer.from_pretrained(model_name)
+    tokenizer.save_pretrained(out_dir)
+
+    model = AutoModel.from_pretrained(model_name).eval()
+    dummy = dict(tokenizer(["texto de ejemplo"], return_tensors="pt"))
+    input_names = list(dummy)
+    dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in input_names}
+    dynamic_axes["last_hidden_state"] = {0: "batch", 1: "sequence"}
+
+    path = os.path.join(out_dir, "model.onnx")
+    tmp_path = path + ".tmp"
+    with torch.no_grad():
+        torch.onnx.export(
+            model, (dummy,), tmp_path,
+            input_names=input_names,
+            output_names=["last_hidden_state"],
+            dynamic_axes=dynamic_axes,
+            opset_version=opset,
+            dynamo=False,
+        )
+    os.replace(tmp_path, path)
+    return path
+
+
+def quantize_onnx(path):
+    """Cuantización dinámica int8 de los pesos (las activaciones se cuantizan al vuelo)."""
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    quantized = path.replace(".onnx", ".int8.onnx")
+    tmp_path = quantized + ".tmp"
+    quantize_dynamic(path, tmp_path, weight_type=QuantType.QInt8)
+    os.replace(tmp_path, quantized)
+    return quantized
+
+
+_export_lock = threading.Lock()
+
+
+def ensure_model(model_name, quantize=True):
+    """Ruta del modelo ONNX listo para cargar, exportándolo y cuantizándolo si falta."""
+    with _export_lock:
+        out_dir = onnx_dir(model_name)
+        path = os.path.join(out_dir, "model.onnx")
+        quantized = os.path.join(out_dir, "model.int8.onnx")
+
+        if quantize and os.path.exists(quantized):
+            return quantized
+        if not os.path.exists(path):
+            logging.info(f"Exportando {model_name} a ONNX en {out_dir}")
+            export_onnx(model_name, out_dir)
+        if quantize:
+            logging.info(f"Cuantizando {path} a int8")
+            return quantize_onnx(path)
+        return path
+
+
+# ============================================================
+# EMBEDDINGS CON ONNX RUNTIME
+# ============================================================
+
+class OnnxEmbeddings(Embeddings):
+    """
+    Embeddings locales con onnxruntime en CPU, misma interfaz que
+    HuggingFaceEmbeddings / HuggingFaceBgeEmbeddings.
+
+    - `pooling`: "mean" (sentence-transformers) o "cls" (BGE).
+    - `query_instruction`: prefijo de las preguntas (modelos BGE).
+    - Batching dinámico: los textos se ordenan por longitud y cada lote se
+      rellena solo hasta su secuencia más larga, con un tope de
+      `max_batch_tokens` tokens por lote.
+    """
+
+    def __init__(self, model_name, pooling="mean", normalize=True, quantize=True,
+                 query_instruction="", max_length=512, max_batch_tokens=16384,
+                 intra_op_threads=None):
+        import onnxruntime as ort
+        from tokenizers import Tokenizer
+
+        self.model_name = model_name
+        self.pooling = pooling
+        self.normalize = normalize
+        self.query_instruction = query_instruction
+        self.max_length = max_length
+        self.max_batch_tokens = max_batch_tokens
+
+        model_path = ensure_model(model_name, quantize=quantize)
+        self.tokenizer = Tokenizer.from_file(os.path.join(os.path.dirname(model_path), "tokenizer.json"))
+        self.tokenizer.no_padding()
+        self.tokenizer.enable_truncation(max_length=max_length)
+        self.pad_id = self.tokenizer.token_to_id("[PAD]") or 0
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+        options.intra_op_num_threads = intra_op_threads or int(
+            os.environ.get("RAG_ONNX_THREADS", min(os.cpu_count() or 1, 8))
+        )
+        options.inter_op_num_threads = 1
+        self.session = ort.InferenceSession(model_path, options, providers=["CPUExecutionProvider"])
+        self.input_names = {i.name for i in self.session.get_inputs()}
+
+    # --------------------------------------------------------
+    # INFERENCIA
+    # --------------------------------------------------------
+
+    def _batches(self, encodings):
+        """Índices agrupados por longitud similar, con tope de tokens por lote."""
+        order = sorted(range(len(encodings)), key=lambda i: len(encodings[i].ids))
+        batch, longest = [], 0
+        for i in order:
+            length = len(encodings[i].ids)
+            if batch and max(longest, length) * (len(batch) + 1) > self.max_batch_tokens:
+                yield batch
+                batch, longest = [], 0
+            batch.append(i)
+            longest = max(longest, length)
+        if batch:
+            yield batch
+
+    def _run(self, encodings):
+        width = max(len(e.ids) for e in encodings)
+        input_ids = np.full((len(encodings), width), self.pad_id, dtype=np.int64)
+        attention_mask = np.zeros((len(encodings), width), dtype=np.int64)
+        for row, e in enumerate(encodings):
+            input_ids[row, :len(e.ids)] = e.ids
+            attention_mask[row, :len(e.ids)] = 1
+
+        feeds = {"input_ids": input_ids, "attention_mask": attention_mask}
+        if "token_type_ids" in self.input_names:
+            feeds["token_type_ids"] = np.zeros_like(input_ids)
+        hidden = self.session.run(None, {k: v for k, v in feeds.items() if k in self.input_names})[0]
+
+        if self.pooling == "cls":
+            vectors = hidden[:, 0]
+        else:
+            mask = attention_mask[..., None].astype(hidden.dtype)
+            vectors = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+
+        if self.normalize:
+            vectors = vectors / np.clip(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12, None)
+        return vectors
+
+    def _embed(self, texts):
+        if not texts:
+            return []
+        encodings = self.tokenizer.encode_batch([t.replace("\n", " ") for t in texts])
+        result = [None] * len(texts)
+        for batch in self._batches(encodings):
+            vectors = self._run([encodings[i] for i in batch])
+            for i, vector in zip(batch, vectors):
+                result[i] = vector.tolist()
+        return result
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self._embed(list(texts))
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._embed([self.query_instruction + text])[0]
@@ -0,0 +1,249 @@
+import hashlib
+import json
+import logging
+import os
+import re
+
+from langchain_core.documents import Document
+
+from intent import normalize_text
+from vector_store import get_store_dir
+
+
+# ============================================================
+# FICHAS COMPACTAS (perfiles, segmentos de edad y normas)
+# ============================================================
+#
+# Se extraen de los documentos de data/ al indexar, sin LLM: cada ficha
+# resume una sección en unas pocas líneas (rasgos, barreras, palancas,
+# tono) y sustituye a los chunks "core" de 1000 caracteres en el prompt.
+
+CARDS_FORMAT = 2          # subir si cambia el formato de las fichas
+MAX_ITEMS = 2             # viñetas por campo
+MAX_ITEM_CHARS = 100
+
+# archivo -> (categoría, tipo de ficha)
+CARD_SOURCES = {
+    "perfiles_comportamentales": ("PERFILES_COMPORTAMENTALES", "perfil"),
+    "segmentacion_edades": ("SEGMENTACION_EDADES", "segmento"),
+    "normasdecomunicacion": ("NORMAS_COMUNICACION", "normas"),
+}
+
+# Campo de la ficha según el título de la subsección (normalizado)
+CARD_FIELDS = [
+    ("Rasgos", ["identidad", "rasgos", "mindset", "creencias", "actitudes"]),
+    ("Motivaciones", ["motivaciones"]),
+    ("Barreras", ["barreras", "frenos"]),
+    ("Palancas", ["palancas"]),
+    ("Relación y tono", ["relacion", "tono", "mensajes", "canales"]),
+]
+
+# Secciones de normas que entran en la ficha (el resto es procedimiento)
+NORMS_SECTIONS = {"1", "2", "3", "4"}
+
+_SECTION_RE = re.compile(r"^=+\s*\n(\d+)\.\s+(.+?)\s*\n=+\s*$", re.MULTILINE)
+_SUBSECTION_RE = re.compile(r"^(\d+)\.(\d+)\.\s+(.+?)\s*$")
+_CITATION_RE = re.compile(r"\s*(\[web:\d+\])+")
+
+
+def _clean(line):
+    line = _CITATION_RE.sub("", line).strip().lstrip("-").strip()
+    if len(line) > MAX_ITEM_CHARS:
+        line = line[:MAX_ITEM_CHARS].rsplit(" ", 1)[0] + "…"
+    return line
+
+
+def parse_sections(text):
+    """[(número, título, cuerpo)] de las secciones principales de un documento de data/."""
+    matches = list(_SECTION_RE.finditer(text))
+    sections = []
+    for i, m in enumerate(matches):
+        end = matches[i + 1].start() if i + 1 < len(matches) else len(text)
+        sections.append((m.group(1), m.group(2), text[m.end():end]))
+    return sections
+
+
+def parse_subsections(body):
+    """(frase de rol, [(título, [viñetas])]) de una sección."""
+    role, subsections = "", []
+    for raw in body.splitlines():
+        line = raw.strip()
+        if not line or set(line) <= set("-="):
+            continue
+        sub = _SUBSECTION_RE.match(line)
+        if sub:
+            subsections.append((sub.group(3), []))
+        elif subsections:
+            subsections[-1][1].append(_clean(line))
+        elif line.lower().startswith("rol"):
+            role = _clean(line.split(":", 1)[-1])
+    return role, subsections
+
+
+def field_of(title):
+    normalized = normalize_text(title)
+    for field, keywords in CARD_FIELDS:
+        if any(k in normalized for k in keywords):
+            return field
+    return None
+
+
+def section_card(title, body):
+    """Ficha de un perfil o segmento: rol + campos con las primeras viñetas."""
+    role, subsections = parse_subsections(body)
+    fields = {}
+    for sub_title, items in subsections:
+        field = field_of(sub_title)
+        if field:
+            fields.setdefault(field, []).extend(i for i in items if i)
+
+    lines = [f"[{_clean(title)}]"]
+    if role:
+        lines.append(f"Rol: {role}")
+    for field, _ in CARD_FIELDS:
+        if fields.get(field):
+            lines.append(f"{field}: " + "; ".join(fields[field][:MAX_ITEMS]))
+    return "\n".join(lines)
+
+
+def norms_card(sections):
+    """Una sola ficha con la primera regla de cada subsección de las normas."""
+    lines = ["[NORMAS DE COMUNICACIÓN]"]
+    for number, title, body in sections:
+        if number not in NORMS_SECTIONS:
+            continue
+        _, subsections = parse_subsections(body)
+        rules = [items[0] for _, items in subsections if items]
+        lines.append(f"{title.capitalize()}: " + "; ".join(rules))
+    return "\n".join(lines)
+
+
+def build_cards(path):
+    """Fichas de un archivo de data/ (lista vacía si no es una fuente de fichas)."""
+    name = os.path.splitext(os.path.basename(path))[0]
+    if name not in CARD_SOURCES:
+        return []
+    category, kind = CARD_SOURCES[name]
+
+    with open(path, "r", encoding="utf-8") as f:
+        sections = parse_sections(f.read())
+
+    if kind == "normas":
+        return [{"id": "normas", "category": category, "source": path,
+                 "sections": sorted(NORMS_SECTIONS), "text": norms_card(sections)}]
+
+    cards = []
+    for number, title, body in sections:
+        if number == "0" or "TABLA" in title.upper():
+            continue
+        cards.append({
+            "id": f"{kind}-{number}",
+            "category": category,
+            "source": path,
+            "sections": [number],
+            "text": section_card(title, body),
+        })
+    return cards
+
+
+# ============================================================
+# VERSIONADO Y CACHÉ EN store/
+# ============================================================
+
+def card_source_paths(texts):
+    """Archivos de origen de los chunks indexados que generan fichas."""
+    paths = set()
+    for t in texts:
+        source = str((getattr(t, "metadata", None) or {}).get("source") or "")
+        if os.path.splitext(os.path.basename(source))[0] in CARD_SOURCES and os.path.exists(source):
+            paths.add(source)
+    return sorted(paths)
+
+
+def cards_version(paths):
+    h = hashlib.sha256(f"cards-v{CARDS_FORMAT}".encode("utf-8"))
+    for path in paths:
+        h.update(os.path.basename(path).encode("utf-8"))
+        with open(path, "rb") as f:
+            h.update(hashlib.sha256(f.read()).digest())
+    return h.hexdigest()[:16]
+
+
+def load_cards(paths, cache_path=None):
+    """
+    Fichas de `paths`, reutilizando las guardadas en store/ mientras no
+    cambie el contenido de los archivos de origen.
+    """
+    if not paths:
+        return [], None
+
+    cache_path = cache_path or os.path.join(get_store_dir(), "profile_cards.json")
+    version = cards_version(paths)
+
+    if os.path.exists(cache_path):
+        try:
+            with open(cache_path, "r", encoding="utf-8") as f:
+                payload = json.load(f)
+            if payload.get("version") == version:
+                return payload["cards"], version
+        except Exception as e:
+            logging.warning(f"No se pudieron leer las fichas {cache_path}: {e}")
+
+    cards = [card for path in paths for card in build_cards(path)]
+    os.makedirs(os.path.dirname(cache_path) or ".", exist_ok=True)
+    tmp_path = cache_path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({"version": version, "cards": cards}, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, cache_path)
+    return cards, version
+
+
+def summarized_chunks(texts, cards):
+    """
+    chunk_id de los chunks cuyo texto cae entero en secciones resumidas por
+    alguna ficha. Solo esos se pueden sustituir por las fichas: el resto de
+    secciones (introducción, tablas, procedimientos) se sigue recuperando.
+    """
+    covered = {}
+    for card in cards:
+        covered.setdefault(card["source"], set()).update(card.get("sections", []))
+
+    spans = {}
+    for source in covered:
+        with open(source, "r", encoding="utf-8") as f:
+            text = f.read()
+        matches = list(_SECTION_RE.finditer(text))
+        spans[source] = (text, [
+            (m.group(1), m.start(), matches[i + 1].start() if i + 1 < len(matches) else len(text))
+            for i, m in enumerate(matches)
+        ])
+
+    summarized = set()
+    for t in texts:
+        source = str(t.metadata.get("source") or "")
+        if source not in spans:
+            continue
+        text, sections = spans[source]
+        start = text.find(t.page_content)
+        if start < 0:
+            continue
+        end = start + len(t.page_content)
+        touched = {number for number, s, e in sections if s < end and e > start}
+        if touched and touched <= covered[source]:
+            summarized.add(t.metadata.get("chunk_id"))
+    return summarized
+
+
+def card_documents(cards):
+    return [
+        Document(
+            page_content=card["text"],
+            metadata={
+                "source": card["source"],
+                "category": card["category"],
+                "card": card["id"],
+                "chunk_id": f"card-{card['id']}",
+            },
+        )
+        for card in cards
+    ]
@@ -5,6 +5,7 @@ from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.runnables import RunnablePassthrough, RunnableLambda
 from langchain_core.messages.base import BaseMessage
 
+from categories import CATEGORIES, categorize
 from splitter import split_documents
 from vector_store import create_vector_db
 from basic_chain import get_model
@@ -25,35 +26,11 @@ def safe_get(x, key, default=""):
 # ============================================================
 
 def structure_context(docs):
-    sections = {
-        "PERFILES_COMPORTAMENTALES": [],
-        "NORMAS_COMUNICACION": [],
-        "PROBLEMAS_AUDIENCIA": [],
-        "SEGMENTACION_EDADES": [],
-        "INSIGHTS_PSICOLOGICOS": [],
-        "OTROS": []
-    }
+    sections = {name: [] for name in CATEGORIES}
 
+    # Categoría asignada al indexar (o deducida si el chunk no la trae)
     for doc in docs:
-        text = doc.page_content.lower()
-
-        if "perfil a" in text or "perfil b" in text or "perfil c" in text:
-            sections["PERFILES_COMPORTAMENTALES"].append(doc.page_content)
-
-        elif "principios rectores" in text or "tono y estilo" in text:
-            sections["NORMAS_COMUNICACION"].append(doc.page_content)
-
-        elif "problemas cognitivos" in text or "problemas emocionales" in text:
-            sections["PROBLEMAS_AUDIENCIA"].append(doc.page_content)
-
-        elif "adolescencia" in text or "juventud adulta" in text or "adultez" in text:
-            sections["SEGMENTACION_EDADES"].append(doc.page_content)
-
-        elif "autoeficacia" in text or "dragones de la inactividad" in text:
-            sections["INSIGHTS_PSICOLOGICOS"].append(doc.page_content)
-
-        else:
-            sections["OTROS"].append(doc.page_content)
+        sections[categorize(doc)].append(doc.page_content)
 
     final_context = ""
     for name, content in sections.items():
@@ -160,6 +137,31 @@ RESPUESTA:
 rag_prompt_es = ChatPromptTemplate.from_template(rag_template_es)
 
 
+# ============================================================
+# PROMPT LIGERO (saludos, agradecimientos, turnos triviales)
+# ============================================================
+
+light_template_es = """
+Eres el Estratega de Comunicación, Audiencias y Comportamiento de la ONG *Cambia el Clima*.
+El usuario ha enviado un mensaje breve (saludo, agradecimiento o despedida).
+Responde en español, en una o dos frases, con tono cercano. Si encaja, ofrece ayuda para
+identificar perfiles, preparar campañas o generar mensajes. NO hagas análisis.
+
+SUJETO ACTIVO (si existe): {current_subject}
+PERFIL COMPORTAMENTAL ACTIVO (si existe): {current_behavioral_profile}
+-----------------------
+HISTORIAL RECIENTE:
+{chat_history}
+-----------------------
+MENSAJE DEL USUARIO:
+{question}
+
+RESPUESTA:
+"""
+
+light_prompt_es = ChatPromptTemplate.from_template(light_template_es)
+
+
 # ============================================================
 # UTILIDADES
 # ============================================================
@@ -180,22 +182,69 @@ def get_question(input_):
     return ""
 
 
+def as_runnable(func):
+    """
+    RunnableLambda con versión async nativa: en `ainvoke`/`astream` las
+    funciones triviales no saltan a un thread del executor.
+    """
+    async def afunc(x):
+        return func(x)
+
+    return RunnableLambda(func, afunc=afunc)
+
+
+def field(key):
+    return as_runnable(lambda x: safe_get(x, key))
+
+
+def with_goal(config, x):
+    """Propaga `current_goal` al retriever en los metadatos de la ejecución."""
+    goal = safe_get(x, "current_goal")
+    if not goal:
+        return config
+    return {**config, "metadata": {**(config.get("metadata") or {}), "current_goal": goal}}
+
+
+def retrieve_context(retriever):
+    """
+    Documentos de contexto: si la entrada ya trae `documents` (p. ej. reutilizados
+    del turno anterior) se usan tal cual; si no, se consulta el retriever.
+    """
+    def _retrieve(x, config):
+        docs = safe_get(x, "documents", None)
+        if docs is None:
+            docs = retriever.invoke(get_question(x), with_goal(config, x))
+        return docs
+
+    async def _aretrieve(x, config):
+        docs = safe_get(x, "documents", None)
+        if docs is None:
+            docs = await retriever.ainvoke(get_question(x), with_goal(config, x))
+        return docs
+
+    return RunnableLambda(_retrieve, afunc=_aretrieve)
+
+
 # ============================================================
 # CADENA RAG FINAL (con SAFE_GET)
 # ============================================================
 
 def make_rag_chain(model, retriever, rag_prompt=None):
+    """
+    Las ramas del diccionario son independientes: con `ainvoke`/`astream`
+    se ejecutan concurrentemente y la recuperación usa el retriever async.
+    """
     if rag_prompt is None:
         rag_prompt = rag_prompt_es
 
     rag_chain = (
         {
-            "context": RunnableLambda(get_question) | retriever | format_docs,
-            "question": RunnableLambda(lambda x: get_question(x)),
-            "chat_history": RunnableLambda(lambda x: safe_get(x, "chat_history")),
-            "current_subject": RunnableLambda(lambda x: safe_get(x, "current_subject")),
-            "current_behavioral_profile": RunnableLambda(lambda x: safe_get(x, "current_behavioral_profile")),
-            "current_goal": RunnableLambda(lambda x: safe_get(x, "current_goal")),
+            "context": retrieve_context(retriever) | as_runnable(format_docs),
+            "question": as_runnable(get_question),
+            "chat_history": field("chat_history"),
+            "current_subject": field("current_subject"),
+            "current_behavioral_profile": field("current_behavioral_profile"),
+            "current_goal": field("current_goal"),
         }
         | rag_prompt
         | model
@@ -203,6 +252,23 @@ def make_rag_chain(model, retriever, rag_prompt=None):
     return rag_chain
 
 
+def make_light_chain(model, light_prompt=None):
+    """Cadena sin recuperación para turnos triviales."""
+    if light_prompt is None:
+        light_prompt = light_prompt_es
+
+    return (
+        {
+            "question": as_runnable(get_question),
+            "chat_history": field("chat_history"),
+            "current_subject": field("current_subject"),
+            "current_behavioral_profile": field("current_behavioral_profile"),
+        }
+        | light_prompt
+        | model
+    )
+
+
 # ============================================================
 # TEST
 # ============================================================
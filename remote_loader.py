@@ -1,11 +1,8 @@
 import requests
 import os
 
-from langchain_community.document_loaders import WebBaseLoader
-from langchain_community.document_loaders import OnlinePDFLoader
 from langchain_core.documents import Document
 from local_loader import get_document_text
-import wikipedia
 
 
 # Carpeta donde se guardarán archivos descargados
@@ -14,12 +11,14 @@ CONTENT_DIR = os.path.dirname(__file__)
 
 def load_web_page(page_url):
     """Carga contenido de una página web."""
+    from langchain_community.document_loaders import WebBaseLoader
     loader = WebBaseLoader(page_url)
     return loader.load()
 
 
 def load_online_pdf(pdf_url):
     """Carga PDF remoto."""
+    from langchain_community.document_loaders import OnlinePDFLoader
     loader = OnlinePDFLoader(pdf_url)
     return loader.load()
 
@@ -46,6 +45,8 @@ def get_wiki_docs(query, load_max_docs=2):
     Carga artículos de Wikipedia usando la librería oficial.
     Devuelve Document() compatibles con LangChain moderno.
     """
+    import wikipedia
+
     wikipedia.set_lang("es")  # opcional: selecciona idioma
 
     pages = wikipedia.search(query, results=load_max_docs)
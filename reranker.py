@@ -0,0 +1,131 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict, deque
+
+from langchain_core.documents import Document
+
+from retrieval_cache import normalize_query
+from splitter import chunk_id
+
+
+# Multilingüe (entrenado con mMARCO, incluye español) y pequeño para CPU
+RERANK_MODEL = "cross-encoder/mmarco-mMiniLMv2-L12-H384-v1"
+
+
+def load_cross_encoder(model_name):
+    """Carga el cross-encoder local (punto único para poder sustituirlo en benchmarks)."""
+    from sentence_transformers import CrossEncoder
+    return CrossEncoder(model_name, max_length=512)
+
+
+def query_hash(query):
+    return hashlib.sha1(normalize_query(query).encode("utf-8")).hexdigest()[:16]
+
+
+# ============================================================
+# RERANKING CON CROSS-ENCODER
+# ============================================================
+
+class CrossEncoderReranker:
+    """
+    Puntúa cada candidato frente a la pregunta con un cross-encoder local y
+    conserva solo los `top_n` mejores.
+
+    - Las puntuaciones se cachean por (hash de la pregunta, chunk_id), así
+      las preguntas repetidas y los chunks core no se vuelven a puntuar.
+    - Solo los pares que faltan en caché se envían al modelo, en lotes.
+    - La latencia de cada llamada queda registrada para `stats()`.
+    """
+
+    def __init__(self, model_name=RERANK_MODEL, top_n=6, batch_size=16, max_cache=8192, max_samples=1024):
+        self.model_name = model_name
+        self.top_n = top_n
+        self.batch_size = batch_size
+        self.max_cache = max_cache
+
+        self._model = None
+        self._scores = OrderedDict()
+        self._latencies = deque(maxlen=max_samples)
+        self._lock = threading.Lock()
+        self._model_lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def model(self):
+        with self._model_lock:
+            if self._model is None:
+                self._model = load_cross_encoder(self.model_name)
+            return self._model
+
+    def score(self, query, docs):
+        """Puntuación de cada documento, reutilizando la caché."""
+        qh = query_hash(query)
+        keys = [(qh, chunk_id(d)) for d in docs]
+        scores = [None] * len(docs)
+        missing = []
+
+        with self._lock:
+            for i, key in enumerate(keys):
+                cached = self._scores.get(key)
+                if cached is None:
+                    missing.append(i)
+                else:
+                    self._scores.move_to_end(key)
+                    scores[i] = cached
+            self.hits += len(docs) - len(missing)
+            self.misses += len(missing)
+
+        if missing:
+            pairs = [(query, docs[i].page_content) for i in missing]
+            predicted = self.model.predict(pairs, batch_size=self.batch_size, show_progress_bar=False)
+
+            with self._lock:
+                for i, value in zip(missing, predicted):
+                    scores[i] = float(value)
+                    self._scores[keys[i]] = scores[i]
+                while len(self._scores) > self.max_cache:
+                    self._scores.popitem(last=False)
+
+        return scores
+
+    def rerank(self, query, docs):
+        """Los `top_n` documentos más relevantes, de mayor a menor puntuación."""
+        if not docs:
+            return docs
+
+        start = time.perf_counter()
+        scores = self.score(query, docs)
+        order = sorted(range(len(docs)), key=lambda i: -scores[i])[:self.top_n]
+        # Copias: los chunks originales se comparten entre peticiones
+        ranked = [
+            Document(page_content=docs[i].page_content,
+                     metadata={**docs[i].metadata, "rerank_score": round(scores[i], 4)})
+            for i in order
+        ]
+
+        with self._lock:
+            self._latencies.append(time.perf_counter() - start)
+        return ranked
+
+    def stats(self):
+        with self._lock:
+            latencies = sorted(self._latencies)
+            hits, misses = self.hits, self.misses
+
+        def pct(p):
+            if not latencies:
+                return 0.0
+            return round(latencies[min(len(latencies) - 1, int(p / 100 * len(latencies)))] * 1000, 3)
+
+        return {
+            "model": self.model_name,
+            "top_n": self.top_n,
+            "calls": len(latencies),
+            "latency_p50_ms": pct(50),
+            "latency_p95_ms": pct(95),
+            "cache_hits": hits,
+            "cache_misses": misses,
+            "cached_scores": len(self._scores),
+        }
@@ -0,0 +1,151 @@
+import atexit
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import unicodedata
+from collections import OrderedDict
+
+from langchain_core.documents import Document
+
+
+# ============================================================
+# NORMALIZACIÓN Y VERSIÓN DEL ÍNDICE
+# ============================================================
+
+def normalize_query(query):
+    """
+    Normaliza el texto de la pregunta para usarlo como clave de caché:
+    Unicode NFKC, minúsculas y espacios colapsados.
+    """
+    text = unicodedata.normalize("NFKC", query or "")
+    return re.sub(r"\s+", " ", text.casefold()).strip()
+
+
+def compute_index_version(texts, *extra):
+    """
+    Calcula una huella del índice a partir de los chunks indexados.
+    Si cambian los documentos (o la configuración en `extra`), cambia la versión.
+    """
+    h = hashlib.sha256()
+    for value in extra:
+        h.update(str(value).encode("utf-8"))
+    for t in texts:
+        if isinstance(t, Document):
+            h.update(t.page_content.encode("utf-8"))
+            h.update(json.dumps(t.metadata, sort_keys=True, default=str).encode("utf-8"))
+        else:
+            h.update(str(t).encode("utf-8"))
+        h.update(b"\0")
+    return h.hexdigest()[:16]
+
+
+def _copy_doc(doc):
+    return Document(page_content=doc.page_content, metadata=dict(doc.metadata))
+
+
+# ============================================================
+# CACHÉ LRU DE RESULTADOS DE RECUPERACIÓN
+# ============================================================
+
+class RetrievalCache:
+    """
+    Caché LRU acotada de resultados de recuperación.
+
+    Las claves son (versión del índice, pregunta normalizada). Al enlazar la
+    caché con una versión distinta (índice reconstruido o recargado) se
+    descartan todas las entradas anteriores. Con `persist_path` la caché se
+    carga al arrancar y se guarda al salir del proceso.
+    """
+
+    def __init__(self, max_entries=256, persist_path=None):
+        self.max_entries = max_entries
+        self.persist_path = persist_path
+        self.index_version = None
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+        if persist_path:
+            self._load()
+            atexit.register(self.save)
+
+    def bind(self, index_version):
+        """Asocia la caché a una versión del índice, invalidando si cambia."""
+        with self._lock:
+            if index_version != self.index_version:
+                self._entries.clear()
+                self.index_version = index_version
+
+    def get(self, query):
+        key = normalize_query(query)
+        with self._lock:
+            docs = self._entries.get(key)
+            if docs is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return [_copy_doc(d) for d in docs]
+
+    def put(self, query, docs):
+        key = normalize_query(query)
+        with self._lock:
+            self._entries[key] = [_copy_doc(d) for d in docs]
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "index_version": self.index_version,
+            }
+
+    # --------------------------------------------------------
+    # PERSISTENCIA
+    # --------------------------------------------------------
+
+    def save(self):
+        if not self.persist_path or self.index_version is None:
+            return
+
+        with self._lock:
+            payload = {
+                "index_version": self.index_version,
+                "entries": [
+                    [key, [{"page_content": d.page_content, "metadata": d.metadata} for d in docs]]
+                    for key, docs in self._entries.items()
+                ],
+            }
+
+        os.makedirs(os.path.dirname(self.persist_path) or ".", exist_ok=True)
+        tmp_path = self.persist_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(payload, f, ensure_ascii=False, default=str)
+        os.replace(tmp_path, self.persist_path)
+
+    def _load(self):
+        if not os.path.exists(self.persist_path):
+            return
+
+        try:
+            with open(self.persist_path, "r", encoding="utf-8") as f:
+                payload = json.load(f)
+        except Exception as e:
+            logging.warning(f"No se pudo cargar la caché de recuperación {self.persist_path}: {e}")
+            return
+
+        self.index_version = payload.get("index_version")
+        for key, docs in payload.get("entries", [])[-self.max_entries:]:
+            self._entries[key] = [Document(**d) for d in docs]
@@ -2,7 +2,8 @@
 
 set -e 
 
-FILES_WITH_MAIN=`grep -l main *.py | grep -v streamlit_app`
+# batch_generate.py necesita un CSV de entrada; server.py arranca uvicorn y no termina
+FILES_WITH_MAIN=`grep -l main *.py | grep -v -e streamlit_app -e batch_generate -e '^server\.py$'`
 for F in $FILES_WITH_MAIN; do
     echo "Running $F"
     python $F
@@ -0,0 +1,335 @@
+import argparse
+import asyncio
+import json
+import logging
+import os
+import tempfile
+import weakref
+from contextlib import ExitStack
+from urllib.parse import unquote
+
+from dotenv import load_dotenv
+
+import ensemble
+import filter as hybrid_filter
+from full_chain import create_session_manager
+from local_loader import load_txt_files
+from retrieval_cache import RetrievalCache
+from splitter import split_documents
+from tracing import trace_request
+from vector_store import get_store_dir
+
+
+# Configuración por variables de entorno (cada worker de uvicorn es un proceso)
+MAX_INFLIGHT = int(os.environ.get("RAG_SERVER_MAX_INFLIGHT", "32"))
+REQUEST_TIMEOUT = float(os.environ.get("RAG_SERVER_TIMEOUT", "60"))
+MAX_BODY_BYTES = 64 * 1024
+RETRIEVER_KIND = os.environ.get("RAG_SERVER_RETRIEVER", "filter")
+OFFLINE = os.environ.get("RAG_SERVER_OFFLINE") == "1"
+SHARED_SESSIONS = os.environ.get("RAG_SERVER_SHARED_SESSIONS") == "1"
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+class HTTPError(Exception):
+    def __init__(self, status, message, headers=None):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+        self.headers = headers or []
+
+
+# ============================================================
+# UTILIDADES ASGI
+# ============================================================
+
+async def read_json(receive):
+    body = b""
+    while True:
+        message = await receive()
+        body += message.get("body", b"")
+        if len(body) > MAX_BODY_BYTES:
+            raise HTTPError(413, "Cuerpo de la petición demasiado grande")
+        if not message.get("more_body"):
+            break
+    try:
+        return json.loads(body or b"{}")
+    except ValueError:
+        raise HTTPError(400, "JSON no válido")
+
+
+async def send_json(send, status, payload, headers=None):
+    body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [
+            (b"content-type", b"application/json; charset=utf-8"),
+            (b"content-length", str(len(body)).encode()),
+        ] + (headers or []),
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+def sse_event(event, payload):
+    data = json.dumps(payload, ensure_ascii=False)
+    return f"event: {event}\ndata: {data}\n\n".encode("utf-8")
+
+
+def session_payload(session_id, session):
+    return {
+        "session_id": session_id,
+        "current_subject": session.current_subject,
+        "current_behavioral_profile": session.current_behavioral_profile,
+        "current_goal": session.current_goal,
+        "degraded": getattr(session, "last_degraded", False),
+    }
+
+
+# ============================================================
+# SERVICIO
+# ============================================================
+
+class ChatService:
+    """
+    Aplicación ASGI con el chatbot RAG:
+
+    - GET    /health                 estado del proceso
+    - POST   /chat                   {"session_id", "question"} -> respuesta JSON
+    - POST   /chat/stream            igual, con Server-Sent Events (token / done / error)
+    - DELETE /sessions/{session_id}  borra la sesión
+
+    El retriever se construye una vez al arrancar y lo comparten todas las
+    sesiones. Con más de `max_inflight` turnos en curso se responde 503
+    (backpressure) y cada turno tiene un tiempo máximo de `timeout` segundos.
+    """
+
+    def __init__(self, max_inflight=MAX_INFLIGHT, timeout=REQUEST_TIMEOUT,
+                 retriever_kind=RETRIEVER_KIND, offline=OFFLINE, shared_sessions=SHARED_SESSIONS):
+        self.max_inflight = max_inflight
+        self.timeout = timeout
+        self.retriever_kind = retriever_kind
+        self.offline = offline
+        self.shared_sessions = shared_sessions
+
+        self.manager = None
+        self.inflight = 0
+        self._session_locks = weakref.WeakValueDictionary()
+        self._resources = ExitStack()
+
+    # --------------------------------------------------------
+    # CICLO DE VIDA
+    # --------------------------------------------------------
+
+    def startup(self):
+        load_dotenv()
+        os.environ["TOKENIZERS_PARALLELISM"] = "false"
+
+        if self.offline:
+            from benchmark import offline_backends
+            self._resources.enter_context(offline_backends(store_dir=os.environ.get("RAG_STORE_DIR")))
+
+        store_dir = get_store_dir()
+        cache = RetrievalCache(persist_path=os.path.join(store_dir, "retrieval_cache.json"))
+        with trace_request("index", retriever=self.retriever_kind):
+            docs = load_txt_files(os.path.join(BASE_DIR, "data"))
+            if self.retriever_kind == "ensemble":
+                retriever = ensemble.ensemble_retriever_from_docs(docs, cache=cache)
+            else:
+                retriever = hybrid_filter.create_retriever(split_documents(docs), cache=cache)
+
+        self.manager = create_session_manager(
+            retriever,
+            db_path=os.path.join(store_dir, "sessions.sqlite3"),
+            shared=self.shared_sessions,
+        )
+
+    def shutdown(self):
+        if self.manager is not None:
+            self.manager.close()
+        self._resources.close()
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                try:
+                    await asyncio.get_running_loop().run_in_executor(None, self.startup)
+                except Exception as e:
+                    logging.exception("Fallo al arrancar el servicio")
+                    await send({"type": "lifespan.startup.failed", "message": str(e)})
+                    return
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                self.shutdown()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    # --------------------------------------------------------
+    # ENRUTADO
+    # --------------------------------------------------------
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            return await self.lifespan(receive, send)
+        if scope["type"] != "http":
+            return
+
+        method, path = scope["method"], scope["path"].rstrip("/") or "/"
+        try:
+            if method == "GET" and path == "/health":
+                return await send_json(send, 200, self.health())
+            if method == "POST" and path == "/chat":
+                return await self.chat(receive, send)
+            if method == "POST" and path == "/chat/stream":
+                return await self.chat_stream(receive, send)
+            if method == "DELETE" and path.startswith("/sessions/"):
+                if self.manager is None:
+                    raise HTTPError(503, "Servicio arrancando", [(b"retry-after", b"5")])
+                session_id = unquote(path[len("/sessions/"):])
+                await asyncio.get_running_loop().run_in_executor(None, self.manager.drop, session_id)
+                return await send_json(send, 200, {"session_id": session_id, "deleted": True})
+            raise HTTPError(404, "Ruta no encontrada")
+        except HTTPError as e:
+            await send_json(send, e.status, {"error": e.message}, e.headers)
+
+    def health(self):
+        return {
+            "status": "ok" if self.manager is not None else "starting",
+            "inflight": self.inflight,
+            "max_inflight": self.max_inflight,
+            "sessions": self.manager.stats() if self.manager is not None else None,
+        }
+
+    # --------------------------------------------------------
+    # TURNOS
+    # --------------------------------------------------------
+
+    async def parse_turn(self, receive):
+        payload = await read_json(receive)
+        if not isinstance(payload, dict):
+            raise HTTPError(400, "Se esperaba un objeto JSON")
+        session_id = str(payload.get("session_id") or "").strip()
+        question = str(payload.get("question") or "").strip()
+        if not session_id or not question:
+            raise HTTPError(400, "Se requieren 'session_id' y 'question'")
+        return session_id, question
+
+    def admit(self):
+        """Backpressure: rechaza en lugar de encolar sin límite."""
+        if self.manager is None:
+            raise HTTPError(503, "Servicio arrancando", [(b"retry-after", b"5")])
+        if self.inflight >= self.max_inflight:
+            raise HTTPError(503, "Servicio saturado, reintenta más tarde", [(b"retry-after", b"1")])
+        self.inflight += 1
+
+    def session_lock(self, session_id):
+        # Los turnos de una misma sesión se ejecutan en orden
+        lock = self._session_locks.get(session_id)
+        if lock is None:
+            lock = asyncio.Lock()
+            self._session_locks[session_id] = lock
+        return lock
+
+    def after_turn(self):
+        # Con varios workers el siguiente turno puede ir a otro proceso
+        if self.shared_sessions:
+            self.manager.flush()
+
+    async def chat(self, receive, send):
+        session_id, question = await self.parse_turn(receive)
+        self.admit()
+        try:
+            async with self.session_lock(session_id):
+                session = self.manager.get(session_id)
+                try:
+                    response = await asyncio.wait_for(session.ainvoke(question), self.timeout)
+                except asyncio.TimeoutError:
+                    raise HTTPError(504, "Tiempo de respuesta agotado")
+                await asyncio.get_running_loop().run_in_executor(None, self.after_turn)
+                payload = session_payload(session_id, session)
+        finally:
+            self.inflight -= 1
+
+        await send_json(send, 200, {"answer": response.content, **payload})
+
+    async def chat_stream(self, receive, send):
+        session_id, question = await self.parse_turn(receive)
+        self.admit()
+        try:
+            await send({
+                "type": "http.response.start",
+                "status": 200,
+                "headers": [
+                    (b"content-type", b"text/event-stream; charset=utf-8"),
+                    (b"cache-control", b"no-cache"),
+                    (b"x-accel-buffering", b"no"),
+                ],
+            })
+
+            async def relay(session):
+                async for chunk in session.astream(question):
+                    if chunk.content:
+                        await send({
+                            "type": "http.response.body",
+                            "body": sse_event("token", {"content": chunk.content}),
+                            "more_body": True,
+                        })
+
+            async with self.session_lock(session_id):
+                session = self.manager.get(session_id)
+                try:
+                    # wait_for (no asyncio.timeout, que es de Python 3.11+), como en `chat`
+                    await asyncio.wait_for(relay(session), self.timeout)
+                    await asyncio.get_running_loop().run_in_executor(None, self.after_turn)
+                    final = sse_event("done", session_payload(session_id, session))
+                except asyncio.TimeoutError:
+                    final = sse_event("error", {"error": "Tiempo de respuesta agotado"})
+                except OSError:
+                    # El cliente cerró la conexión
+                    return
+                except Exception as e:
+                    logging.exception("Error generando la respuesta")
+                    final = sse_event("error", {"error": str(e)})
+
+            await send({"type": "http.response.body", "body": final})
+        finally:
+            self.inflight -= 1
+
+
+app = ChatService()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Servicio HTTP (JSON + SSE) del chatbot RAG.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=1, help="Procesos de uvicorn")
+    parser.add_argument("--max-inflight", type=int, default=MAX_INFLIGHT, help="Turnos simultáneos por worker")
+    parser.add_argument("--timeout", type=float, default=REQUEST_TIMEOUT, help="Tiempo máximo por turno (s)")
+    parser.add_argument("--retriever", choices=["filter", "ensemble"], default=RETRIEVER_KIND)
+    parser.add_argument("--offline", action="store_true", help="LLM y embeddings locales simulados")
+    args = parser.parse_args()
+
+    # Los workers heredan la configuración por entorno
+    os.environ["RAG_SERVER_MAX_INFLIGHT"] = str(args.max_inflight)
+    os.environ["RAG_SERVER_TIMEOUT"] = str(args.timeout)
+    os.environ["RAG_SERVER_RETRIEVER"] = args.retriever
+    if args.offline:
+        os.environ["RAG_SERVER_OFFLINE"] = "1"
+        os.environ.setdefault("RAG_STORE_DIR", tempfile.mkdtemp(prefix="rag-server-"))
+    if args.workers > 1:
+        os.environ["RAG_SERVER_SHARED_SESSIONS"] = "1"
+
+    import uvicorn
+    uvicorn.run(
+        "server:app",
+        host=args.host,
+        port=args.port,
+        workers=args.workers,
+        app_dir=BASE_DIR,
+        timeout_graceful_shutdown=int(args.timeout),
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,219 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from langchain_core.chat_history import BaseChatMessageHistory
+
+
+SESSIONS_DB = "store/sessions.sqlite3"
+
+
+def _history_of(session):
+    """Historial de una sesión: la propia memoria o la de un MemoryWrappedChain."""
+    if isinstance(session, BaseChatMessageHistory):
+        return session
+    return session.chat_memory
+
+
+# ============================================================
+# GESTOR DE SESIONES (LRU + SQLITE WRITE-BEHIND)
+# ============================================================
+
+class SessionManager:
+    """
+    Sesiones independientes por `session_id`.
+
+    - Las sesiones activas viven en memoria, con expulsión LRU.
+    - Los cambios se escriben en SQLite por lotes desde un hilo en segundo plano.
+    - Las sesiones se rehidratan desde disco solo cuando se vuelven a pedir.
+
+    `factory()` crea una sesión vacía; las sesiones deben implementar
+    `get_state()` / `set_state(state)` (MemoryWrappedChain o SummaryBufferMemory).
+    Con `db_path=None` no hay persistencia.
+
+    Con `shared=True` varios procesos comparten la misma base: antes de
+    devolver una sesión en memoria se comprueba si otro proceso la ha
+    guardado después, y en ese caso se recarga.
+    """
+
+    def __init__(self, factory, db_path=SESSIONS_DB, max_sessions=256, flush_interval=2.0, shared=False):
+        self.factory = factory
+        self.db_path = db_path
+        self.max_sessions = max_sessions
+        self.flush_interval = flush_interval
+        self.shared = shared and bool(db_path)
+
+        self._sessions = OrderedDict()
+        self._dirty = set()
+        self._pending = {}     # estado serializado de sesiones expulsadas sin guardar
+        self._versions = {}    # updated_at de la última versión leída o escrita
+        self._lock = threading.RLock()
+        self._db_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._conn = None
+        self._flusher = None
+
+        if db_path:
+            os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+            self._conn = sqlite3.connect(db_path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS sessions ("
+                "session_id TEXT PRIMARY KEY, state TEXT NOT NULL, updated_at REAL NOT NULL)"
+            )
+            self._conn.commit()
+
+            self._flusher = threading.Thread(target=self._flush_loop, name="session-flush", daemon=True)
+            self._flusher.start()
+
+    # --------------------------------------------------------
+    # ACCESO
+    # --------------------------------------------------------
+
+    def get(self, session_id):
+        """Devuelve la sesión, rehidratándola desde disco si hace falta."""
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is not None and not self._is_stale(session_id):
+                self._sessions.move_to_end(session_id)
+                return session
+            if session is not None:
+                # Versión obsoleta: se descarta y se recarga desde disco
+                _history_of(session).on_change = None
+
+            session = self.factory()
+            pending = self._pending.pop(session_id, None)
+            state = pending or self._load(session_id)
+            if state is not None:
+                session.set_state(json.loads(state))
+            if pending is not None:
+                # Aún no estaba en disco: sigue pendiente de escritura
+                self._dirty.add(session_id)
+
+            _history_of(session).on_change = lambda: self._mark_dirty(session_id)
+            self._sessions[session_id] = session
+            self._sessions.move_to_end(session_id)
+            self._evict()
+            return session
+
+    def get_history(self, session_id):
+        """Compatible con `RunnableWithMessageHistory(get_session_history=...)`."""
+        return _history_of(self.get(session_id))
+
+    def drop(self, session_id):
+        with self._lock:
+            self._sessions.pop(session_id, None)
+            self._dirty.discard(session_id)
+            self._pending.pop(session_id, None)
+            self._versions.pop(session_id, None)
+        if self._conn is not None:
+            with self._db_lock:
+                self._conn.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+                self._conn.commit()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "active": len(self._sessions),
+                "dirty": len(self._dirty),
+                "pending": len(self._pending),
+                "max_sessions": self.max_sessions,
+            }
+
+    # --------------------------------------------------------
+    # EXPULSIÓN Y PERSISTENCIA
+    # --------------------------------------------------------
+
+    def _mark_dirty(self, session_id):
+        if self._conn is None:
+            return
+        with self._lock:
+            if session_id in self._sessions:
+                self._dirty.add(session_id)
+
+    def _evict(self):
+        while len(self._sessions) > self.max_sessions:
+            session_id, session = self._sessions.popitem(last=False)
+            _history_of(session).on_change = None
+            self._versions.pop(session_id, None)
+            if session_id in self._dirty:
+                self._dirty.discard(session_id)
+                self._pending[session_id] = json.dumps(session.get_state(), ensure_ascii=False)
+
+    def _is_stale(self, session_id):
+        """En modo compartido, indica si otro proceso guardó una versión más reciente."""
+        if not self.shared or session_id in self._dirty:
+            return False
+        with self._db_lock:
+            row = self._conn.execute(
+                "SELECT updated_at FROM sessions WHERE session_id = ?", (session_id,)
+            ).fetchone()
+        return bool(row) and row[0] > self._versions.get(session_id, 0.0)
+
+    def _load(self, session_id):
+        if self._conn is None:
+            return None
+        with self._db_lock:
+            row = self._conn.execute(
+                "SELECT state, updated_at FROM sessions WHERE session_id = ?", (session_id,)
+            ).fetchone()
+        if not row:
+            return None
+        self._versions[session_id] = row[1]
+        return row[0]
+
+    def flush(self):
+        """Escribe en un solo lote todas las sesiones modificadas."""
+        if self._conn is None:
+            return 0
+
+        with self._lock:
+            rows = [(sid, state) for sid, state in self._pending.items()]
+            rows += [
+                (sid, json.dumps(self._sessions[sid].get_state(), ensure_ascii=False))
+                for sid in self._dirty
+            ]
+            self._pending.clear()
+            self._dirty.clear()
+
+        if not rows:
+            return 0
+
+        now = time.time()
+        try:
+            with self._db_lock:
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO sessions (session_id, state, updated_at) VALUES (?, ?, ?)",
+                    [(sid, state, now) for sid, state in rows],
+                )
+                self._conn.commit()
+            with self._lock:
+                for sid, _ in rows:
+                    self._versions[sid] = now
+        except Exception:
+            # Se reintenta en el siguiente lote sin pisar cambios más recientes
+            with self._lock:
+                for sid, state in rows:
+                    if sid not in self._dirty:
+                        self._pending.setdefault(sid, state)
+            raise
+        return len(rows)
+
+    def _flush_loop(self):
+        while not self._stop.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception as e:
+                logging.warning(f"No se pudieron guardar las sesiones: {e}")
+
+    def close(self):
+        self._stop.set()
+        if self._conn is not None:
+            self.flush()
+            with self._db_lock:
+                self._conn.close()
+            self._conn = None
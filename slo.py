@@ -0,0 +1,324 @@
+import asyncio
+import contextvars
+import logging
+import math
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from basic_chain import basic_chain
+from rag_chain import make_rag_chain
+from tracing import current_trace, span
+
+
+# ============================================================
+# PLAZOS POR ETAPA Y DEGRADACIÓN ESCALONADA
+# ============================================================
+#
+# Cada etapa del turno tiene un plazo. Si la recuperación no llega a
+# tiempo (o falla) se baja un escalón:
+#
+#   full (búsqueda híbrida) -> bm25 (solo léxica) -> core (solo fichas)
+#   -> none (fallback_prompt de basic_chain, sin RAG)
+#
+# Con el modelo, pasado el umbral de cobertura (p95 de las últimas
+# respuestas, o uno fijo) se lanza una petición duplicada y gana la
+# primera. Si aun así vence el plazo o falla, responde el fallback_prompt.
+# Las respuestas degradadas llevan `slo` en response_metadata.
+
+RETRIEVAL_DEADLINE_S = float(os.environ.get("RAG_SLO_RETRIEVAL_S", 3.0))
+STEP_DEADLINE_S = float(os.environ.get("RAG_SLO_STEP_S", 1.0))          # cada escalón degradado
+LLM_DEADLINE_S = float(os.environ.get("RAG_SLO_LLM_S", 20.0))
+FALLBACK_DEADLINE_S = float(os.environ.get("RAG_SLO_FALLBACK_S", 10.0))
+HEDGE = os.environ.get("RAG_SLO_HEDGE", "1") == "1"
+HEDGE_AFTER_S = float(os.environ["RAG_SLO_HEDGE_AFTER_S"]) if os.environ.get("RAG_SLO_HEDGE_AFTER_S") else None
+HEDGE_PERCENTILE = 95
+HEDGE_MIN_SAMPLES = 20    # sin umbral fijo, no se duplica hasta tener un p95 fiable
+LATENCY_WINDOW = 200
+
+# Escalones que entiende un retriever sin atributo `modes` (solo búsqueda completa)
+DEFAULT_MODES = ("full",)
+
+
+def enabled():
+    """`RAG_SLO=0` desactiva el ejecutor (las etapas esperan sin plazo)."""
+    return os.environ.get("RAG_SLO", "1") != "0"
+
+
+def with_mode(config, mode):
+    """Propaga el escalón al retriever en los metadatos de la ejecución (como `current_goal`)."""
+    config = dict(config or {})
+    config["metadata"] = {**(config.get("metadata") or {}), "retrieval_mode": mode}
+    return config
+
+
+def fallback_input(inputs):
+    """Entrada del fallback_prompt: la pregunta, con el sujeto activo si lo hay."""
+    question = inputs.get("question", "")
+    subject = inputs.get("current_subject")
+    return {"input": f"(Sujeto activo: {subject})\n{question}" if subject else question}
+
+
+def degradation(retrieval="full", fallback=False, hedged=False):
+    """Resumen de lo que se degradó en el turno (también queda en la traza)."""
+    info = {
+        "degraded": retrieval != "full" or fallback,
+        "retrieval": retrieval,
+        "fallback": fallback,
+        "hedged": hedged,
+    }
+    trace = current_trace()
+    if trace is not None:
+        trace.set(slo=info)
+    return info
+
+
+def mark(response, **kwargs):
+    response.response_metadata = {**(response.response_metadata or {}), "slo": degradation(**kwargs)}
+    return response
+
+
+def is_degraded(response):
+    metadata = getattr(response, "response_metadata", None) or {}
+    return bool(metadata.get("slo", {}).get("degraded"))
+
+
+# ============================================================
+# EJECUTOR
+# ============================================================
+
+class DeadlineExecutor:
+    """
+    Ejecuta recuperación y modelo con plazo. Se comparte entre sesiones:
+    el umbral de cobertura sale de las latencias de todas ellas.
+
+    En la ruta síncrona las etapas corren en pools de hilos (con el
+    contexto de la traza), uno para la recuperación y otro para el modelo.
+    Un hilo no se puede cancelar: una etapa vencida y la petición duplicada
+    que pierde siguen en segundo plano hasta terminar (una búsqueda completa
+    tardía deja al menos su resultado en la caché). Para que esas tareas no
+    dejen en cola a los turnos nuevos, con el pool lleno se salta el escalón
+    de recuperación o la petición duplicada. En la ruta asíncrona las tareas
+    vencidas y la perdedora se cancelan.
+    """
+
+    def __init__(self, retrieval_deadline=RETRIEVAL_DEADLINE_S, step_deadline=STEP_DEADLINE_S,
+                 llm_deadline=LLM_DEADLINE_S, fallback_deadline=FALLBACK_DEADLINE_S,
+                 hedge=HEDGE, hedge_after=HEDGE_AFTER_S, retrieval_workers=16, llm_workers=32):
+        self.retrieval_deadline = retrieval_deadline
+        self.step_deadline = step_deadline
+        self.llm_deadline = llm_deadline
+        self.fallback_deadline = fallback_deadline
+        self.hedge = hedge
+        self.hedge_after = hedge_after
+        self._latencies = deque(maxlen=LATENCY_WINDOW)
+        self._lock = threading.Lock()
+        self._retrieval_pool = ThreadPoolExecutor(max_workers=retrieval_workers, thread_name_prefix="rag-slo-retrieval")
+        self._llm_pool = ThreadPoolExecutor(max_workers=llm_workers, thread_name_prefix="rag-slo-llm")
+        self._capacity = {self._retrieval_pool: retrieval_workers, self._llm_pool: llm_workers}
+        self._busy = {self._retrieval_pool: 0, self._llm_pool: 0}
+
+    def _submit(self, pool, func, *args):
+        # Cada tarea con su copia del contexto: spans y embeddings de la petición
+        with self._lock:
+            self._busy[pool] += 1
+        future = pool.submit(contextvars.copy_context().run, func, *args)
+        future.add_done_callback(lambda _: self._release(pool))
+        return future
+
+    def _release(self, pool):
+        with self._lock:
+            self._busy[pool] -= 1
+
+    def saturated(self, pool):
+        """¿Todos los hilos del pool ocupados (una tarea nueva esperaría en cola)?"""
+        with self._lock:
+            return self._busy[pool] >= self._capacity[pool]
+
+    def steps(self, retriever):
+        modes = getattr(retriever, "modes", DEFAULT_MODES)
+        return [(mode, self.retrieval_deadline if i == 0 else self.step_deadline) for i, mode in enumerate(modes)]
+
+    # ---- umbral de cobertura ----
+
+    def observe(self, seconds):
+        with self._lock:
+            self._latencies.append(seconds)
+
+    def hedge_delay(self):
+        """Segundos tras los que se duplica la petición al modelo (None = no duplicar)."""
+        if not self.hedge:
+            return None
+        if self.hedge_after is not None:
+            return self.hedge_after
+        with self._lock:
+            samples = sorted(self._latencies)
+        if len(samples) < HEDGE_MIN_SAMPLES:
+            return None
+        return samples[max(1, math.ceil(HEDGE_PERCENTILE / 100 * len(samples))) - 1]
+
+    # ---- recuperación por escalones ----
+
+    def retrieve(self, retriever, query, config=None):
+        """(documentos, escalón); ("none") si ningún escalón responde a tiempo."""
+        for mode, deadline in self.steps(retriever):
+            if self.saturated(self._retrieval_pool):
+                logging.warning(f"Recuperación '{mode}' omitida: pool de recuperación lleno")
+                continue
+            future = self._submit(self._retrieval_pool, retriever.invoke, query, with_mode(config, mode))
+            try:
+                return future.result(timeout=deadline), mode
+            except Exception as e:
+                logging.warning(f"Recuperación '{mode}' sin resultado en {deadline}s: {e!r}")
+        return [], "none"
+
+    async def aretrieve(self, retriever, query, config=None):
+        for mode, deadline in self.steps(retriever):
+            try:
+                docs = await asyncio.wait_for(retriever.ainvoke(query, with_mode(config, mode)), deadline)
+                return docs, mode
+            except Exception as e:
+                logging.warning(f"Recuperación '{mode}' sin resultado en {deadline}s: {e!r}")
+        return [], "none"
+
+    # ---- modelo con petición duplicada ----
+
+    def call(self, func, *args, deadline=None, observe=True):
+        """
+        (resultado, duplicada): si `func` no termina antes del umbral de
+        cobertura se lanza una copia y gana la primera en terminar bien.
+
+        La latencia observada (para el p95) se mide desde la primera
+        petición, aunque gane la copia; con `observe=False` (fallback) no
+        entra en la ventana. La copia perdedora no se puede cancelar.
+        """
+        deadline = self.llm_deadline if deadline is None else deadline
+        started = time.perf_counter()
+        hedge_at = self.hedge_delay()
+        pending = {self._submit(self._llm_pool, func, *args)}
+        hedged, error = False, None
+
+        while pending:
+            now = time.perf_counter()
+            if now >= started + deadline:
+                break
+            timeout = started + deadline - now
+            if hedge_at is not None and not hedged:
+                timeout = min(timeout, max(0.0, started + hedge_at - now))
+
+            done, _ = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+            for future in done:
+                pending.discard(future)
+                if future.exception() is None:
+                    if observe:
+                        self.observe(time.perf_counter() - started)
+                    return future.result(), hedged
+                error = future.exception()
+
+            if not done and hedge_at is not None and not hedged:
+                # Con el pool lleno la copia esperaría en cola: no se duplica
+                if self.saturated(self._llm_pool):
+                    hedge_at = None
+                    continue
+                with span("hedge", after_ms=round(hedge_at * 1000, 3)):
+                    pending.add(self._submit(self._llm_pool, func, *args))
+                hedged = True
+
+        if pending or error is None:
+            raise TimeoutError(f"Sin respuesta del modelo en {deadline}s")
+        raise error
+
+    async def acall(self, afunc, *args, deadline=None, observe=True):
+        deadline = self.llm_deadline if deadline is None else deadline
+        started = time.perf_counter()
+        hedge_at = self.hedge_delay()
+        pending = {asyncio.ensure_future(afunc(*args))}
+        hedged, error = False, None
+
+        try:
+            while pending:
+                now = time.perf_counter()
+                if now >= started + deadline:
+                    break
+                timeout = started + deadline - now
+                if hedge_at is not None and not hedged:
+                    timeout = min(timeout, max(0.0, started + hedge_at - now))
+
+                done, _ = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    pending.discard(task)
+                    if task.exception() is None:
+                        if observe:
+                            self.observe(time.perf_counter() - started)
+                        return task.result(), hedged
+                    error = task.exception()
+
+                if not done and hedge_at is not None and not hedged:
+                    with span("hedge", after_ms=round(hedge_at * 1000, 3)):
+                        pending.add(asyncio.ensure_future(afunc(*args)))
+                    hedged = True
+        finally:
+            # La perdedora (o las vencidas) no siguen consumiendo tokens
+            for task in pending:
+                task.cancel()
+
+        if pending or error is None:
+            raise TimeoutError(f"Sin respuesta del modelo en {deadline}s")
+        raise error
+
+    # ---- respuesta del turno ----
+
+    def respond(self, chain, fallback_chain, inputs, retrieval="full", config=None):
+        """Respuesta marcada; con recuperación "none" o si el modelo falla, fallback_prompt."""
+        if retrieval != "none":
+            try:
+                response, hedged = self.call(chain.invoke, inputs, config)
+                return mark(response, retrieval=retrieval, hedged=hedged)
+            except Exception as e:
+                logging.warning(f"Modelo sin respuesta válida ({e!r}): se usa el prompt de respaldo")
+
+        response, hedged = self.call(fallback_chain.invoke, fallback_input(inputs), config,
+                                     deadline=self.fallback_deadline, observe=False)
+        return mark(response, retrieval=retrieval, fallback=True, hedged=hedged)
+
+    async def arespond(self, chain, fallback_chain, inputs, retrieval="full", config=None):
+        if retrieval != "none":
+            try:
+                response, hedged = await self.acall(chain.ainvoke, inputs, config)
+                return mark(response, retrieval=retrieval, hedged=hedged)
+            except Exception as e:
+                logging.warning(f"Modelo sin respuesta válida ({e!r}): se usa el prompt de respaldo")
+
+        response, hedged = await self.acall(fallback_chain.ainvoke, fallback_input(inputs), config,
+                                            deadline=self.fallback_deadline, observe=False)
+        return mark(response, retrieval=retrieval, fallback=True, hedged=hedged)
+
+
+# ============================================================
+# CADENA RAG CON PLAZOS (pregunta -> respuesta)
+# ============================================================
+
+class SLORagChain:
+    """
+    Equivalente a `make_rag_chain(model, retriever)` para entradas de texto
+    (la app de Streamlit), pero con recuperación por escalones, petición
+    duplicada al modelo y fallback_prompt como último recurso.
+    """
+
+    def __init__(self, model, retriever, executor=None):
+        self.retriever = retriever
+        self.chain = make_rag_chain(model, retriever)
+        self.fallback_chain = basic_chain(model)
+        self.executor = executor or DeadlineExecutor()
+
+    def invoke(self, question, config=None):
+        docs, mode = self.executor.retrieve(self.retriever, question, config)
+        inputs = {"question": question, "documents": docs}
+        return self.executor.respond(self.chain, self.fallback_chain, inputs, mode, config)
+
+    async def ainvoke(self, question, config=None):
+        docs, mode = await self.executor.aretrieve(self.retriever, question, config)
+        inputs = {"question": question, "documents": docs}
+        return await self.executor.arespond(self.chain, self.fallback_chain, inputs, mode, config)
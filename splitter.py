@@ -1,11 +1,33 @@
+import hashlib
+import os
+
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 from langchain_core.documents import Document
 
+from categories import categorize
+from dedup import deduplicate_chunks
+from tracing import span
+
 
-def split_documents(docs):
+def chunk_id(doc):
+    """
+    Identificador estable de un chunk (nombre del archivo de origen + contenido).
+    No depende del directorio de trabajo ni del separador de rutas del sistema.
+    """
+    if doc.metadata.get("chunk_id"):
+        return doc.metadata["chunk_id"]
+    source = str(doc.metadata.get("source") or doc.metadata.get("title") or "")
+    source = os.path.basename(source.replace("\\", "/"))
+    return hashlib.sha1(f"{source}\0{doc.page_content}".encode("utf-8")).hexdigest()[:16]
+
+
+def split_documents(docs, dedup=True):
     """
     Divide documentos en chunks compatibles con LangChain moderno, 
     preservando metadatos cuando existen.
+
+    Con `dedup`, los chunks casi duplicados se reducen a uno por grupo
+    (ver `dedup.deduplicate_chunks`).
     """
 
     text_splitter = RecursiveCharacterTextSplitter(
@@ -16,15 +38,27 @@ def split_documents(docs):
 
     processed_docs = []
 
-    for doc in docs:
-        if isinstance(doc, Document):
-            # Preserva metadatos al dividir
-            chunks = text_splitter.split_documents([doc])
-            processed_docs.extend(chunks)
-        else:
-            # Caso donde doc es string
-            chunks = text_splitter.create_documents([doc])
-            processed_docs.extend(chunks)
+    with span("split", docs=len(docs)):
+        for doc in docs:
+            if isinstance(doc, Document):
+                # Preserva metadatos al dividir
+                chunks = text_splitter.split_documents([doc])
+                processed_docs.extend(chunks)
+            else:
+                # Caso donde doc es string
+                chunks = text_splitter.create_documents([doc])
+                processed_docs.extend(chunks)
+
+        for chunk in processed_docs:
+            chunk.metadata["chunk_id"] = chunk_id(chunk)
+            chunk.metadata["category"] = categorize(chunk)
+
+    if dedup:
+        before = len(processed_docs)
+        with span("dedup", chunks=before):
+            processed_docs = deduplicate_chunks(processed_docs)
+        if len(processed_docs) < before:
+            print(f"Removed {before - len(processed_docs)} near-duplicate chunks")
 
     print(f"Split into {len(processed_docs)} chunks")
     return processed_docs
@@ -0,0 +1,243 @@
+import argparse
+import json
+import os
+import shutil
+import sqlite3
+import time
+
+from langchain_core.documents import Document
+
+from local_loader import load_txt_files
+from splitter import chunk_id, split_documents
+from vector_store import get_store_dir
+
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+SQLITE_FILE = "chroma.sqlite3"
+
+
+# ============================================================
+# INSPECCIÓN DEL STORE
+# ============================================================
+
+def dir_size(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            total += os.path.getsize(os.path.join(root, name))
+    return total
+
+
+def persist_dirs(store_dir):
+    """Subdirectorios del store con una base Chroma (chroma.sqlite3)."""
+    if not os.path.isdir(store_dir):
+        return []
+    return sorted(
+        os.path.join(store_dir, name) for name in os.listdir(store_dir)
+        if os.path.isfile(os.path.join(store_dir, name, SQLITE_FILE))
+    )
+
+
+def referenced_segments(persist_dir):
+    """Ids de los segmentos que la base SQLite todavía conoce."""
+    con = sqlite3.connect(os.path.join(persist_dir, SQLITE_FILE))
+    try:
+        return {row[0] for row in con.execute("SELECT id FROM segments")}
+    finally:
+        con.close()
+
+
+def orphan_segment_dirs(persist_dir):
+    """Directorios de segmentos HNSW (UUID) que ya no pertenecen a ninguna colección."""
+    segments = referenced_segments(persist_dir)
+    return sorted(
+        os.path.join(persist_dir, name) for name in os.listdir(persist_dir)
+        if os.path.isdir(os.path.join(persist_dir, name)) and name not in segments
+    )
+
+
+def normalize_source(source):
+    """Rutas guardadas en Windows ("data\\x.txt") o en otro sistema: separador local."""
+    return str(source).replace("\\", "/").replace("/", os.sep)
+
+
+class SourceIndex:
+    """
+    Chunks actuales del corpus (data/ troceado como al indexar), para
+    detectar entradas huérfanas: de archivos que ya no existen o de una
+    versión anterior del texto o del troceado.
+    """
+
+    def __init__(self, data_dir=None):
+        self.chunks = set()
+        self.files = set()
+        if data_dir and os.path.isdir(data_dir):
+            for doc in split_documents(load_txt_files(data_dir)):
+                name = os.path.basename(doc.metadata["source"])
+                self.files.add(name)
+                self.chunks.add((name, doc.page_content))
+
+    def is_orphan(self, document, metadata):
+        source = (metadata or {}).get("source")
+        if not source:
+            return False
+        name = os.path.basename(normalize_source(source))
+        return name not in self.files or (name, document) not in self.chunks
+
+
+def entry_key(document, metadata):
+    """Dos entradas son la misma si tienen el mismo texto y el mismo archivo de origen."""
+    source = os.path.basename(normalize_source((metadata or {}).get("source") or ""))
+    return source, document
+
+
+def analyze_collection(collection, sources):
+    """
+    Entradas que se conservan (una por chunk, con su chunk_id como id) y
+    recuento de duplicados y huérfanas.
+    """
+    data = collection.get(include=["embeddings", "documents", "metadatas"])
+    keep, seen = {}, set()
+    duplicates = orphans = 0
+
+    for i, entry_id in enumerate(data["ids"]):
+        document = data["documents"][i] or ""
+        metadata = data["metadatas"][i] or {}
+        key = entry_key(document, metadata)
+        if key in seen:
+            duplicates += 1
+            continue
+        seen.add(key)
+        if sources.is_orphan(document, metadata):
+            orphans += 1
+            continue
+
+        new_id = chunk_id(Document(page_content=document, metadata=metadata))
+        keep[new_id] = (data["embeddings"][i], document, metadata, entry_id)
+
+    return {
+        "vectors": len(data["ids"]),
+        "unique": len(keep),
+        "duplicates": duplicates,
+        "orphans": orphans,
+        "legacy_ids": sum(1 for new_id, entry in keep.items() if entry[3] != new_id),
+    }, keep
+
+
+# ============================================================
+# REPARACIÓN
+# ============================================================
+
+def rebuild_collection(client, collection, keep):
+    """
+    Recrea la colección solo con las entradas a conservar, reutilizando sus
+    vectores (no se vuelve a embeber nada). Chroma construye un segmento
+    HNSW nuevo y compacto; el antiguo queda huérfano y se borra después.
+    """
+    name, metadata = collection.name, collection.metadata
+    client.delete_collection(name)
+    fresh = client.create_collection(name, metadata=metadata or None, embedding_function=None)
+
+    ids = list(keep)
+    batch = client.get_max_batch_size()
+    for start in range(0, len(ids), batch):
+        chunk = ids[start:start + batch]
+        fresh.add(
+            ids=chunk,
+            embeddings=[keep[i][0] for i in chunk],
+            documents=[keep[i][1] for i in chunk],
+            metadatas=[keep[i][2] or None for i in chunk],
+        )
+    return fresh
+
+
+def vacuum(persist_dir):
+    con = sqlite3.connect(os.path.join(persist_dir, SQLITE_FILE))
+    try:
+        con.execute("VACUUM")
+    finally:
+        con.close()
+
+
+# ============================================================
+# PUNTO DE ENTRADA
+# ============================================================
+
+def maintain(store_dir=None, apply=False, data_dir=os.path.join(BASE_DIR, "data")):
+    """
+    Informe por colección (vectores, duplicados, huérfanas, tamaño en disco).
+    Con `apply`, elimina duplicados y huérfanas, reconstruye los segmentos
+    HNSW, borra los directorios de segmentos huérfanos y compacta SQLite.
+    """
+    import chromadb
+
+    store_dir = store_dir or get_store_dir()
+    sources = SourceIndex(data_dir)
+    report = []
+
+    for persist_dir in persist_dirs(store_dir):
+        entry = {"path": persist_dir, "size_before": dir_size(persist_dir), "collections": []}
+        client = chromadb.PersistentClient(path=persist_dir)
+
+        for collection in client.list_collections():
+            started = time.perf_counter()
+            stats, keep = analyze_collection(collection, sources)
+            stats["name"] = collection.name
+            needs_rebuild = stats["duplicates"] or stats["orphans"] or stats["legacy_ids"]
+            if apply and needs_rebuild:
+                rebuild_collection(client, collection, keep)
+                stats["rebuilt"] = True
+            stats["seconds"] = round(time.perf_counter() - started, 3)
+            entry["collections"].append(stats)
+
+        entry["orphan_segments"] = [os.path.basename(p) for p in orphan_segment_dirs(persist_dir)]
+        if apply:
+            # El cliente mantiene abiertos los segmentos: se libera antes de tocar el disco
+            client.clear_system_cache()
+            del client
+            for path in orphan_segment_dirs(persist_dir):
+                shutil.rmtree(path)
+            vacuum(persist_dir)
+        entry["size_after"] = dir_size(persist_dir)
+        report.append(entry)
+
+    return report
+
+
+def print_report(report, apply):
+    for entry in report:
+        print(f"\n{entry['path']}  ({entry['size_before'] / 1e6:.2f} MB"
+              + (f" -> {entry['size_after'] / 1e6:.2f} MB)" if apply else ")"))
+        print(f"  {'colección':<16}{'vectores':>10}{'únicos':>9}{'duplic.':>9}{'huérf.':>8}{'ids antiguos':>14}")
+        for c in entry["collections"]:
+            print(f"  {c['name']:<16}{c['vectors']:>10}{c['unique']:>9}{c['duplicates']:>9}"
+                  f"{c['orphans']:>8}{c['legacy_ids']:>14}" + ("  reconstruida" if c.get("rebuilt") else ""))
+        if entry["orphan_segments"]:
+            action = "borrados" if apply else "huérfanos"
+            print(f"  segmentos {action}: {', '.join(entry['orphan_segments'])}")
+
+    if not apply:
+        print("\nSolo informe. Usa --apply para limpiar, reconstruir y compactar.")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mantenimiento de las colecciones Chroma de store/.")
+    parser.add_argument("--store", help="Directorio del store (por defecto, RAG_STORE_DIR o store/)")
+    parser.add_argument("--apply", action="store_true",
+                        help="Eliminar duplicados y huérfanas, reconstruir HNSW y hacer VACUUM")
+    parser.add_argument("--data", default=os.path.join(BASE_DIR, "data"),
+                        help="Corpus actual: las entradas que no salen de él se consideran huérfanas")
+    parser.add_argument("--output", help="Ruta del informe JSON")
+    args = parser.parse_args()
+
+    report = maintain(store_dir=args.store, apply=args.apply, data_dir=args.data)
+    print_report(report, args.apply)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"Informe guardado en {args.output}")
+
+
+if __name__ == "__main__":
+    main()
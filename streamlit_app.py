@@ -1,11 +1,14 @@
+import logging
+import threading
+import time
+
 import streamlit as st
-from langchain_community.chat_message_histories import StreamlitChatMessageHistory
-from langchain_community.embeddings import OpenAIEmbeddings
 
-from local_loader import load_txt_files
-from filter import create_retriever   # 🔥 Nuevo retriever híbrido con documentos core
-from rag_chain import make_rag_chain  # 🔥 Nuevo RAG maestro (contexto estructurado + reglas duras)
-from basic_chain import get_model      # 🔥 Modelo base que respeta identidad y normas
+from tracing import trace_request, tracing_config
+
+# LangChain, OpenAI, sentence-transformers y Chroma se importan dentro de
+# las funciones que los usan (en el hilo de precarga): la página se pinta
+# sin esperar a que carguen.
 
 
 # --------------------------------------------------------------
@@ -20,7 +23,7 @@ st.title("Chat RAG en Español – Públicos Objetivo")
 # INTERFAZ DE CHAT
 # --------------------------------------------------------------
 
-def show_ui(chain, prompt_to_user="¿En qué puedo ayudarte? Puedes pedirme que genere mensajes adaptados a tu público objetivo."):
+def show_ui(chain, prompt_to_user="¿En qué puedo ayudarte? Puedes pedirme que genere mensajes adaptados a tu público objetivo.", fallback=False):
 
     # Inicializa historial si no existe
     if "messages" not in st.session_state.keys():
@@ -41,12 +44,17 @@ def show_ui(chain, prompt_to_user="¿En qué puedo ayudarte? Puedes pedirme que
     if st.session_state.messages[-1]["role"] != "assistant":
         with st.chat_message("assistant"):
             with st.spinner("Generando respuesta..."):
-                response = chain.invoke(prompt)
+                with trace_request("turn"):
+                    response = chain.invoke(prompt, config=tracing_config())
 
                 # extraer texto del objeto devuelto
                 text = response.content if hasattr(response, "content") else str(response)
 
                 st.markdown(text)
+                if fallback:
+                    st.caption("Respuesta sin documentos: el índice todavía se está cargando.")
+                elif degraded(response):
+                    st.caption("Respuesta degradada: la búsqueda o el modelo no respondieron a tiempo.")
                 st.session_state.messages.append({"role": "assistant", "content": text})
 
 
@@ -55,41 +63,110 @@ def show_ui(chain, prompt_to_user="¿En qué puedo ayudarte? Puedes pedirme que
 # RETRIEVER – Con vectorización y documentos CORE
 # --------------------------------------------------------------
 
-@st.cache_resource
-def get_retriever(openai_api_key=None):
+def get_retriever():
+    from local_loader import load_txt_files
+    from filter import create_retriever   # 🔥 Nuevo retriever híbrido con documentos core
+    from retrieval_cache import RetrievalCache
+
     docs = load_txt_files()  # Carga los Document()
-    
-    # Creamos embeddings SOLO para vectorización dentro de create_vector_db
-    # Este embeddings no se usa directamente aquí.
-    embeddings = OpenAIEmbeddings(
-        openai_api_key=openai_api_key,
-        model="text-embedding-3-small"
-    )
-
-    # Usamos tu retriever híbrido mejorado
-    retriever = create_retriever(docs)
+
+    # Usamos tu retriever híbrido mejorado, con caché persistente de resultados
+    cache = RetrievalCache(persist_path="store/retrieval_cache.json")
+    with trace_request("index"):
+        retriever = create_retriever(docs, cache=cache)
     return retriever
 
 
+# --------------------------------------------------------------
+# PRECARGA EN SEGUNDO PLANO
+# --------------------------------------------------------------
+
+class Warmup:
+    """
+    Carga en un hilo, en cuanto arranca el servidor, el proveedor del modelo
+    y después el retriever (modelos de embeddings e índice). Mientras no
+    termina, las preguntas se responden con la cadena básica, sin RAG.
+    """
+
+    def __init__(self):
+        self.retriever = None
+        self.error = None
+        self.stage = "modelo"
+        self.seconds = None
+        self._started = time.perf_counter()
+        threading.Thread(target=self._run, name="rag-warmup", daemon=True).start()
+
+    def _run(self):
+        try:
+            # Primero lo que necesita la cadena de respaldo
+            import basic_chain
+            from langchain_openai import ChatOpenAI
+
+            self.stage = "índice"
+            self.retriever = get_retriever()
+
+            import rag_chain
+            self.stage = "lista"
+        except Exception as e:
+            logging.exception("Fallo en la precarga del retriever")
+            self.error = e
+        finally:
+            self.seconds = round(time.perf_counter() - self._started, 1)
+
+    @property
+    def ready(self):
+        return self.retriever is not None
+
+
+@st.cache_resource
+def start_warmup():
+    return Warmup()
+
+
 # --------------------------------------------------------------
 # CONSTRUCCIÓN DE LA CADENA COMPLETA (RAG + memoria)
 # --------------------------------------------------------------
 
-def get_chain(openai_api_key=None):
+@st.cache_resource
+def get_executor():
+    """Ejecutor con plazos compartido por todas las sesiones (umbral de cobertura común)."""
+    from slo import DeadlineExecutor
+    return DeadlineExecutor()
+
+
+def degraded(response):
+    from slo import is_degraded
+    return is_degraded(response)
 
-    retriever = get_retriever(openai_api_key=openai_api_key)
+
+def get_chain(retriever, openai_api_key=None):
+    from langchain_community.chat_message_histories import StreamlitChatMessageHistory
+    from rag_chain import make_rag_chain  # 🔥 Nuevo RAG maestro (contexto estructurado + reglas duras)
+    from basic_chain import get_model      # 🔥 Modelo base que respeta identidad y normas
+    import slo
 
     model = get_model(openai_api_key=openai_api_key)
 
     # Chat memory para conservar el hilo conversacional
     memory = StreamlitChatMessageHistory(key="langchain_messages")
 
-    # Tu cadena final: RAG maestro → modelo
+    # Tu cadena final: RAG maestro → modelo (con plazos y degradación, salvo RAG_SLO=0)
+    if slo.enabled():
+        return slo.SLORagChain(model, retriever, get_executor())
     chain = make_rag_chain(model, retriever)
 
     return chain
 
 
+def get_fallback_chain(openai_api_key=None):
+    """Cadena básica (identidad y normas, sin documentos) mientras se carga el índice."""
+    from langchain_core.runnables import RunnableLambda
+    from basic_chain import basic_chain, get_model
+
+    model = get_model(openai_api_key=openai_api_key)
+    return RunnableLambda(lambda question: {"input": question}) | basic_chain(model)
+
+
 # --------------------------------------------------------------
 # GESTIÓN DE SECRETS Y API KEYS
 # --------------------------------------------------------------
@@ -119,9 +196,25 @@ def get_secret_or_input(secret_key, secret_name, info_link=None):
 # EJECUCIÓN PRINCIPAL
 # --------------------------------------------------------------
 
+def show_warmup_status(warmup):
+    if warmup.error is not None:
+        st.error(f"No se pudo cargar el índice: {warmup.error}")
+        # El Warmup fallido queda en cache_resource: se descarta y se lanza otro
+        if st.button("Reintentar"):
+            start_warmup.clear()
+            st.rerun()
+    elif warmup.ready:
+        st.caption(f"Índice listo ({warmup.seconds} s)")
+    else:
+        st.caption(f"Cargando {warmup.stage}… mientras tanto, respuestas sin documentos.")
+
+
 def run():
     ready = True
 
+    # Arranca la precarga antes de pintar nada
+    warmup = start_warmup()
+
     openai_api_key = st.session_state.get("OPENAI_API_KEY")
 
     with st.sidebar:
@@ -131,15 +224,19 @@ def run():
                 "OpenAI API key",
                 info_link="https://platform.openai.com/account/api-keys"
             )
+        show_warmup_status(warmup)
 
     if not openai_api_key:
         st.warning("Falta OPENAI_API_KEY")
         ready = False
 
     if ready:
-        chain = get_chain(openai_api_key=openai_api_key)
+        if warmup.ready:
+            chain = get_chain(warmup.retriever, openai_api_key=openai_api_key)
+        else:
+            chain = get_fallback_chain(openai_api_key=openai_api_key)
         st.subheader("Haz preguntas o pide que genere mensajes adaptados a tu público objetivo.")
-        show_ui(chain, "¿Qué mensaje quieres generar o qué deseas saber sobre tu público?")
+        show_ui(chain, "¿Qué mensaje quieres generar o qué deseas saber sobre tu público?", fallback=not warmup.ready)
     else:
         st.stop()
 
@@ -0,0 +1,286 @@
+import contextvars
+import json
+import math
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+
+# ============================================================
+# TRAZAS POR PETICIÓN
+# ============================================================
+#
+# Cada turno (o cada construcción del índice) abre una traza; dentro de
+# ella, `span(...)` cronometra las etapas del código propio (búsquedas,
+# caché, reordenación...) y `TracingCallbackHandler` las de LangChain
+# (prompt, modelo, retriever), con los tokens del modelo. Fuera de una
+# traza, `span` no hace nada.
+
+TRACE_BUFFER = int(os.environ.get("RAG_TRACE_BUFFER", 2000))
+
+_current = contextvars.ContextVar("rag_trace", default=None)
+
+
+class Trace:
+    def __init__(self, name, **attrs):
+        self.id = uuid.uuid4().hex[:12]
+        self.name = name
+        self.attrs = attrs
+        self.started = time.time()
+        self.duration_ms = None
+        self.spans = []
+        self._t0 = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def add_span(self, name, start, duration, **attrs):
+        span = {
+            "name": name,
+            "start_ms": round((start - self._t0) * 1000, 3),
+            "duration_ms": round(duration * 1000, 3),
+            **{k: v for k, v in attrs.items() if v is not None},
+        }
+        with self._lock:
+            self.spans.append(span)
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def finish(self):
+        self.duration_ms = round((time.perf_counter() - self._t0) * 1000, 3)
+
+    def to_dict(self):
+        with self._lock:
+            spans = sorted(self.spans, key=lambda s: s["start_ms"])
+        cache = [s["hit"] for s in spans if s["name"] == "cache" and "hit" in s]
+        return {
+            "id": self.id,
+            "name": self.name,
+            "started": self.started,
+            "duration_ms": self.duration_ms,
+            "prompt_tokens": sum(s.get("prompt_tokens", 0) for s in spans),
+            "completion_tokens": sum(s.get("completion_tokens", 0) for s in spans),
+            "cache_hits": sum(cache),
+            "cache_misses": len(cache) - sum(cache),
+            **self.attrs,
+            "spans": spans,
+        }
+
+
+def _pct(values, p):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[max(1, math.ceil(p / 100 * len(ordered))) - 1]
+
+
+class Tracer:
+    """
+    Búfer circular en memoria con las últimas `max_traces` trazas. Con
+    `export_path` (o `RAG_TRACE_FILE`) cada traza terminada se añade
+    además a un JSONL.
+    """
+
+    def __init__(self, max_traces=TRACE_BUFFER, export_path=None):
+        self.export_path = export_path
+        self._traces = deque(maxlen=max_traces)
+        self._lock = threading.Lock()
+
+    def record(self, trace):
+        data = trace.to_dict()
+        with self._lock:
+            self._traces.append(data)
+            if self.export_path:
+                with open(self.export_path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(data, ensure_ascii=False) + "\n")
+
+    def traces(self, name=None, last=None):
+        with self._lock:
+            traces = [t for t in self._traces if name is None or t["name"] == name]
+        return traces[-last:] if last else traces
+
+    def clear(self):
+        with self._lock:
+            self._traces.clear()
+
+    def export_jsonl(self, path=None):
+        """Vuelca el búfer a `path`; sin ruta, devuelve el texto JSONL."""
+        text = "".join(json.dumps(t, ensure_ascii=False) + "\n" for t in self.traces())
+        if path is None:
+            return text
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(text)
+        return path
+
+    def stage_stats(self, name="turn", last=None):
+        """p50/p95 por etapa (y del total de la petición) sobre las últimas trazas."""
+        traces = self.traces(name, last)
+        stages = {}
+        for t in traces:
+            totals = {}
+            for s in t["spans"]:
+                totals[s["name"]] = totals.get(s["name"], 0.0) + s["duration_ms"]
+            for stage, ms in totals.items():
+                stages.setdefault(stage, []).append(ms)
+            stages.setdefault("total", []).append(t["duration_ms"] or 0.0)
+
+        return {
+            stage: {
+                "count": len(values),
+                "p50_ms": round(_pct(values, 50), 3),
+                "p95_ms": round(_pct(values, 95), 3),
+                "mean_ms": round(sum(values) / len(values), 3),
+            }
+            for stage, values in stages.items()
+        }
+
+
+TRACER = Tracer(export_path=os.environ.get("RAG_TRACE_FILE"))
+
+
+def current_trace():
+    return _current.get()
+
+
+@contextmanager
+def trace_request(name="turn", tracer=None, **attrs):
+    """Abre la traza de una petición; las anidadas se suman a la exterior."""
+    trace = _current.get()
+    if trace is not None:
+        yield trace
+        return
+
+    trace = Trace(name, **attrs)
+    token = _current.set(trace)
+    try:
+        yield trace
+    except BaseException as e:
+        trace.set(error=repr(e))
+        raise
+    finally:
+        try:
+            _current.reset(token)
+        except ValueError:
+            pass  # generador async cerrado desde otro contexto
+        trace.finish()
+        (tracer or TRACER).record(trace)
+
+
+@contextmanager
+def span(name, **attrs):
+    """
+    Cronometra una etapa de la traza activa. Devuelve un dict en el que se
+    pueden añadir atributos (p. ej. `s["hit"] = True`).
+    """
+    trace = _current.get()
+    if trace is None:
+        yield attrs
+        return
+
+    start = time.perf_counter()
+    try:
+        yield attrs
+    finally:
+        trace.add_span(name, start, time.perf_counter() - start, **attrs)
+
+
+async def timed(name, awaitable, **attrs):
+    """`span` para una corrutina lanzada con asyncio.gather."""
+    with span(name, **attrs):
+        return await awaitable
+
+
+# ============================================================
+# CALLBACKS DE LANGCHAIN
+# ============================================================
+
+# Runnables propios con nombre de etapa
+CHAIN_STAGES = {"format_docs": "context"}
+
+
+def token_usage(response):
+    """Tokens de entrada y salida de un LLMResult (OpenAI o usage_metadata)."""
+    usage = (response.llm_output or {}).get("token_usage") or {}
+    if usage:
+        return {"prompt_tokens": usage.get("prompt_tokens"), "completion_tokens": usage.get("completion_tokens")}
+    for generations in response.generations:
+        for generation in generations:
+            metadata = getattr(getattr(generation, "message", None), "usage_metadata", None)
+            if metadata:
+                return {"prompt_tokens": metadata.get("input_tokens"), "completion_tokens": metadata.get("output_tokens")}
+    return {}
+
+
+class TracingCallbackHandler(BaseCallbackHandler):
+    """Spans de prompt, modelo (con tokens y primer token) y retriever en la traza dada."""
+
+    run_inline = True  # barato y thread-safe: sin saltar al executor en async
+
+    def __init__(self, trace):
+        self.trace = trace
+        self._runs = {}
+
+    def _start(self, run_id, stage):
+        self._runs[run_id] = [stage, time.perf_counter(), None]
+
+    def _end(self, run_id, **attrs):
+        run = self._runs.pop(run_id, None)
+        if run is None:
+            return
+        stage, start, first_token = run
+        if first_token is not None:
+            attrs["first_token_ms"] = round((first_token - start) * 1000, 3)
+        self.trace.add_span(stage, start, time.perf_counter() - start, **attrs)
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+        self._start(run_id, "llm")
+
+    def on_llm_start(self, serialized, prompts, *, run_id, **kwargs):
+        self._start(run_id, "llm")
+
+    def on_llm_new_token(self, token, *, run_id, **kwargs):
+        run = self._runs.get(run_id)
+        if run is not None and run[2] is None:
+            run[2] = time.perf_counter()
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        self._end(run_id, **token_usage(response))
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self._end(run_id, error=repr(error))
+
+    def on_chain_start(self, serialized, inputs, *, run_id, **kwargs):
+        if kwargs.get("run_type") == "prompt":
+            self._start(run_id, "prompt")
+        elif kwargs.get("name") in CHAIN_STAGES:
+            self._start(run_id, CHAIN_STAGES[kwargs["name"]])
+
+    def on_chain_end(self, outputs, *, run_id, **kwargs):
+        self._end(run_id)
+
+    def on_chain_error(self, error, *, run_id, **kwargs):
+        self._end(run_id, error=repr(error))
+
+    def on_retriever_start(self, serialized, query, *, run_id, **kwargs):
+        # Las búsquedas internas del retriever híbrido ya tienen sus propios spans
+        if not any(run[0] == "retriever" for run in self._runs.values()):
+            self._start(run_id, "retriever")
+
+    def on_retriever_end(self, documents, *, run_id, **kwargs):
+        self._end(run_id, docs=len(documents))
+
+    def on_retriever_error(self, error, *, run_id, **kwargs):
+        self._end(run_id, error=repr(error))
+
+
+def tracing_config(config=None):
+    """`config` de LangChain con el handler de la traza activa (si la hay)."""
+    config = dict(config or {})
+    trace = _current.get()
+    if trace is not None:
+        config["callbacks"] = list(config.get("callbacks") or []) + [TracingCallbackHandler(trace)]
+    return config
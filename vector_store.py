@@ -1,32 +1,148 @@
+import asyncio
+import contextvars
+import hashlib
 import logging
 import os
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
 from typing import List
 from time import sleep
 
-from langchain_openai import OpenAIEmbeddings
-from langchain_community.vectorstores import Chroma
-
-from splitter import split_documents
+from splitter import chunk_id, split_documents
 from dotenv import load_dotenv
 from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.runnables.config import run_in_executor
+
+from tracing import span
 
 EMBED_DELAY = 0.02  # reduce CPU usage during embedding
 
 
-class EmbeddingProxy:
+def get_store_dir():
+    """Directorio de las colecciones; `RAG_STORE_DIR` permite aislar benchmarks y pruebas."""
+    return os.environ.get("RAG_STORE_DIR", "store")
+
+
+# ============================================================
+# CONTEXTO DE EMBEDDINGS POR PETICIÓN
+# ============================================================
+
+_query_vectors = contextvars.ContextVar("query_vectors", default=None)
+
+
+@contextmanager
+def embedding_context():
+    """
+    Ámbito de una petición: dentro de él, cada modelo embebe la pregunta una
+    sola vez y todos los consumidores (búsqueda vectorial, filtros, cachés)
+    reciben el mismo vector. Los ámbitos anidados reutilizan el exterior.
+    """
+    if _query_vectors.get() is not None:
+        yield
+        return
+
+    token = _query_vectors.set({})
+    try:
+        yield
+    finally:
+        _query_vectors.reset(token)
+
+
+def _text_key(text):
+    return hashlib.sha1(text.encode("utf-8")).digest()
+
+
+class EmbeddingProxy(Embeddings):
     """
     Pequeño wrapper para reducir uso de CPU al generar embeddings.
+
+    - Las preguntas se embeben una vez por petición (ver `embedding_context`).
+    - Los vectores de documentos se memorizan (LRU), así los chunks ya
+      indexados no se recalculan en cada filtrado de redundancia.
     """
-    def __init__(self, embedding):
+    def __init__(self, embedding, max_cached_documents=8192):
         self.embedding = embedding
+        self.max_cached_documents = max_cached_documents
+        self._doc_vectors = OrderedDict()
+        self._lock = threading.Lock()
 
-    def embed_documents(self, texts: List[str]) -> List[List[float]]:
-        sleep(EMBED_DELAY)
-        return self.embedding.embed_documents(texts)
+    # ---- vectores de pregunta compartidos en la petición ----
+
+    def _query_slot(self, text):
+        vectors = _query_vectors.get()
+        if vectors is None:
+            return None, None
+        return vectors, (id(self.embedding), text)
 
     def embed_query(self, text: str) -> List[float]:
-        sleep(EMBED_DELAY)
-        return self.embedding.embed_query(text)
+        vectors, key = self._query_slot(text)
+        if vectors is not None and key in vectors:
+            return vectors[key]
+
+        with span("embed_query"):
+            sleep(EMBED_DELAY)
+            vector = self.embedding.embed_query(text)
+        if vectors is not None:
+            vectors[key] = vector
+        return vector
+
+    async def aembed_query(self, text: str) -> List[float]:
+        vectors, key = self._query_slot(text)
+        if vectors is not None and key in vectors:
+            return vectors[key]
+
+        with span("embed_query"):
+            await asyncio.sleep(EMBED_DELAY)
+            vector = await self.embedding.aembed_query(text)
+        if vectors is not None:
+            vectors[key] = vector
+        return vector
+
+    # ---- vectores de documentos memorizados ----
+
+    def _split_cached(self, texts):
+        keys = [_text_key(t) for t in texts]
+        with self._lock:
+            found = {}
+            for k in keys:
+                if k in self._doc_vectors:
+                    self._doc_vectors.move_to_end(k)
+                    found[k] = self._doc_vectors[k]
+        missing = [i for i, k in enumerate(keys) if k not in found]
+        return keys, found, missing
+
+    def _remember(self, keys, found, missing, vectors):
+        with self._lock:
+            for i, vector in zip(missing, vectors):
+                found[keys[i]] = vector
+                self._doc_vectors[keys[i]] = vector
+            while len(self._doc_vectors) > self.max_cached_documents:
+                self._doc_vectors.popitem(last=False)
+        return [found[k] for k in keys]
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        keys, found, missing = self._split_cached(texts)
+        vectors = []
+        if missing:
+            sleep(EMBED_DELAY)
+            vectors = self.embedding.embed_documents([texts[i] for i in missing])
+        return self._remember(keys, found, missing, vectors)
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        keys, found, missing = self._split_cached(texts)
+        vectors = []
+        if missing:
+            await asyncio.sleep(EMBED_DELAY)
+            vectors = await self.embedding.aembed_documents([texts[i] for i in missing])
+        return self._remember(keys, found, missing, vectors)
+
+
+def load_openai_embeddings(openai_api_key):
+    """Embeddings de OpenAI (punto único para poder sustituirlos en benchmarks)."""
+    from langchain_openai import OpenAIEmbeddings
+    return OpenAIEmbeddings(openai_api_key=openai_api_key, model="text-embedding-3-small")
 
 
 def create_vector_db(texts, embeddings=None, collection_name="chroma"):
@@ -44,17 +160,17 @@ def create_vector_db(texts, embeddings=None, collection_name="chroma"):
         if not openai_api_key:
             raise ValueError("Falta OPENAI_API_KEY para crear embeddings.")
 
-        embeddings = OpenAIEmbeddings(
-            openai_api_key=openai_api_key,
-            model="text-embedding-3-small"
-        )
+        embeddings = load_openai_embeddings(openai_api_key=openai_api_key)
+
+    # langchain_community y chromadb solo se cargan al crear la primera colección
+    from langchain_community.vectorstores import Chroma
 
     proxy_embeddings = EmbeddingProxy(embeddings)
 
     db = Chroma(
         collection_name=collection_name,
         embedding_function=proxy_embeddings,
-        persist_directory=os.path.join("store/", collection_name)
+        persist_directory=os.path.join(get_store_dir(), collection_name)
     )
 
     # Normalizar: convertir strings a Document()
@@ -65,10 +181,38 @@ def create_vector_db(texts, embeddings=None, collection_name="chroma"):
         else:
             docs.append(t)
 
-    db.add_documents(docs)
+    with span("index", collection=collection_name, chunks=len(docs)):
+        add_missing_documents(db, docs)
     return db
 
 
+def add_missing_documents(db, docs):
+    """
+    Indexa los documentos con su chunk_id como id: los que ya están en la
+    colección no se vuelven a embeber ni a insertar (arranques repetidos no
+    la hacen crecer) y solo se actualizan si han cambiado sus metadatos.
+    """
+    by_id = {}
+    for d in docs:
+        by_id.setdefault(chunk_id(d), d)
+    if not by_id:
+        return
+
+    ids = list(by_id)
+    existing = db.get(ids=ids, include=["metadatas"])
+    stored = dict(zip(existing["ids"], existing["metadatas"]))
+
+    changed = [i for i in stored if (stored[i] or {}) != by_id[i].metadata]
+    if changed:
+        # API pública de Chroma: vuelve a embeber esos chunks (pocos: solo
+        # cambian anotaciones como categoría o duplicados)
+        db.update_documents(changed, [by_id[i] for i in changed])
+
+    missing = [i for i in ids if i not in stored]
+    if missing:
+        db.add_documents([by_id[i] for i in missing], ids=missing)
+
+
 def find_similar(vs, query: str):
     """
     Búsqueda simple para debugging o inspección del vector store.
@@ -76,6 +220,16 @@ def find_similar(vs, query: str):
     return vs.similarity_search(query)
 
 
+async def asearch_by_vector(vs, query: str, k: int = 4, filter=None):
+    """
+    Búsqueda asíncrona: el embedding de la pregunta usa la API async del
+    modelo y la consulta a Chroma se ejecuta fuera del event loop.
+    `filter` restringe la búsqueda por metadatos (p. ej. {"category": ...}).
+    """
+    embedding = await vs.embeddings.aembed_query(query)
+    return await run_in_executor(None, vs.similarity_search_by_vector, embedding, k, filter)
+
+
 def main():
     load_dotenv()
     print("El módulo vector_store está listo. Se usa automáticamente en el chatbot RAG.")